@@ -1,4 +1,97 @@
-import re
+import re, os, time, hashlib
+import pandas as pd
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from tqdm import tqdm
+from data_io import MESSAGE_SCHEMA, FrameReader, FrameWriter, KeyValueCache, read_table, write_table
+
+# the ranges of emojis that are removed from the text
+_EMOJI_CHARACTERS = (
+    "\U0001F600-\U0001F64F"  # emoticons
+    "\U0001F300-\U0001F5FF"  # symbols & pictographs
+    "\U0001F680-\U0001F6FF"  # transport & map symbols
+    "\U0001F700-\U0001F77F"  # alchemical symbols
+    "\U0001F780-\U0001F7FF"  # Geometric Shapes Extended
+    "\U0001F800-\U0001F8FF"  # Supplemental Arrows-C
+    "\U0001F900-\U0001F9FF"  # Supplemental Symbols and Pictographs
+    "\U0001FA00-\U0001FA6F"  # Chess Symbols
+    "\U0001FA70-\U0001FAFF"  # Symbols and Pictographs Extended-A
+    "\U00002702-\U000027B0"  # Dingbats
+    "\U000024C2-\U0001F251" 
+)
+
+# the punctuations that are removed from the text, this includes amharic punctuations like ፤, ። and ፣
+_SPECIAL_CHARACTERS = r'\!\@\#\$\%\^\«\»\&\*\(\)\…\[\]\{\}\;\“\”\›\’\‘\"\'\:\,\.\‹\/\<\>\?\\\\|\`\´\~\-\=\+\፡\።\፤\;\፦\፥\፧\፨\፠\፣'
+
+# the patterns used by the preprocessing stages, compiled once at import time
+_EMOJI_PATTERN = re.compile(f"[{_EMOJI_CHARACTERS}]+", flags=re.UNICODE)
+_SPECIAL_CHARACTERS_PATTERN = re.compile(f"[{_SPECIAL_CHARACTERS}]")
+_EXTRA_SPACE_PATTERN = re.compile(r'\s+')
+_NEWLINE_PATTERN = re.compile('\n')
+
+# removing emojis and then punctuations is the same as removing both in a single pass, used by the batch pipeline
+_STRIP_PATTERN = re.compile(f"[{_EMOJI_CHARACTERS}{_SPECIAL_CHARACTERS}]+", flags=re.UNICODE)
+
+# groups of 'Fidels' that have the same sound and the standard 'Fidel' they are replaced with
+_FIDEL_FOLDS = (
+    ('ሃኅኃሐሓኻ', 'ሀ'),
+    ('ሑኁዅ', 'ሁ'),
+    ('ኂሒኺ', 'ሂ'),
+    ('ኌሔዄ', 'ሄ'),
+    ('ሕ', 'ህ'),
+    ('ኆሖኾ', 'ሆ'),
+    ('ሠ', 'ሰ'),
+    ('ሡ', 'ሱ'),
+    ('ሢ', 'ሲ'),
+    ('ሣ', 'ሳ'),
+    ('ሤ', 'ሴ'),
+    ('ሥ', 'ስ'),
+    ('ሦ', 'ሶ'),
+    ('ዓኣዐ', 'አ'),
+    ('ዑ', 'ኡ'),
+    ('ዒ', 'ኢ'),
+    ('ዔ', 'ኤ'),
+    ('ዕ', 'እ'),
+    ('ዖ', 'ኦ'),
+    ('ጸ', 'ፀ'),
+    ('ጹ', 'ፁ'),
+    ('ጺ', 'ፂ'),
+    ('ጻ', 'ፃ'),
+    ('ጼ', 'ፄ'),
+    ('ጽ', 'ፅ'),
+    ('ጾ', 'ፆ'),
+)
+
+# a translation table that applies all of the single 'Fidel' folds in one pass
+_FIDEL_TRANSLATION = str.maketrans({source: target for sources, target in _FIDEL_FOLDS for source in sources})
+
+# the labialized 'Fidel' each character is merged into when it is followed by ዋ or አ
+_LABIALIZED_FIDELS = {
+    'ሉ': 'ሏ', 'ሙ': 'ሟ', 'ቱ': 'ቷ', 'ሩ': 'ሯ', 'ሱ': 'ሷ',
+    'ሹ': 'ሿ', 'ቁ': 'ቋ', 'ቡ': 'ቧ', 'ቹ': 'ቿ', 'ሁ': 'ኋ',
+    'ኑ': 'ኗ', 'ኙ': 'ኟ', 'ኩ': 'ኳ', 'ዙ': 'ዟ', 'ጉ': 'ጓ',
+    'ደ': 'ዷ', 'ጡ': 'ጧ', 'ጩ': 'ጯ', 'ጹ': 'ጿ', 'ፉ': 'ፏ',
+}
+
+# a lookup of every rewrite done after the folds, ቁ and ኩ can also be written as ቊ and ኵ
+_LABIALIZED_REWRITES = {
+    **{base + suffix: target for base, target in _LABIALIZED_FIDELS.items() for suffix in 'ዋአ'},
+    'ቊ': 'ቁ',
+    'ኵ': 'ኩ',
+}
+
+# a single compiled alternation that matches every key of the rewrite lookup
+_LABIALIZED_PATTERN = re.compile('|'.join(map(re.escape, _LABIALIZED_REWRITES)))
+
+# the version of the cleaning steps, bump it when Preprocessor.preprocess_text or preprocess_series change
+CLEANER_VERSION = 1
+
+# the cache keys are salted with the version and the rule tables, so a cache never serves text cleaned by older rules
+_CACHE_SALT = hashlib.blake2b(
+    repr((CLEANER_VERSION, _EMOJI_CHARACTERS, _SPECIAL_CHARACTERS, _FIDEL_FOLDS, sorted(_LABIALIZED_REWRITES.items()))).encode('utf-8'),
+    digest_size=32
+).digest()
 
 class Preprocessor:
     """
@@ -16,23 +109,7 @@ class Preprocessor:
             The string without any emojis
         """
         if type(text) != type(';'): print(text)
-        emoji_pattern = re.compile(
-            "[" 
-            "\U0001F600-\U0001F64F"  # emoticons
-            "\U0001F300-\U0001F5FF"  # symbols & pictographs
-            "\U0001F680-\U0001F6FF"  # transport & map symbols
-            "\U0001F700-\U0001F77F"  # alchemical symbols
-            "\U0001F780-\U0001F7FF"  # Geometric Shapes Extended
-            "\U0001F800-\U0001F8FF"  # Supplemental Arrows-C
-            "\U0001F900-\U0001F9FF"  # Supplemental Symbols and Pictographs
-            "\U0001FA00-\U0001FA6F"  # Chess Symbols
-            "\U0001FA70-\U0001FAFF"  # Symbols and Pictographs Extended-A
-            "\U00002702-\U000027B0"  # Dingbats
-            "\U000024C2-\U0001F251" 
-            "]+", 
-            flags=re.UNICODE
-        )
-        return emoji_pattern.sub(r'', text)
+        return _EMOJI_PATTERN.sub(r'', text)
 
     @staticmethod
     def remove_special_characters(text: str):
@@ -44,7 +121,7 @@ class Preprocessor:
         Returns:
             The text without punctuations
         """ 
-        normalized_text = re.sub('[\!\@\#\$\%\^\«\»\&\*\(\)\…\[\]\{\}\;\“\”\›\’\‘\"\'\:\,\.\‹\/\<\>\?\\\\|\`\´\~\-\=\+\፡\።\፤\;\፦\፥\፧\፨\፠\፣]', '',text) 
+        normalized_text = _SPECIAL_CHARACTERS_PATTERN.sub('', text)
         return normalized_text
     
     @staticmethod
@@ -58,57 +135,13 @@ class Preprocessor:
         Returns:
             The normalized string
         """
-        rep1=re.sub('[ሃኅኃሐሓኻ]','ሀ',text)
-        rep2=re.sub('[ሑኁዅ]','ሁ',rep1)
-        rep3=re.sub('[ኂሒኺ]','ሂ',rep2)
-        rep4=re.sub('[ኌሔዄ]','ሄ',rep3)
-        rep5=re.sub('[ሕኅ]','ህ',rep4)
-        rep6=re.sub('[ኆሖኾ]','ሆ',rep5)
-        rep7=re.sub('[ሠ]','ሰ',rep6)
-        rep8=re.sub('[ሡ]','ሱ',rep7)
-        rep9=re.sub('[ሢ]','ሲ',rep8)
-        rep10=re.sub('[ሣ]','ሳ',rep9)
-        rep11=re.sub('[ሤ]','ሴ',rep10)
-        rep12=re.sub('[ሥ]','ስ',rep11)
-        rep13=re.sub('[ሦ]','ሶ',rep12)
-        rep14=re.sub('[ዓኣዐ]','አ',rep13)
-        rep15=re.sub('[ዑ]','ኡ',rep14)
-        rep16=re.sub('[ዒ]','ኢ',rep15)
-        rep17=re.sub('[ዔ]','ኤ',rep16)
-        rep18=re.sub('[ዕ]','እ',rep17)
-        rep19=re.sub('[ዖ]','ኦ',rep18)
-        rep20=re.sub('[ጸ]','ፀ',rep19)
-        rep21=re.sub('[ጹ]','ፁ',rep20)
-        rep22=re.sub('[ጺ]','ፂ',rep21)
-        rep23=re.sub('[ጻ]','ፃ',rep22)
-        rep24=re.sub('[ጼ]','ፄ',rep23)
-        rep25=re.sub('[ጽ]','ፅ',rep24)
-        rep26=re.sub('[ጾ]','ፆ',rep25)
-        #Normalizing words with Labialized Amharic characters such as በልቱዋል or  በልቱአል to  በልቷል  
-        rep27=re.sub('(ሉ[ዋአ])','ሏ',rep26)
-        rep28=re.sub('(ሙ[ዋአ])','ሟ',rep27)
-        rep29=re.sub('(ቱ[ዋአ])','ቷ',rep28)
-        rep30=re.sub('(ሩ[ዋአ])','ሯ',rep29)
-        rep31=re.sub('(ሱ[ዋአ])','ሷ',rep30)
-        rep32=re.sub('(ሹ[ዋአ])','ሿ',rep31)
-        rep33=re.sub('(ቁ[ዋአ])','ቋ',rep32)
-        rep34=re.sub('(ቡ[ዋአ])','ቧ',rep33)
-        rep35=re.sub('(ቹ[ዋአ])','ቿ',rep34)
-        rep36=re.sub('(ሁ[ዋአ])','ኋ',rep35)
-        rep37=re.sub('(ኑ[ዋአ])','ኗ',rep36)
-        rep38=re.sub('(ኙ[ዋአ])','ኟ',rep37)
-        rep39=re.sub('(ኩ[ዋአ])','ኳ',rep38)
-        rep40=re.sub('(ዙ[ዋአ])','ዟ',rep39)
-        rep41=re.sub('(ጉ[ዋአ])','ጓ',rep40)
-        rep42=re.sub('(ደ[ዋአ])','ዷ',rep41)
-        rep43=re.sub('(ጡ[ዋአ])','ጧ',rep42)
-        rep44=re.sub('(ጩ[ዋአ])','ጯ',rep43)
-        rep45=re.sub('(ጹ[ዋአ])','ጿ',rep44)
-        rep46=re.sub('(ፉ[ዋአ])','ፏ',rep45)
-        rep47=re.sub('[ቊ]','ቁ',rep46) #ቁ can be written as ቊ
-        rep48=re.sub('[ኵ]','ኩ',rep47) #ኩ can be also written as ኵ  
-
-        return rep48
+        # 1) fold the single 'Fidels' that share a sound, this is done in one pass using a translation table
+        result = text.translate(_FIDEL_TRANSLATION)
+
+        # 2) normalize words with Labialized Amharic characters such as በልቱዋል or  በልቱአል to  በልቷል, also handles ቊ and ኵ
+        result = _LABIALIZED_PATTERN.sub(lambda match: _LABIALIZED_REWRITES[match.group(0)], result)
+
+        return result
     
     @staticmethod
     def remove_extra_space(text: str):
@@ -122,10 +155,10 @@ class Preprocessor:
         """
 
         # remove extra spaces
-        result = re.sub(pattern='\s+', repl=' ', string=text)
+        result = _EXTRA_SPACE_PATTERN.sub(' ', text)
 
         # remove newlines
-        result = re.sub(pattern='\n', repl=' ', string=result)
+        result = _NEWLINE_PATTERN.sub(' ', result)
 
         return result
     
@@ -153,20 +186,329 @@ class Preprocessor:
 
         return result
 
+    @staticmethod
+    def preprocess_series(series: pd.Series):
+        """
+        A method that runs the same pipeline as preprocess_text over a whole column at once, using vectorized string operations.
+
+        Args:
+            series(pd.Series): the column of strings we want to pass through the preprocessing pipeline
+        Returns:
+            A series with the preprocessed text, the index of the passed series is kept
+        """
+        # 1) & 2) remove the emojis and special characters found in the text
+        result = series.str.replace(_STRIP_PATTERN, '', regex=True)
+
+        # 3) normalize the text
+        result = result.str.translate(_FIDEL_TRANSLATION)
+        result = result.str.replace(_LABIALIZED_PATTERN, lambda match: _LABIALIZED_REWRITES[match.group(0)], regex=True)
+
+        # 4) remove extra space, the newlines are covered by the whitespace pattern
+        result = result.str.replace(_EXTRA_SPACE_PATTERN, ' ', regex=True)
+
+        return result
+
+    @staticmethod
+    def preprocess_parallel(series: pd.Series, workers: int, chunksize: int=10000):
+        """
+        A method that splits a column into chunks and runs preprocess_series on each of them using a pool of processes.
+
+        Args:
+            series(pd.Series): the column of strings we want to pass through the preprocessing pipeline
+            workers(int): the number of processes to run the pipeline on
+            chunksize(int): the number of rows sent to a process at a time
+        Returns:
+            result(pd.Series): the preprocessed text, in the same order and with the same index as the passed series
+            stats(dict): the number of rows and the seconds spent cleaning them, for every worker process id
+        """
+        # split the column into chunks of rows
+        chunks = [series.iloc[start:start + chunksize] for start in range(0, len(series), chunksize)]
+
+        results = []
+        stats = {}
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # executor.map yields the results in the order of the chunks, which keeps the output deterministic
+            for result, pid, seconds in executor.map(_preprocess_chunk, chunks):
+                results.append(result)
+                _record_worker_stats(stats=stats, pid=pid, rows=len(result), seconds=seconds)
+
+        if not results: return series.copy(), stats
+
+        return pd.concat(results), stats
+
+
+class PreprocessorCache(KeyValueCache):
+    """
+    A cache of preprocessed texts keyed by a hash of the raw text, so reposted messages are only cleaned once.
+    The texts are kept in a KeyValueCache, in the preprocessed table of the on-disk cache.
+
+    Attributes:
+        max_size(int): the maximum number of entries kept in memory
+        path(str): the path to the sqlite file of the on-disk cache, None if the cache is only kept in memory
+        hits(int): the number of texts that were served from the cache
+        misses(int): the number of texts that had to be preprocessed
+        group_stats(dict): the hits and misses for every group, e.g. for every channel
+    """
+
+    def __init__(self, max_size: int=100000, path: str=None):
+        """
+        Initializes the cache, creating the on-disk cache table if a path is given.
+
+        Args:
+            max_size(int): the maximum number of entries kept in memory
+            path(str): the path to the sqlite file of the on-disk cache
+        """
+        super().__init__(table='preprocessed', column='text', max_size=max_size, path=path)
+        self.hits = 0
+        self.misses = 0
+        self.group_stats = {}
+
+    @staticmethod
+    def hash_text(text: str):
+        """
+        A function that creates the cache key of a raw text, keyed by the version of the cleaning rules.
+
+        Args:
+            text(str): the raw text
+        Returns:
+            The hex digest of the text's hash
+        """
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16, key=_CACHE_SALT).hexdigest()
+
+    def __record(self, hits: pd.Series, groups: pd.Series=None):
+        """
+        Adds the hits and misses of a lookup to the totals and to the totals of every group.
+
+        Args:
+            hits(pd.Series): a boolean for every looked up text, True if it was served from the cache
+            groups(pd.Series): the group of every looked up text
+        """
+        hit_count = int(hits.sum())
+        self.hits += hit_count
+        self.misses += len(hits) - hit_count
+
+        if groups is None: return
+
+        for group, group_hits in hits.groupby(groups.values):
+            group_stats = self.group_stats.setdefault(group, {'hits': 0, 'misses': 0})
+            group_stats['hits'] += int(group_hits.sum())
+            group_stats['misses'] += len(group_hits) - int(group_hits.sum())
+
+    def preprocess_text(self, text: str, group: str=None):
+        """
+        A method that passes a text through Preprocessor.preprocess_text, unless it is already in the cache.
+
+        Args:
+            text(str): the string we want to pass through the preprocessing pipeline
+            group(str): the group the text belongs to, e.g. its channel, used for the hit and miss statistics
+        Returns:
+            The text which has been passed to the preprocessing pipeline
+        """
+        return self.preprocess_series(series=pd.Series([text], dtype=object), groups=None if group is None else pd.Series([group])).iloc[0]
+
+    def preprocess_series(self, series: pd.Series, groups: pd.Series=None, clean=Preprocessor.preprocess_series):
+        """
+        A method that preprocesses a column, only the texts that aren't in the cache are cleaned and every distinct text is cleaned once.
+
+        Args:
+            series(pd.Series): the column of strings we want to pass through the preprocessing pipeline
+            groups(pd.Series): the group of every text, e.g. its channel, used for the hit and miss statistics
+            clean(callable): the function used to preprocess the texts that missed the cache, takes and returns a pd.Series
+        Returns:
+            A series with the preprocessed text, the index of the passed series is kept
+        """
+        keys = series.map(self.hash_text)
+
+        # the first occurrence of a text that isn't cached is a miss, its repeats are served from the cache
+        first_occurrences = ~keys.duplicated()
+        found = self.get_many(keys=keys[first_occurrences].tolist())
+        misses = first_occurrences & ~keys.isin(list(found))
+
+        if misses.any():
+            cleaned = clean(pd.Series(series[misses].values, index=keys[misses].values, dtype=object))
+            cleaned = dict(zip(cleaned.index, cleaned.values))
+            self.put_many(entries=cleaned)
+            found.update(cleaned)
+
+        self.__record(hits=~misses, groups=groups)
+
+        return keys.map(found)
+
+
+
+def _preprocess_chunk(series: pd.Series):
+    """
+    A function that cleans a chunk of rows inside a worker process of Preprocessor.preprocess_parallel.
+
+    Args:
+        series(pd.Series): the chunk of rows to be preprocessed
+    Returns:
+        The preprocessed chunk, the id of the worker process and the seconds it took to clean the chunk
+    """
+    start = time.perf_counter()
+    result = Preprocessor.preprocess_series(series=series)
+    return result, os.getpid(), time.perf_counter() - start
+
+def _record_worker_stats(stats: dict, pid: int, rows: int, seconds: float):
+    """
+    A function that adds the rows cleaned by a worker process, and the time it took, to the running totals of that worker.
+
+    Args:
+        stats(dict): the running totals, keyed by the worker process id
+        pid(int): the id of the worker process
+        rows(int): the number of rows the worker cleaned
+        seconds(float): the seconds the worker spent cleaning the rows
+    """
+    worker_stats = stats.setdefault(pid, {'rows': 0, 'seconds': 0.0})
+    worker_stats['rows'] += rows
+    worker_stats['seconds'] += seconds
+
+def _clean_misses(series: pd.Series, executor: ProcessPoolExecutor, workers: int, stats: dict):
+    """
+    A function that preprocesses the texts that missed a PreprocessorCache, splitting them across the worker processes if there are any.
+
+    Args:
+        series(pd.Series): the texts that missed the cache
+        executor(ProcessPoolExecutor): the pool of worker processes, None to clean the texts in this process
+        workers(int): the number of worker processes in the pool
+        stats(dict): the running totals of rows and seconds for every worker, updated in place
+    Returns:
+        The preprocessed texts, in the same order and with the same index as the passed series
+    """
+    if executor is None:
+        chunks = [series]
+    else:
+        chunksize = -(-len(series) // workers)
+        chunks = [series.iloc[start:start + chunksize] for start in range(0, len(series), chunksize)]
+
+    results = []
+    for result, pid, seconds in (map if executor is None else executor.map)(_preprocess_chunk, chunks):
+        _record_worker_stats(stats=stats, pid=pid, rows=len(result), seconds=seconds)
+        results.append(result)
+
+    return pd.concat(results)
+
+def _preprocess_frames(frames, text_col: str, workers: int, stats: dict, cache: PreprocessorCache=None, group_col: str=None):
+    """
+    A generator that drops the empty rows of every frame and preprocesses its text column, keeping the order of the frames.
+    When more than one worker is used at most two frames per worker are in flight, so memory stays bounded.
+
+    Args:
+        frames(Iterable[pd.DataFrame]): the frames to be preprocessed, usually the chunks of a csv reader
+        text_col(str): the column of the frames that contains the amharic texts
+        workers(int): the number of processes to run the pipeline on
+        stats(dict): the running totals of rows and seconds for every worker, updated in place
+        cache(PreprocessorCache): a cache of preprocessed texts, when given only the texts that miss it are cleaned
+        group_col(str): the column of the frames the cache statistics are grouped by, e.g. the channel username
+    Yields:
+        The preprocessed frames
+    """
+    if cache is not None:
+        # the cache is looked up in this process, only the misses of every frame are sent to the workers
+        executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            clean = partial(_clean_misses, executor=executor, workers=workers, stats=stats)
+            for frame in frames:
+                frame = frame.dropna(subset=[text_col])
+                groups = frame[group_col] if group_col in frame else None
+                frame[text_col] = cache.preprocess_series(series=frame[text_col], groups=groups, clean=clean)
+                yield frame
+        finally:
+            if executor is not None: executor.shutdown()
+        return
+
+    if workers <= 1:
+        for frame in frames:
+            frame = frame.dropna(subset=[text_col])
+            result, pid, seconds = _preprocess_chunk(series=frame[text_col])
+            _record_worker_stats(stats=stats, pid=pid, rows=len(result), seconds=seconds)
+            frame[text_col] = result
+            yield frame
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for frame in frames:
+            frame = frame.dropna(subset=[text_col])
+            pending.append((frame, executor.submit(_preprocess_chunk, frame[text_col])))
+
+            # wait for the oldest frame once enough of them are in flight
+            while len(pending) >= workers * 2 or (pending and pending[0][1].done()):
+                yield _collect_frame(pending.popleft(), text_col=text_col, stats=stats)
+
+        while pending:
+            yield _collect_frame(pending.popleft(), text_col=text_col, stats=stats)
+
+def _collect_frame(pending_frame: tuple, text_col: str, stats: dict):
+    """
+    A function that waits for a frame submitted to a worker process and puts the preprocessed text back into it.
+
+    Args:
+        pending_frame(tuple): the frame and the future of its preprocessed text column
+        text_col(str): the column of the frame that contains the amharic texts
+        stats(dict): the running totals of rows and seconds for every worker, updated in place
+    Returns:
+        The preprocessed frame
+    """
+    frame, future = pending_frame
+    result, pid, seconds = future.result()
+    _record_worker_stats(stats=stats, pid=pid, rows=len(result), seconds=seconds)
+    frame[text_col] = result
+    return frame
+
+def preprocess_stream(path: str, out: str, text_col: str, chunksize: int=10000, workers: int=1, cache: PreprocessorCache=None, group_col: str=None):
+    """
+    A function that reads, cleans and appends a csv or parquet file to the output in fixed-size chunks, so memory does not grow with the size of the file.
+
+    Args:
+        path(str): the path to the csv or parquet file that contains the unprocessed data
+        out(str): the path to save the preprocessed data to, it is written as parquet if it ends with .parquet
+        text_col(str): the column of the file that contains the amharic texts
+        chunksize(int): the number of rows read, cleaned and written at a time
+        workers(int): the number of processes to run the pipeline on
+        cache(PreprocessorCache): a cache of preprocessed texts, when given only the texts that miss it are cleaned
+        group_col(str): the column of the file the cache statistics are grouped by, e.g. the channel username
+    Returns:
+        rows(int): the number of rows written to the output
+        stats(dict): the number of rows and the seconds spent cleaning them, for every worker process id
+    """
+    rows = 0
+    stats = {}
+
+    # the text column of a csv is read as strings, otherwise a chunk with only empty or numeric messages would not be text
+    reader = FrameReader(path=path, chunksize=chunksize, dtype={text_col: str})
+    with FrameWriter(path=out, schema=MESSAGE_SCHEMA) as writer:
+        with tqdm(total=reader.total, desc="Cleaning", unit=reader.unit, unit_scale=True) as progress:
+            for frame in _preprocess_frames(frames=reader, text_col=text_col, workers=workers, stats=stats, cache=cache, group_col=group_col):
+                writer.write(frame)
+                rows += len(frame)
+
+                progress.update(reader.position - progress.n)
+                progress.set_postfix_str(f"{rows} rows")
+
+    return rows, stats
+
 
 if __name__ == "__main__":
-    import argparse, os
-    import pandas as pd
+    import argparse
 
-    # define an argument for providing the path to the unprocessed Amharic data, expects it to be in csv format
+    # define an argument for providing the path to the unprocessed Amharic data, expects it to be in csv or parquet format
     parser = argparse.ArgumentParser(
         prog="Amharic Text Preprocessor",
-        description="Cleans and saves Amharic data presented to it in a csv file"
+        description="Cleans and saves Amharic data presented to it in a csv or parquet file"
     )
 
-    parser.add_argument("--path", default="./data/telegram_data.csv") # an argument for defining the path to the amharic text csv file
-    parser.add_argument("--out", default="./data/preprocessed.csv") # an argument for defining the path to save the preprocessed data
+    parser.add_argument("--path", default="./data/telegram_data.csv") # an argument for defining the path to the amharic text csv file, a .parquet file or a folder of parquet files
+    parser.add_argument("--out", default="./data/preprocessed.csv") # an argument for defining the path to save the preprocessed data, written as parquet if it ends with .parquet
     parser.add_argument("--text_col", default="message") # an argument for defining the column of the csv that contains the amharic texts
+    parser.add_argument("--row_wise", action="store_true") # an argument for running the pipeline one row at a time instead of over the whole column
+    parser.add_argument("--workers", type=int, default=1) # an argument for defining the number of processes the cleaning is split across
+    parser.add_argument("--chunksize", type=int, default=10000) # an argument for defining the number of rows sent to a worker process at a time
+    parser.add_argument("--stream", action="store_true") # an argument for reading, cleaning and writing the data in chunks of --chunksize rows
+    parser.add_argument("--cache", action="store_true") # an argument for only cleaning every distinct message once, repeats are served from a cache
+    parser.add_argument("--cache_size", type=int, default=100000) # an argument for defining the number of cleaned messages kept in memory
+    parser.add_argument("--cache_path", default=None) # an argument for defining a sqlite file that persists the cache between runs, implies --cache
+    parser.add_argument("--group_col", default="channel_username") # an argument for defining the column the cache statistics are reported by
 
     args = parser.parse_args()
 
@@ -174,17 +516,52 @@ if __name__ == "__main__":
     path = args.path
     out = args.out
     text_col = args.text_col
+    row_wise = args.row_wise
+    workers = args.workers
+    chunksize = args.chunksize
+    stream = args.stream
+    group_col = args.group_col
+    stats = {}
+
+    # create the cache of cleaned messages if it was asked for
+    cache = PreprocessorCache(max_size=args.cache_size, path=args.cache_path) if args.cache or args.cache_path else None
+
+    if stream:
+        # clean the data chunk by chunk, writing every chunk as soon as it is done
+        rows, stats = preprocess_stream(path=path, out=out, text_col=text_col, chunksize=chunksize, workers=workers, cache=cache, group_col=group_col)
+        print(f"Remaining data: {rows}")
+    else:
+        # load the data
+        data = read_table(path)
+
+        # remove rows that don't have any data
+        data = data.dropna(subset=[text_col])
 
-    # load the data
-    data = pd.read_csv(path)
+        print(f"Remaining data: {data.shape[0]}")
 
-    # remove rows that don't have any data
-    data = data.dropna(subset=[text_col])
+        # apply the preprocessing pipeline to the column with the text data
+        if cache is not None:
+            [data] = _preprocess_frames(frames=[data], text_col=text_col, workers=workers, stats=stats, cache=cache, group_col=group_col)
+        elif row_wise:
+            data[text_col] = data[text_col].apply(lambda x : Preprocessor.preprocess_text(text=x))
+        elif workers > 1:
+            data[text_col], stats = Preprocessor.preprocess_parallel(series=data[text_col], workers=workers, chunksize=chunksize)
+        else:
+            data[text_col] = Preprocessor.preprocess_series(series=data[text_col])
 
-    print(f"Remaining data: {data.shape[0]}")
+        # save the preprocessed data to the path specified
+        write_table(data, out, schema=MESSAGE_SCHEMA)
 
-    # apply the preprocessing pipeline to the column with the text data
-    data[text_col] = data[text_col].apply(lambda x : Preprocessor.preprocess_text(text=x))
+    # report the throughput of every worker
+    if workers > 1:
+        for pid, worker_stats in stats.items():
+            rows, seconds = worker_stats['rows'], worker_stats['seconds']
+            print(f"Worker {pid}: {rows} rows in {seconds:.2f}s ({rows / max(seconds, 1e-9):.0f} rows/s)")
 
-    # save the preprocessed data to the path specified
-    data.to_csv(out, index=False)
\ No newline at end of file
+    # report the hits and misses of the cache, overall and for every group
+    if cache is not None:
+        for group, group_stats in sorted(cache.group_stats.items()):
+            hits, misses = group_stats['hits'], group_stats['misses']
+            print(f"Cache {group}: {hits} hits, {misses} misses ({hits / max(hits + misses, 1):.1%} deduplicated)")
+        print(f"Cache total: {cache.hits} hits, {cache.misses} misses ({cache.hits / max(cache.hits + cache.misses, 1):.1%} deduplicated)")
+        cache.close()
\ No newline at end of file
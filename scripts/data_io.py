@@ -0,0 +1,357 @@
+import os, sqlite3, uuid
+from collections import OrderedDict
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# the schema of the scraped telegram messages, shared by the scrapper, the cleaner and the pusher
+MESSAGE_SCHEMA = pa.schema([
+    ('channel_title', pa.string()),
+    ('channel_username', pa.string()),
+    ('id', pa.int64()),
+    ('message', pa.string()),
+    ('date', pa.timestamp('us', tz='UTC')),
+    ('media_path', pa.string()),
+])
+
+# the schema of the objects detected in the scraped images
+DETECTION_SCHEMA = pa.schema([
+    ('media_path', pa.string()),
+    ('label', pa.string()),
+    ('confidence', pa.float32()),
+    ('x1', pa.float32()),
+    ('y1', pa.float32()),
+    ('x2', pa.float32()),
+    ('y2', pa.float32()),
+])
+
+# the compression used for every parquet file
+COMPRESSION = 'zstd'
+
+def is_parquet(path: str):
+    """
+    A function that decides whether a path refers to parquet data, either a .parquet file or a folder of parquet part files.
+
+    Args:
+        path(str): the path to the data
+    Returns:
+        True if the path refers to parquet data
+    """
+    return path.endswith('.parquet') or os.path.isdir(path)
+
+def to_table(data: pd.DataFrame, schema: pa.Schema=None):
+    """
+    A function that converts a dataframe into an arrow table, casting the columns found in the schema to their types.
+    The columns that aren't in the schema keep their inferred types.
+
+    Args:
+        data(pd.DataFrame): the dataframe to be converted
+        schema(pa.Schema): the schema of the known columns
+    Returns:
+        table(pa.Table): the typed table
+    """
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    if schema is None: return table
+
+    fields = [schema.field(name) if name in schema.names else table.schema.field(name) for name in table.column_names]
+    return table.cast(pa.schema(fields))
+
+def read_table(path: str, columns: list=None):
+    """
+    A function that reads a csv or parquet file into a dataframe, only the given columns are read.
+
+    Args:
+        path(str): the path to the csv file, the parquet file or the folder of parquet part files
+        columns(list): the columns to read, None to read all of them
+    Returns:
+        data(pd.DataFrame): the data that was read
+    """
+    if is_parquet(path): return pd.read_parquet(path, columns=columns)
+    return pd.read_csv(path, usecols=columns)
+
+def write_table(data: pd.DataFrame, path: str, schema: pa.Schema=None):
+    """
+    A function that writes a dataframe to a csv file, or to a compressed parquet file if the path ends with .parquet.
+
+    Args:
+        data(pd.DataFrame): the data to be written
+        path(str): the path to write the data to
+        schema(pa.Schema): the schema of the known columns, only used for parquet
+    """
+    if is_parquet(path): pq.write_table(to_table(data, schema=schema), path, compression=COMPRESSION)
+    else: data.to_csv(path, index=False)
+
+class FrameReader:
+    """
+    Reads a csv or parquet file in chunks of rows, keeping track of how far it has gotten.
+
+    Attributes:
+        path(str): the path to the csv file, the parquet file or the folder of parquet part files
+        chunksize(int): the number of rows in every chunk
+        columns(list): the columns to read, None to read all of them
+        dtype(dict): the types of csv columns that shouldn't be inferred, parquet columns are always typed
+        unit(str): the unit of total and position, bytes for csv and rows for parquet
+        total(int): the size of the data
+        position(int): how much of the data was read
+    """
+
+    def __init__(self, path: str, chunksize: int, columns: list=None, dtype: dict=None):
+        """
+        Initializes the reader, measuring the size of the data.
+
+        Args:
+            path(str): the path to the csv file, the parquet file or the folder of parquet part files
+            chunksize(int): the number of rows in every chunk
+            columns(list): the columns to read, None to read all of them
+            dtype(dict): the types of csv columns that shouldn't be inferred
+        """
+        self.path = path
+        self.chunksize = chunksize
+        self.columns = columns
+        self.dtype = dtype
+        self.position = 0
+
+        if is_parquet(path):
+            self.dataset = ds.dataset(path, format='parquet')
+            self.unit = 'rows'
+            self.total = self.dataset.count_rows()
+        else:
+            self.dataset = None
+            self.unit = 'B'
+            self.total = os.path.getsize(path)
+
+    def __iter__(self):
+        """
+        Yields the chunks of the data as dataframes.
+        """
+        if self.dataset is not None:
+            for batch in self.dataset.to_batches(columns=self.columns, batch_size=self.chunksize):
+                self.position += batch.num_rows
+                yield batch.to_pandas()
+            return
+
+        with open(self.path, 'rb') as source:
+            for frame in pd.read_csv(source, chunksize=self.chunksize, usecols=self.columns, dtype=self.dtype):
+                # the position of the source is how far the csv reader has gotten
+                self.position = source.tell()
+                yield frame
+
+class FrameWriter:
+    """
+    Appends dataframes to a csv file, or as row groups to a compressed parquet file if the path ends with .parquet.
+
+    Attributes:
+        path(str): the path to write the data to
+        schema(pa.Schema): the schema of the known columns, only used for parquet
+    """
+
+    def __init__(self, path: str, schema: pa.Schema=None):
+        """
+        Initializes the writer, the file is created by the first write.
+
+        Args:
+            path(str): the path to write the data to
+            schema(pa.Schema): the schema of the known columns, only used for parquet
+        """
+        self.path = path
+        self.schema = schema
+        self.writer = None
+        self.file = None
+
+    def write(self, frame: pd.DataFrame):
+        """
+        Appends a dataframe to the file, the header or parquet schema is taken from the first one.
+
+        Args:
+            frame(pd.DataFrame): the data to be appended
+        """
+        if is_parquet(self.path):
+            table = to_table(frame, schema=self.schema)
+            if self.writer is None: self.writer = pq.ParquetWriter(self.path, table.schema, compression=COMPRESSION)
+            self.writer.write_table(table.cast(self.writer.schema))
+        else:
+            header = self.file is None
+            if header: self.file = open(self.path, 'w', newline='', encoding='utf-8')
+            frame.to_csv(self.file, header=header, index=False)
+
+    def close(self):
+        """
+        Closes the file, writing the parquet footer.
+        """
+        if self.writer is not None: self.writer.close()
+        if self.file is not None: self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ParquetPartWriter:
+    """
+    Writes rows to a folder of parquet part files, with the same writerow interface as a csv writer.
+    Every flush writes the buffered rows to a new part file, so the rows that were flushed are readable even if the run crashes
+    and later runs can add to the data by adding part files.
+
+    Attributes:
+        folder(str): the folder the part files are written to
+        schema(pa.Schema): the schema of the rows
+        rows_per_part(int): the number of buffered rows that triggers a flush
+    """
+
+    def __init__(self, folder: str, schema: pa.Schema, rows_per_part: int=100000):
+        """
+        Initializes the writer, creating the folder if it doesn't exist.
+
+        Args:
+            folder(str): the folder the part files are written to
+            schema(pa.Schema): the schema of the rows
+            rows_per_part(int): the number of buffered rows that triggers a flush
+        """
+        self.folder = folder
+        self.schema = schema
+        self.rows_per_part = rows_per_part
+        self.rows = []
+        self.run_id = uuid.uuid4().hex
+        self.parts = 0
+        os.makedirs(folder, exist_ok=True)
+
+    def writerow(self, row: list):
+        """
+        Buffers a row, its values must be in the order of the schema.
+
+        Args:
+            row(list): the values of the row
+        """
+        self.rows.append(row)
+        if len(self.rows) >= self.rows_per_part: self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered rows to a new part file.
+        """
+        if not self.rows: return
+
+        columns = list(zip(*self.rows))
+        table = pa.Table.from_arrays([pa.array(column, type=field.type) for column, field in zip(columns, self.schema)], schema=self.schema)
+        pq.write_table(table, os.path.join(self.folder, f"part-{self.run_id}-{self.parts:05d}.parquet"), compression=COMPRESSION)
+        self.parts += 1
+        self.rows = []
+
+    def close(self):
+        """
+        Writes the remaining buffered rows.
+        """
+        self.flush()
+
+class KeyValueCache:
+    """
+    A bounded LRU of values in memory, optionally persisted to a table of a sqlite file between runs.
+    Subclasses choose the table and how their values are stored, by overriding encode and decode.
+
+    Attributes:
+        max_size(int): the maximum number of entries kept in memory
+        path(str): the path to the sqlite file of the on-disk cache, None if the cache is only kept in memory
+        table(str): the table of the on-disk cache
+        column(str): the column of the table the values are stored in
+        entries(OrderedDict): the entries kept in memory, from the least to the most recently used
+    """
+
+    def __init__(self, table: str, column: str, max_size: int=100000, path: str=None):
+        """
+        Initializes the cache, creating the on-disk cache table if a path is given.
+
+        Args:
+            table(str): the table of the on-disk cache
+            column(str): the column of the table the values are stored in
+            max_size(int): the maximum number of entries kept in memory
+            path(str): the path to the sqlite file of the on-disk cache
+        """
+        self.table = table
+        self.column = column
+        self.max_size = max_size
+        self.path = path
+        self.entries = OrderedDict()
+        self.connection = self.__open_disk_cache() if path else None
+
+    def __open_disk_cache(self):
+        """
+        Opens the sqlite file of the on-disk cache and creates its table if it doesn't exist.
+
+        Returns:
+            connection(sqlite3.Connection): the connection to the on-disk cache
+        """
+        connection = sqlite3.connect(self.path)
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, {self.column} TEXT NOT NULL)")
+        return connection
+
+    def encode(self, value):
+        """
+        Turns a value into the text stored on disk, the values are stored as they are unless a subclass overrides it.
+        """
+        return value
+
+    def decode(self, text: str):
+        """
+        Turns the text stored on disk back into a value, the inverse of encode.
+        """
+        return text
+
+    def __remember(self, key: str, value):
+        """
+        Adds an entry to the in-memory LRU, evicting the least recently used entry when it is full.
+        """
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size: self.entries.popitem(last=False)
+
+    def get_many(self, keys: list):
+        """
+        Looks up the values of the given keys, first in memory and then on disk.
+
+        Args:
+            keys(list): the keys to look up
+        Returns:
+            found(dict): the values of the keys that were found
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                found[key] = self.entries[key]
+            else:
+                missing.append(key)
+
+        if self.connection is not None:
+            # look the keys up in batches, sqlite limits the number of parameters in a query
+            for start in range(0, len(missing), 500):
+                batch = missing[start:start + 500]
+                placeholders = ', '.join('?' * len(batch))
+                for key, text in self.connection.execute(f"SELECT key, {self.column} FROM {self.table} WHERE key IN ({placeholders})", batch):
+                    value = self.decode(text)
+                    self.__remember(key, value)
+                    found[key] = value
+
+        return found
+
+    def put_many(self, entries: dict):
+        """
+        Adds values to the cache, they are also written to disk if an on-disk cache is used.
+
+        Args:
+            entries(dict): the values by key
+        """
+        for key, value in entries.items(): self.__remember(key, value)
+
+        if self.connection is not None:
+            rows = [(key, self.encode(value)) for key, value in entries.items()]
+            self.connection.executemany(f"INSERT OR REPLACE INTO {self.table} (key, {self.column}) VALUES (?, ?)", rows)
+            self.connection.commit()
+
+    def close(self):
+        """
+        Closes the connection to the on-disk cache.
+        """
+        if self.connection is not None: self.connection.close()
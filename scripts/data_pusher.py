@@ -1,6 +1,8 @@
 import pandas as pd
-import psycopg2, uuid
+import psycopg2, psycopg2.pool, uuid, io, time
+from concurrent.futures import ThreadPoolExecutor
 from logger import config_logger, log_message
+from data_io import read_table
 
 class DB_Client:
     """
@@ -35,6 +37,7 @@ class DB_Client:
         self.database_name = database_name
         self.connection = self.__establish_connection()
         self.cursor = self.connection.cursor()
+        self.pool = None
     
     def __establish_connection(self):
         """
@@ -64,7 +67,38 @@ class DB_Client:
             print(f"Failed to establish connection: {e}")
             return None
 
-    def execute_query(self, query: str):
+    def __connection_pool(self, size: int):
+        """
+        Creates the pool of connections channels are pushed on in parallel, it is reused while it is large enough.
+
+        Args:
+            size (int): the number of connections in the pool
+
+        Returns:
+            pool: A `psycopg2.pool.ThreadedConnectionPool` with up to `size` connections.
+        """
+        if self.pool is not None and self.pool.maxconn >= size: return self.pool
+        if self.pool is not None: self.pool.closeall()
+
+        self.pool = psycopg2.pool.ThreadedConnectionPool(
+            minconn=1,
+            maxconn=size,
+            host=self.host,
+            port=self.port,
+            database=self.database_name,
+            user=self.user_name,
+            password=self.password
+        )
+        return self.pool
+
+    def close(self):
+        """
+        Closes the connection of the client and the connections of its pool.
+        """
+        if self.pool is not None: self.pool.closeall()
+        if self.connection is not None: self.connection.close()
+
+    def execute_query(self, query: str, params: tuple=None):
         """
         Executes a SQL query on the connected PostgreSQL database.
 
@@ -72,6 +106,7 @@ class DB_Client:
 
         Args:
             query (str): The SQL query to be executed.
+            params (tuple): The values of the %s placeholders in the query, escaped by psycopg2.
 
         Returns:
             pandas.DataFrame: A DataFrame containing the query result if successful.
@@ -81,20 +116,22 @@ class DB_Client:
             Exception: If there is an error while executing the query.
         """
         try:
-            self.cursor.execute(query=query)
+            self.cursor.execute(query, params)
             self.connection.commit()
             return None
         except Exception as e:
             print(f"Failed to execute query: {e}")
+            self.connection.rollback()
             return None
 
-    def add_channel(self, username: str, title: str):
+    def add_channel(self, username: str, title: str, connection: object=None):
         """
         A method that adds a new telegram to the channel table.
 
         Args:
             username(str): the username of the channel
             title(str): the title of the channel
+            connection(object): a pooled connection to run on as part of the caller's transaction, None to use the client's connection and commit right away
 
         Returns:
             uuid(UUID): the uuid of the newly added telegram channel
@@ -102,22 +139,67 @@ class DB_Client:
         # generate a uuid
         id = str(uuid.uuid4()).encode('utf-8').decode('utf-8')
 
-        # encode the username and titles
-        username = username.encode('utf-8').decode('utf-8')
-        title = title.encode('utf-8').decode('utf-8')
-
-        # create the sql query
-        query = f"INSERT INTO channel (id, username, title) VALUES ('{id}', '{username}', '{title}')"
+        # create the sql query, the values are passed as parameters so they are escaped
+        query = "INSERT INTO channel (id, username, title) VALUES (%s, %s, %s)"
 
         # execute the query
-        self.execute_query(query=query)
+        if connection is None:
+            self.execute_query(query=query, params=(id, username, title))
+        else:
+            with connection.cursor() as cursor: cursor.execute(query, (id, username, title))
+
+        return id
+
+    def ensure_natural_keys(self):
+        """
+        A method that creates the unique indexes the upserts rely on, channels are keyed by their username and messages by
+        their channel and telegram id. Creating them fails if earlier runs already duplicated channels or messages.
+
+        Returns:
+            created(bool): whether the indexes exist
+        """
+        try:
+            self.cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS channel_username_key ON channel (username)")
+            self.cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS message_channel_telegram_id_key ON message (channel_id, telegram_id)")
+            self.connection.commit()
+            return True
+        except Exception as e:
+            log_message(msg=f"Failed to create the natural key indexes, remove the duplicated channels and messages first: {e}", level="ERROR")
+            self.connection.rollback()
+            return False
+
+    def upsert_channel(self, username: str, title: str, connection: object=None):
+        """
+        A method that adds a telegram channel to the channel table unless a channel with the same username exists,
+        in which case its title is updated.
+
+        Args:
+            username(str): the username of the channel
+            title(str): the title of the channel
+            connection(object): a pooled connection to run on as part of the caller's transaction, None to use the client's connection and commit right away
+
+        Returns:
+            uuid(str): the uuid of the new or existing telegram channel
+        """
+        with (connection or self.connection).cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO channel (id, username, title) VALUES (%s, %s, %s) "
+                "ON CONFLICT (username) DO UPDATE SET title = EXCLUDED.title RETURNING id",
+                (str(uuid.uuid4()), username, title)
+            )
+            id = cursor.fetchone()[0]
+        if connection is None: self.connection.commit()
 
         return id
 
-    def add_messages(self, channel_id: str, telegram_id_col: str, message_col: str, media_path_col: str, date_col:str, data: pd.DataFrame):
+    def add_messages(self, channel_id: str, telegram_id_col: str, message_col: str, media_path_col: str, date_col:str, data: pd.DataFrame, batch_size: int=10000, upsert: bool=False, connection: object=None):
         """
         A method that inserts messages into the message table.
 
+        The messages are streamed in batches through COPY into a temporary staging table, from which they are inserted into
+        the message table with ids generated by the database. Every batch is committed on its own, unless a pooled connection
+        is passed, then the batches are part of the caller's transaction and failures are raised to the caller.
+
         Args:
             channel_id_col(str): the id of the telegram channel we want the messages to be added to.
             telegram_id_col(str): the name of the column that contains the telegram_id values.
@@ -125,53 +207,132 @@ class DB_Client:
             media_path_col(str): the name of the column that contains the media_path values.
             date_col(str): the name of the column that contains the date values.
             data(pd.DataFrame): the dataframe that contains the data to be inserted.
+            batch_size(int): the number of messages copied and committed at a time.
+            upsert(bool): whether to skip the messages whose channel and telegram id are already in the table, needs ensure_natural_keys.
+            connection(object): a pooled connection to run on as part of the caller's transaction, None to use the client's connection.
 
         Returns: 
+            inserted(int): the number of messages that were inserted.
         """
 
-        # obtain the columns of interest
-        data = data[[telegram_id_col, message_col, media_path_col, date_col]]
+        # obtain the columns of interest, in the order of the staging table
+        data = data[[telegram_id_col, message_col, date_col, media_path_col]]
+        data = data.astype({telegram_id_col: 'Int64'})
 
-        # first half of the query, the one that declares the table and the types of values to be passed
-        first_half = f"INSERT INTO message (id, channel_id, telegram_id, message, date, media_path) VALUES"
-        
-        # generate the values to add to the second half of the query
-        values = []
-        for index, row in data.iterrows():
-            # generate uuid for every entry
-            id = str(uuid.uuid4()).encode('utf-8').decode('utf-8')
-
-            # encode the message, channel_id, media_path in utf-8
-            encoded_message = str(row[message_col]).encode('utf-8').decode('utf-8')
-            channel_id = channel_id.encode('utf-8').decode('utf-8')
-            media_path = str(row[media_path_col]).encode('utf-8').decode('utf-8')
-            date = str(row[date_col]).encode('utf-8').decode('utf-8')
-
-            # create the sql query
-            query = f" ('{id}', '{channel_id}', '{row[telegram_id_col]}', '{encoded_message}', '{date}', '{media_path}'),"
-
-            # add to the values list
-            values.append(query)
-        
-        # create the second half of the query
-        second_half = ''.join(values)
-        
-        # obtain the query
-        query = first_half + second_half
+        # batches on the client's connection are committed on their own, batches on a pooled connection belong to the caller's transaction
+        own_transaction = connection is None
+        connection = connection or self.connection
+        cursor = connection.cursor()
+
+        inserted = 0
+        try:
+            # the staging table lives as long as the connection
+            cursor.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS message_staging "
+                "(telegram_id BIGINT, message TEXT, date TIMESTAMPTZ, media_path TEXT) ON COMMIT DELETE ROWS"
+            )
+
+            for start in range(0, data.shape[0], batch_size):
+                batch = data.iloc[start:start + batch_size]
+                started = time.perf_counter()
+
+                # write the batch as csv to an in-memory buffer, missing values become NULL
+                buffer = io.StringIO()
+                batch.to_csv(buffer, index=False, header=False)
+                buffer.seek(0)
+
+                # stream the buffer into the staging table and move the rows into the message table
+                cursor.copy_expert("COPY message_staging (telegram_id, message, date, media_path) FROM STDIN WITH (FORMAT csv)", buffer)
+                cursor.execute(
+                    "INSERT INTO message (id, channel_id, telegram_id, message, date, media_path) "
+                    "SELECT gen_random_uuid(), %s, telegram_id, message, date, media_path FROM message_staging"
+                    + (" ON CONFLICT (channel_id, telegram_id) DO NOTHING" if upsert else ""),
+                    (channel_id,)
+                )
+                inserted += cursor.rowcount
+                cursor.execute("TRUNCATE message_staging")
+                if own_transaction: connection.commit()
+
+                seconds = time.perf_counter() - started
+                log_message(msg=f"Copied {batch.shape[0]} messages in {seconds:.2f}s ({batch.shape[0] / max(seconds, 1e-9):.0f} rows/s).", level="DEBUG")
+        except Exception as e:
+            if not own_transaction: raise
+            print(f"Failed to copy messages: {e}")
+            connection.rollback()
+        finally:
+            cursor.close()
+
+        return inserted
 
-        # remove the last ','
-        query = query[:-1]
+    def push_channel(self, pool: object, username: str, title: str, channel_messages: pd.DataFrame, batch_size: int=10000, upsert: bool=False):
+        """
+        A method that pushes a channel and its messages on a connection from the pool, in a single transaction.
 
-        # execute the command
-        self.execute_query(query=query)
+        Args:
+            pool(object): the pool of connections, a `psycopg2.pool.ThreadedConnectionPool`
+            username(str): the username of the channel
+            title(str): the title of the channel
+            channel_messages(pd.DataFrame): the cleaned messages of the channel
+            batch_size(int): the number of messages copied at a time
+            upsert(bool): whether to reuse the channel and skip the messages that are already in the database
 
-    def push_data(self, data: pd.DataFrame):
+        Returns:
+            inserted(int): the number of messages that were inserted, 0 if the transaction was rolled back
+        """
+        connection = pool.getconn()
+        started = time.perf_counter()
+        try:
+            channel_id = self.upsert_channel(username=username, title=title, connection=connection) if upsert else self.add_channel(username=username, title=title, connection=connection)
+            inserted = self.add_messages(channel_id=channel_id, telegram_id_col="id", message_col="message", media_path_col="media_path", date_col='date', data=channel_messages, batch_size=batch_size, upsert=upsert, connection=connection)
+            connection.commit()
+
+            log_message(msg=f"{inserted} messages add for channel {title}({username}) with the UUID {channel_id} in {time.perf_counter() - started:.2f}s.")
+            return inserted
+        except Exception as e:
+            connection.rollback()
+            log_message(msg=f"Failed to push channel {title}({username}), its transaction was rolled back: {e}", level="ERROR")
+            return 0
+        finally:
+            pool.putconn(connection)
+
+    def push_batch(self, data: pd.DataFrame, batch_size: int=10000):
+        """
+        A method that upserts a batch of messages, of one or more channels, in a single transaction on the client's connection.
+        Unlike push_data it raises once the batch is rolled back, so the caller can tell lost messages from skipped ones.
+        The natural key indexes have to exist, see ensure_natural_keys.
+
+        Args:
+            data(pd.DataFrame): the cleaned messages
+            batch_size(int): the number of messages copied at a time
+
+        Returns:
+            inserted(int): the number of messages that were inserted, the ones already in the database are skipped
+        """
+        inserted = 0
+        try:
+            for (username, title), channel_messages in data.groupby(by=['channel_username', 'channel_title']):
+                # the batches of a run arrive newest first, so only the natural key can tell which messages are stored
+                channel_id = self.upsert_channel(username=username, title=title, connection=self.connection)
+                inserted += self.add_messages(channel_id=channel_id, telegram_id_col="id", message_col="message", media_path_col="media_path", date_col='date', data=channel_messages, batch_size=batch_size, upsert=True, connection=self.connection)
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+
+        return inserted
+
+    def push_data(self, data: pd.DataFrame, batch_size: int=10000, upsert: bool=False, workers: int=1):
         """
         A method that pushes the cleaned data to a postgress database
 
         Args:
             data(pd.DataFrame): the cleaned data frame
+            batch_size(int): the number of messages copied and committed at a time
+            upsert(bool): whether to reuse the channels and skip the messages that are already in the database, so re-runs only write new messages
+            workers(int): the number of channels pushed in parallel, each on its own pooled connection and in its own transaction
         """
+        # the upserts rely on unique indexes over the natural keys
+        if upsert and not self.ensure_natural_keys(): return
 
         # group the data by username and title
         grouping = data.groupby(by=['channel_username', 'channel_title'])
@@ -179,20 +340,34 @@ class DB_Client:
         # obtain the channels with their channel_usernames and channel_titles
         channels = list(grouping.groups.keys())
 
+        if workers > 1:
+            # push the channels in parallel on the connections of the pool
+            pool = self.__connection_pool(size=workers)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(self.push_channel, pool, username, title, grouping.get_group(name=(username, title)), batch_size, upsert)
+                    for username, title in channels
+                ]
+                inserted = sum(future.result() for future in futures)
+
+            log_message(msg=f"Finished pushing data! {inserted} messages were added.")
+            return
+
         # add the channel to the tabel and also add all the related messages
         for channel in channels:
             # obtain the channel username and title
             username = channel[0]
             title = channel[1]
+            started = time.perf_counter()
 
             # add the channel to channel table
-            channel_id = self.add_channel(username=username, title=title)
+            channel_id = self.upsert_channel(username=username, title=title) if upsert else self.add_channel(username=username, title=title)
             log_message(msg=f"Channel {title}({username}) has been added with the UUID {channel_id}.")
 
-            # add the messages of that channel to the message channel
+            # add the messages of that channel to the message channel, the upsert skips the ones already stored
             channel_messages = grouping.get_group(name=channel)
-            self.add_messages(channel_id=channel_id, telegram_id_col="id", message_col="message", media_path_col="media_path", date_col='date', data=channel_messages)
-            log_message(msg=f"{channel_messages.shape[0]} messages add for channel {title}({username}).\n")
+            inserted = self.add_messages(channel_id=channel_id, telegram_id_col="id", message_col="message", media_path_col="media_path", date_col='date', data=channel_messages, batch_size=batch_size, upsert=upsert)
+            log_message(msg=f"{inserted} messages add for channel {title}({username}) in {time.perf_counter() - started:.2f}s.\n")
             
         log_message(msg="Finished pushing data!")
 
@@ -207,13 +382,19 @@ if __name__ == "__main__":
     )
 
     parser.add_argument('--env_path', default='.env') # the path to the .env file which contains connection params
-    parser.add_argument('--data_path', default='./data/preprocessed.csv') # the path to the cleaned/preprocessed telegram data
+    parser.add_argument('--data_path', default='./data/preprocessed.csv') # the path to the cleaned/preprocessed telegram data, a csv or parquet file
+    parser.add_argument('--batch_size', type=int, default=10000) # the number of messages copied and committed at a time
+    parser.add_argument('--upsert', action='store_true') # reuse the channels and only write the messages that aren't in the database yet
+    parser.add_argument('--workers', type=int, default=1) # the number of channels pushed in parallel, each on its own connection
 
     args = parser.parse_args()
     
     # obtain the parsed args
     env_path = args.env_path
     data_path = args.data_path
+    batch_size = args.batch_size
+    upsert = args.upsert
+    workers = args.workers
 
     # configure the logger
     config_logger(log_file='log.log')
@@ -239,12 +420,14 @@ if __name__ == "__main__":
 
     log_message(msg='Initialized clinet')
 
-    # read the 
-    data = pd.read_csv(data_path)
+    # read the columns of the preprocessed data that are pushed
+    data = read_table(data_path, columns=['channel_username', 'channel_title', 'id', 'message', 'media_path', 'date'])
 
     log_message(msg='Loaded preprocessed data')
 
     # push the data to postgress
-    client.push_data(data=data)
+    client.push_data(data=data, batch_size=batch_size, upsert=upsert, workers=workers)
+
+    client.close()
 
     log_message(msg='Finished running the data_pusher script.')
\ No newline at end of file
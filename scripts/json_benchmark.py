@@ -0,0 +1,78 @@
+import argparse, logging, os, sys, time
+from logger import config_logger, log_message
+
+# the API is imported in process from src, with the response cache off so every request reaches the database
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ['RESPONSE_CACHE_SIZE'] = '0'
+
+def time_requests(client, path: str, requests: int=30):
+    """
+    This is a function that requests a path a number of times and measures the mean latency.
+
+    Args:
+        client(TestClient): the client of the API
+        path(str): the path requested
+        requests(int): the number of measured requests, after one warm up request
+    Returns:
+        latency_ms(float): the mean latency in milliseconds
+        body(bytes): the body of the last response
+    """
+    client.get(path)
+    start = time.perf_counter()
+    for _ in range(requests): response = client.get(path)
+    return (time.perf_counter() - start) / requests * 1000, response.content
+
+def compare_json_modes(client, paths: list, requests: int=30):
+    """
+    This is a function that times every path with JSON_MODE=pydantic and JSON_MODE=orjson,
+    and checks that both modes send the same body.
+
+    Args:
+        client(TestClient): the client of the API
+        paths(list): the paths requested
+        requests(int): the number of measured requests per path and mode
+    Returns:
+        results(list): a dict per path with the latency of both modes in milliseconds and whether their bodies are identical
+    """
+    import routes
+
+    results = []
+    for path in paths:
+        # the routes read the mode on every request, so it is switched without restarting the API
+        routes.FAST_JSON = False
+        pydantic_ms, pydantic_body = time_requests(client, path, requests)
+        routes.FAST_JSON = True
+        orjson_ms, orjson_body = time_requests(client, path, requests)
+        results.append({'path': path, 'pydantic_ms': pydantic_ms, 'orjson_ms': orjson_ms, 'identical': pydantic_body == orjson_body})
+
+    return results
+
+if __name__ == "__main__":
+    # initialize argparse
+    parser = argparse.ArgumentParser(
+        prog='JSON Mode Benchmark',
+        description='Compares the latency of every list endpoint with JSON_MODE=pydantic and JSON_MODE=orjson, against the database in CONNECTION_STRING.'
+    )
+
+    # define arguments for the script
+    parser.add_argument('--paths', type=str, nargs='+', default=[
+        '/messages/?limit=1000', '/channels/', '/image-detection/?limit=1000', '/products-transformed/?limit=1000',
+        '/product-prices-transformed/?limit=1000', '/phone-numbers-transformed/?limit=1000'
+    ], help='the paths requested')
+    parser.add_argument('--requests', type=int, default=30, help='the number of measured requests per path and mode')
+
+    # obtain the passed arguments
+    args = parser.parse_args()
+
+    # configure the logger
+    config_logger(log_file='log.log')
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    from fastapi.testclient import TestClient
+    import main
+
+    for result in compare_json_modes(TestClient(main.app), paths=args.paths, requests=args.requests):
+        log_message(msg=(
+            f"{result['path']}: pydantic {result['pydantic_ms']:.1f} ms, orjson {result['orjson_ms']:.1f} ms, "
+            f"x{result['pydantic_ms'] / result['orjson_ms']:.1f}, identical bodies: {result['identical']}"
+        ))
@@ -1,68 +1,582 @@
-import torch, cv2, psycopg2
+import torch, cv2, psycopg2, os, io, json, queue, threading, hashlib, time
+import multiprocessing as mp
+import numpy as np
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
 from tqdm import tqdm
+from data_io import DETECTION_SCHEMA, FrameWriter, KeyValueCache, read_table
+from yolo_backend import LocalDetector
 
-def detect_objects(folder_path: str, model: object):
+def content_hash(data: bytes):
+    """
+    A function that creates the cache key of an image from its bytes, only identical files share it.
+
+    Args:
+        data(bytes): the bytes of the image file
+    Returns:
+        The hex digest of the bytes' hash
+    """
+    return 'content:' + hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def perceptual_hash(image: np.ndarray):
+    """
+    A function that creates the cache key of an image from a difference hash of its pixels,
+    so resized or re-encoded copies of the same photo share it.
+
+    Args:
+        image(np.ndarray): the decoded image
+    Returns:
+        The hex digest of the 64 bit difference hash
+    """
+    # compare every pixel of a 9x8 grayscale thumbnail with its right neighbour
+    thumbnail = cv2.resize(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).flatten()
+    return 'perceptual:' + np.packbits(bits).tobytes().hex()
+
+def load_image(image_path: str, image_size: int=None, hash_mode: str=None):
+    """
+    A function that decodes an image and shrinks it so its longest side is at most image_size, keeping its aspect ratio.
+
+    Args:
+        image_path(str): the path to the image
+        image_size(int): the longest side of the image given to the model, None to keep the image as it is
+        hash_mode(str): 'content' or 'perceptual' to create the detection cache key of the image, None to skip it
+    Returns:
+        image(np.ndarray): the decoded image, None if the file isn't an image or is corrupt
+        scale(float): the factor the image was shrunk by, boxes found in the image are divided by it
+        key(str): the detection cache key of the image, None if no hash_mode is given
+    """
+    with open(image_path, 'rb') as file: data = file.read()
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None: return None, 1.0, None
+
+    key = None
+    if hash_mode == 'content': key = content_hash(data)
+    elif hash_mode == 'perceptual': key = perceptual_hash(image)
+
+    scale = 1.0 if image_size is None else min(image_size / max(image.shape[:2]), 1.0)
+    if scale < 1.0:
+        image = cv2.resize(image, (round(image.shape[1] * scale), round(image.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+
+    return image, scale, key
+
+class DetectionCache(KeyValueCache):
+    """
+    A cache of detections keyed by a hash of the image, so a photo reposted under another name only goes through the model once.
+    The boxes are kept relative to the size of the image, so they fit copies of another size found by the perceptual hash.
+    The boxes are kept in a KeyValueCache, stored as json in the detections table of the on-disk cache.
+
+    Attributes:
+        mode(str): 'content' to match identical files, 'perceptual' to also match resized or re-encoded copies
+        max_size(int): the maximum number of entries kept in memory
+        path(str): the path to the sqlite file of the on-disk cache, None if the cache is only kept in memory
+        hits(int): the number of images whose detections were served from the cache
+        misses(int): the number of images that went through the model
+    """
+
+    def __init__(self, mode: str='content', max_size: int=100000, path: str=None):
+        """
+        Initializes the cache, creating the on-disk cache table if a path is given.
+
+        Args:
+            mode(str): 'content' to match identical files, 'perceptual' to also match resized or re-encoded copies
+            max_size(int): the maximum number of entries kept in memory
+            path(str): the path to the sqlite file of the on-disk cache
+        """
+        super().__init__(table='detections', column='boxes', max_size=max_size, path=path)
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, boxes: tuple):
+        """
+        Stores the labels and the relative boxes of an image as json.
+        """
+        labels, values = boxes
+        return json.dumps([labels.tolist(), values.tolist()])
+
+    def decode(self, text: str):
+        """
+        Reads the labels and the relative boxes of an image back from json.
+        """
+        labels, values = json.loads(text)
+        return np.array(labels, dtype=object), np.array(values, dtype=np.float64).reshape(-1, 5)
+
+    def lookup(self, keys: list):
+        """
+        Looks up the boxes of a batch of images, the first image of every key that isn't cached is a miss and its copies are hits.
+
+        Args:
+            keys(list): the hash of every image in the batch
+        Returns:
+            found(dict): the relative boxes of the keys that were found
+            misses(list): the positions of the images that have to go through the model
+        """
+        first_occurrences = {}
+        for index, key in enumerate(keys): first_occurrences.setdefault(key, index)
+
+        found = self.get_many(keys=list(first_occurrences))
+        misses = [index for key, index in first_occurrences.items() if key not in found]
+
+        self.misses += len(misses)
+        self.hits += len(keys) - len(misses)
+
+        return found, misses
+
+class ImageLoader:
+    """
+    Decodes and resizes the images of a directory on a pool of threads, ahead of the model.
+    A background thread keeps up to prefetch batches ready in a bounded queue, so the model doesn't wait on the disk or on decoding.
+    Files that can't be decoded are left out of the batches and recorded in skipped.
+
+    Attributes:
+        folder_path(str): the path to the directory which contains the images
+        image_files(list): the names of the images to load
+        batch_size(int): the number of images in every batch
+        workers(int): the number of images decoded at the same time
+        prefetch(int): the number of batches kept ready ahead of the model
+        image_size(int): the longest side of the loaded images, None to keep the images as they are
+        hash_mode(str): 'content' or 'perceptual' to create the detection cache keys of the images, None to skip them
+        skipped(list): the names of the files that couldn't be decoded
+    """
+
+    def __init__(self, folder_path: str, image_files: list, batch_size: int=1, workers: int=4, prefetch: int=2, image_size: int=None, hash_mode: str=None):
+        """
+        Initializes the loader, the images are loaded once it is iterated over.
+
+        Args:
+            folder_path(str): the path to the directory which contains the images
+            image_files(list): the names of the images to load
+            batch_size(int): the number of images in every batch
+            workers(int): the number of images decoded at the same time
+            prefetch(int): the number of batches kept ready ahead of the model
+            image_size(int): the longest side of the loaded images, None to keep the images as they are
+            hash_mode(str): 'content' or 'perceptual' to create the detection cache keys of the images, None to skip them
+        """
+        self.folder_path = folder_path
+        self.image_files = image_files
+        self.batch_size = batch_size
+        self.workers = workers
+        self.prefetch = prefetch
+        self.image_size = image_size
+        self.hash_mode = hash_mode
+        self.skipped = []
+
+    def __load_batch(self, executor: ThreadPoolExecutor, batch_files: list):
+        """
+        Decodes the images of a batch in parallel, leaving out the files that can't be decoded.
+
+        Args:
+            executor(ThreadPoolExecutor): the pool the images are decoded on
+            batch_files(list): the names of the images in the batch
+        Returns:
+            batch(tuple): the names, images, scales and cache keys of the images that were decoded
+        """
+        paths = [os.path.join(self.folder_path, path) for path in batch_files]
+        results = executor.map(load_image, paths, [self.image_size] * len(paths), [self.hash_mode] * len(paths))
+        loaded = [(path, image, scale, key) for path, (image, scale, key) in zip(batch_files, results) if image is not None]
+        self.skipped.extend(sorted(set(batch_files) - {path for path, _, _, _ in loaded}))
+
+        return tuple(list(column) for column in zip(*loaded)) if loaded else ([], [], [], [])
+
+    def __produce(self, batches: queue.Queue, stop: threading.Event):
+        """
+        Loads the batches in order and puts them on the queue until every batch is loaded or the loader is stopped.
+
+        Args:
+            batches(queue.Queue): the bounded queue of loaded batches, a None is put on it once the loading stops
+            stop(threading.Event): set when the consumer stops early
+        """
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for start in range(0, len(self.image_files), self.batch_size):
+                    batch_files = self.image_files[start:start + self.batch_size]
+                    batch = (len(batch_files), self.__load_batch(executor, batch_files))
+
+                    # wait for room in the queue, giving up once the consumer stopped
+                    while not stop.is_set():
+                        try:
+                            batches.put(batch, timeout=0.1)
+                            break
+                        except queue.Full:
+                            continue
+                    if stop.is_set(): return
+        finally:
+            batches.put(None)
+
+    def __iter__(self):
+        """
+        Yields the batches in the order of the image files.
+
+        Yields:
+            size(int): the number of files in the batch, including the ones that were skipped
+            batch(tuple): the names, images, scales and cache keys of the images of the batch that were decoded
+        """
+        batches = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        producer = threading.Thread(target=self.__produce, args=(batches, stop), daemon=True)
+        producer.start()
+
+        try:
+            while (batch := batches.get()) is not None:
+                yield batch
+        finally:
+            stop.set()
+            # free up the queue so the producer can put its final None
+            while producer.is_alive():
+                try: batches.get(timeout=0.1)
+                except queue.Empty: pass
+            producer.join()
+
+def class_labels(names: object):
+    """
+    A function that creates a lookup array of the class names of a model, so the labels of many boxes are found with a single index.
+
+    Args:
+        names(object): the class names of the model, a dict by class index or a list
+    Returns:
+        labels(np.ndarray): the class name of every class index
+    """
+    if isinstance(names, dict): names = [names.get(index, str(index)) for index in range(max(names, default=-1) + 1)]
+    return np.array(names, dtype=object)
+
+def collect_detections(boxes: object, labels: np.ndarray, scale: float=1.0):
+    """
+    A function that turns the boxes the model found in an image into arrays of labels and values.
+
+    Args:
+        boxes(torch.Tensor): the boxes of the image, one row of x1, y1, x2, y2, confidence and class for every object
+        labels(np.ndarray): the class name of every class index, from class_labels
+        scale(float): the factor the image was shrunk by before the model saw it, the boxes are mapped back to the original image
+    Returns:
+        labels(np.ndarray): the label of every box
+        values(np.ndarray): one row of confidence, x1, y1, x2 and y2 for every box
+    """
+    boxes = boxes.cpu().numpy().astype(np.float64, copy=False).reshape(-1, 6)
+    values = np.empty((len(boxes), 5), dtype=np.float64)
+    values[:, 0] = boxes[:, 4]
+    values[:, 1:] = boxes[:, :4] / scale
+
+    return labels[boxes[:, 5].astype(np.int64)], values
+
+def relative_boxes(values: np.ndarray, shape: tuple, scale: float=1.0):
+    """
+    A function that turns the boxes of an image into boxes relative to its size, as they are kept in the DetectionCache.
+
+    Args:
+        values(np.ndarray): one row of confidence, x1, y1, x2 and y2 for every box
+        shape(tuple): the shape of the image given to the model
+        scale(float): the factor the image was shrunk by before the model saw it
+    Returns:
+        values(np.ndarray): one row of confidence and relative x1, y1, x2 and y2 for every box
+    """
+    height, width = shape[0] / scale, shape[1] / scale
+    return values / np.array([1.0, width, height, width, height])
+
+def absolute_boxes(values: np.ndarray, shape: tuple, scale: float=1.0):
+    """
+    A function that turns boxes relative to the size of an image back into boxes of the image.
+
+    Args:
+        values(np.ndarray): one row of confidence and relative x1, y1, x2 and y2 for every box
+        shape(tuple): the shape of the image given to the model
+        scale(float): the factor the image was shrunk by before the model saw it
+    Returns:
+        values(np.ndarray): one row of confidence, x1, y1, x2 and y2 for every box
+    """
+    height, width = shape[0] / scale, shape[1] / scale
+    return values * np.array([1.0, width, height, width, height])
+
+def detections_frame(media_paths: list, labels: list, values: list):
+    """
+    A function that assembles the arrays of a batch of images into a single dataframe of detections.
+
+    Args:
+        media_paths(list): the name of every image
+        labels(list): the labels of the boxes of every image
+        values(list): the confidence, x1, y1, x2 and y2 of the boxes of every image
+    Returns:
+        detections(pd.DataFrame): one row for every box, with the DETECTION_SCHEMA columns
+    """
+    counts = [len(image_labels) for image_labels in labels]
+    values = np.concatenate(values).astype(np.float32) if values else np.empty((0, 5), dtype=np.float32)
+
+    return pd.DataFrame({
+        'media_path': np.repeat(np.array(media_paths, dtype=object), counts),
+        'label': np.concatenate(labels) if labels else np.empty(0, dtype=object),
+        'confidence': values[:, 0],
+        'x1': values[:, 1],
+        'y1': values[:, 2],
+        'x2': values[:, 3],
+        'y2': values[:, 4],
+    })
+
+def detect_objects(folder_path: str, model: object, image_files: list=None, batch_size: int=1, workers: int=4, prefetch: int=2, image_size: int=None, cache: DetectionCache=None, show_progress: bool=True, sink: callable=None):
     """
     A function that will detect objects in images found in a directory.
+    The images are given to the model in batches, so the inference engine runs over many images in a single call.
+    The batches are decoded and resized by an ImageLoader ahead of the model, files that can't be decoded are skipped and reported.
 
     Args:
         folder_path(str): the path to the directory which contains the images to be detected
         model(object): the YOLO model, this function expectes to be provided one
+        image_files(list): the names of the images in the directory to detect objects in, None to use every file in it
+        batch_size(int): the number of images given to the model at a time
+        workers(int): the number of images decoded at the same time
+        prefetch(int): the number of batches decoded ahead of the model
+        image_size(int): the longest side of the images given to the model, the boxes are mapped back to the original images
+        cache(DetectionCache): a cache of detections, when given the copies of an image that was already detected skip the model
+        show_progress(bool): whether to show a progress bar
+        sink(callable): called with the detections of every batch as soon as they are found, e.g. to write or push them during the run.
+                        The batches are then not kept and the returned dataframe is empty.
     
     Returns:
         detection_data(pd.DataFrame): a dataframe containing the bounding box and label of the images
     """
-    # a list for containing the detection information
+    # a list for containing the detections of every batch
     detections = []
+    labels = class_labels(model.names)
 
     # get the list of images
-    image_files = os.listdir(folder_path)
-
-    # loop throught the images and detect objects
-    for path in tqdm(image_files, desc="Processing Images", unit="Images"):
-        # load the image using opencv
-        image_path = os.path.join(images_folder, path)
-        image = cv2.imread(filename=image_path)
-        
-        # detect objects in the image
-        detection_results = model(image)
-
-        for object in detection_results.xyxy[0].cpu().numpy():
-            x1, y1, x2, y2, conf, cls = object[:6]
-            
-            # Get the class name from the model
-            class_name = model.names[int(cls)]
-
-            detections.append({
-                'media_path': path,
-                'label': class_name,
-                'confidence': conf,
-                'x1': x1,
-                'y1': y1,
-                'x2': x2,
-                'y2': y2
-            })
+    if image_files is None: image_files = os.listdir(folder_path)
+
+    # decode the images on a pool of threads, ahead of the model
+    loader = ImageLoader(folder_path=folder_path, image_files=image_files, batch_size=batch_size, workers=workers, prefetch=prefetch, image_size=image_size, hash_mode=None if cache is None else cache.mode)
+
+    # loop throught the batches of images and detect objects
+    with tqdm(total=len(image_files), desc="Processing Images", unit="Images", disable=not show_progress) as progress:
+        for size, (batch_files, images, scales, keys) in loader:
+            # only the images that aren't cached go through the model
+            found, misses = cache.lookup(keys=keys) if cache is not None else ({}, list(range(len(images))))
+
+            results = {}
+            if misses:
+                # detect objects in the whole batch, the model returns the boxes of every image in the order the images were given
+                detection_results = model([images[index] for index in misses])
+
+                for index, boxes in zip(misses, detection_results.xyxy):
+                    results[index] = collect_detections(boxes=boxes, labels=labels, scale=scales[index])
+
+                if cache is not None:
+                    entries = {keys[index]: (results[index][0], relative_boxes(values=results[index][1], shape=images[index].shape, scale=scales[index])) for index in misses}
+                    cache.put_many(entries=entries)
+                    found.update(entries)
+
+            # the copies of cached images get the cached boxes, fitted to their own size
+            for index in range(len(batch_files)):
+                if index not in results:
+                    cached_labels, cached_values = found[keys[index]]
+                    results[index] = (cached_labels, absolute_boxes(values=cached_values, shape=images[index].shape, scale=scales[index]))
+
+            batch = detections_frame(media_paths=batch_files, labels=[results[index][0] for index in range(len(batch_files))], values=[results[index][1] for index in range(len(batch_files))])
+            if sink is not None: sink(batch)
+            else: detections.append(batch)
+
+            progress.update(size)
+
+    # report the files that couldn't be decoded
+    if loader.skipped: print(f"Skipped {len(loader.skipped)} files that aren't readable images: {', '.join(loader.skipped)}")
+
+    # report the hits and misses of the cache
+    if cache is not None and show_progress: print(f"Detection cache: {cache.hits} hits, {cache.misses} misses ({cache.hits / max(cache.hits + cache.misses, 1):.1%} of the images skipped the model)")
     
-    # convert the list of dicts into a dataframe
-    detections = pd.DataFrame(data=detections)
+    # concatenate the detections of the batches once
+    if not detections: return detections_frame(media_paths=[], labels=[], values=[])
+
+    return pd.concat(detections, ignore_index=True)
 
-    return detections
+def load_yolo_model():
+    """
+    A function that loads a pretrained YOLOv5 model from torch hub.
+
+    Returns:
+        model(object): the YOLOv5s model
+    """
+    return torch.hub.load('ultralytics/yolov5', 'yolov5s', pretrained=True)
+
+# the model and cache of a labeling worker process, loaded once by _init_worker
+_worker_model = None
+_worker_cache = None
 
-def push_detections(detections: pd.DataFrame, table_name: str, host: str, username: str, password: str, database: str, port: int):
+def _init_worker(load_model: callable, threads: int, cache_mode: str=None, cache_size: int=100000):
     """
-    Push the detections dataframe to a PostgreSQL table using psycopg2.
+    A function that prepares a labeling worker process, it limits the threads torch uses and loads the model once.
 
     Args:
-        detections (pd.DataFrame): DataFrame containing detection results.
-        table_name (str): The name of the table to insert data into.
+        load_model(callable): the function that loads the model, it has to be importable by the worker
+        threads(int): the number of threads torch runs the inference on
+        cache_mode(str): 'content' or 'perceptual' to give the worker its own in-memory DetectionCache, None for no cache
+        cache_size(int): the maximum number of entries in the cache of the worker
+    """
+    global _worker_model, _worker_cache
+    torch.set_num_threads(threads)
+    _worker_model = load_model()
+    _worker_cache = None if cache_mode is None else DetectionCache(mode=cache_mode, max_size=cache_size)
+
+def _detect_shard(folder_path: str, image_files: list, options: dict):
+    """
+    A function that runs detect_objects over a shard of the images in a worker process.
+
+    Args:
+        folder_path(str): the path to the directory which contains the images
+        image_files(list): the names of the images in the shard
+        options(dict): the batch_size, workers, prefetch and image_size passed to detect_objects
+    Returns:
+        detections(pd.DataFrame): the detections of the shard
+        pid(int): the process id of the worker
+        seconds(float): the seconds the worker spent on the shard
+    """
+    started = time.perf_counter()
+    detections = detect_objects(folder_path=folder_path, model=_worker_model, image_files=image_files, cache=_worker_cache, show_progress=False, **options)
+    return detections, os.getpid(), time.perf_counter() - started
+
+def detect_objects_parallel(folder_path: str, load_model: callable, image_files: list, processes: int, shard_size: int=256, threads: int=None, cache_mode: str=None, cache_size: int=100000, sink: callable=None, **options):
+    """
+    A function that splits the images into shards and runs detect_objects on each of them using a pool of processes.
+    Every process loads the model once and runs torch on its share of the cores, the detections are merged in the order of the images.
+
+    Args:
+        folder_path(str): the path to the directory which contains the images to be detected
+        load_model(callable): the function that loads the model in every process, e.g. load_yolo_model
+        image_files(list): the names of the images in the directory to detect objects in
+        processes(int): the number of processes to run the model in
+        shard_size(int): the number of images sent to a process at a time
+        threads(int): the number of threads torch uses in every process, None to split the cores evenly between the processes
+        cache_mode(str): 'content' or 'perceptual' to give every process its own in-memory DetectionCache, None for no cache
+        cache_size(int): the maximum number of entries in the cache of every process
+        sink(callable): called with the detections of every shard in order, as soon as they are merged. The shards are then not kept
+                        and the returned dataframe is empty.
+        options: the batch_size, workers, prefetch and image_size passed to detect_objects
+    Returns:
+        detections(pd.DataFrame): the detections of every image, in the order of the images
+        stats(dict): the number of images and the seconds spent detecting them, for every worker process id
+    """
+    if threads is None: threads = max(1, (os.cpu_count() or 1) // processes)
+
+    # split the images into shards
+    shards = [image_files[start:start + shard_size] for start in range(0, len(image_files), shard_size)]
+
+    results = []
+    stats = {}
+    # the processes are spawned, torch's thread pools don't survive a fork
+    with ProcessPoolExecutor(max_workers=processes, mp_context=mp.get_context('spawn'), initializer=_init_worker, initargs=(load_model, threads, cache_mode, cache_size)) as executor:
+        with tqdm(total=len(image_files), desc="Processing Images", unit="Images") as progress:
+            # executor.map yields the results in the order of the shards, which keeps the output deterministic
+            for shard, (detections, pid, seconds) in zip(shards, executor.map(_detect_shard, [folder_path] * len(shards), shards, [options] * len(shards))):
+                if sink is not None: sink(detections)
+                else: results.append(detections)
+                worker_stats = stats.setdefault(pid, {'images': 0, 'seconds': 0.0})
+                worker_stats['images'] += len(shard)
+                worker_stats['seconds'] += seconds
+                progress.update(len(shard))
+
+    if not results: return detections_frame(media_paths=[], labels=[], values=[]), stats
+
+    return pd.concat(results, ignore_index=True), stats
+
+class DetectionManifest:
+    """
+    A JSON file that records the modification time and size every image had when it was labeled,
+    so later runs only label the images that are new or were changed since.
+
+    Attributes:
+        path(str): the path to the JSON manifest file
+        entries(dict): the modification time and size of every labeled image, by image name
+    """
+
+    def __init__(self, path: str):
+        """
+        Initializes the manifest, loading the file if it exists.
+
+        Args:
+            path(str): the path to the JSON manifest file
+        """
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                self.entries = json.load(file)
+
+    @staticmethod
+    def stat(image_path: str):
+        """
+        Returns the modification time and size of an image.
+
+        Args:
+            image_path(str): the path to the image
+        Returns:
+            entry(list): the modification time in nanoseconds and the size in bytes of the image
+        """
+        stat = os.stat(image_path)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def is_current(self, folder_path: str, image_file: str):
+        """
+        Decides whether an image was labeled and hasn't changed since.
+
+        Args:
+            folder_path(str): the path to the directory which contains the image
+            image_file(str): the name of the image
+        Returns:
+            True if the manifest holds the current modification time and size of the image
+        """
+        return self.entries.get(image_file) == self.stat(os.path.join(folder_path, image_file))
+
+    def record(self, folder_path: str, image_files: list):
+        """
+        Records the current modification time and size of labeled images and saves the manifest file.
+
+        Args:
+            folder_path(str): the path to the directory which contains the images
+            image_files(list): the names of the images that were labeled
+        """
+        for image_file in image_files:
+            self.entries[image_file] = self.stat(os.path.join(folder_path, image_file))
+
+        # write to a temporary file and move it over the manifest, so a crash never leaves a half written file
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            json.dump(self.entries, file)
+        os.replace(temporary_path, self.path)
+
+def select_images(folder_path: str, image_files: list, manifest: DetectionManifest=None, labeled: set=None):
+    """
+    A function that selects the images that still need to be labeled.
+    An image the manifest knows is labeled again only if it changed, an image it doesn't know is skipped if it is in the labeled set.
+
+    Args:
+        folder_path(str): the path to the directory which contains the images
+        image_files(list): the names of the candidate images
+        manifest(DetectionManifest): the manifest of the earlier runs
+        labeled(set): the names of the images that already have detections, e.g. from labeled_images
+    Returns:
+        image_files(list): the names of the images to label, in the order they were passed
+    """
+    selected = []
+    for image_file in image_files:
+        if manifest is not None and image_file in manifest.entries:
+            if not manifest.is_current(folder_path, image_file): selected.append(image_file)
+        elif labeled is None or image_file not in labeled:
+            selected.append(image_file)
+
+    return selected
+
+def labeled_images(table_name: str, host: str, username: str, password: str, database: str, port: int):
+    """
+    Loads the names of the images that already have detections in a PostgreSQL table.
+
+    Args:
+        table_name (str): The name of the table the detections are in.
         host (str): The PostgreSQL server host.
         username (str): PostgreSQL username.
         password (str): PostgreSQL password.
         database (str): Name of the PostgreSQL database.
         port (int): Port number for PostgreSQL.
+
+    Returns:
+        labeled(set): the distinct media paths of the table, empty if it can't be read
     """
-    # Establish connection
     try:
         connection = psycopg2.connect(
             host=host,
@@ -71,35 +585,140 @@ def push_detections(detections: pd.DataFrame, table_name: str, host: str, userna
             user=username,
             password=password
         )
-        cursor = connection.cursor()
     except Exception as e:
         print(f"Failed to establish connection: {e}")
-        return
-
-    # Generate insert query
-    insert_query = f"INSERT INTO {table_name} (media_path, label, confidence, x1, y1, x2, y2) VALUES %s"
-
-    # Prepare data for insertion
-    values = []
-    for _, row in detections.iterrows():
-        values.append((row['media_path'], row['label'], row['confidence'], row['x1'], row['y1'], row['x2'], row['y2']))
+        return set()
 
     try:
-        # Use psycopg2.extras.execute_values for bulk insert
-        from psycopg2.extras import execute_values
-        execute_values(cursor, insert_query, values)
-        
-        connection.commit()
-        print(f"Successfully pushed {len(detections)} records to {table_name}.")
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT DISTINCT media_path FROM {table_name}")
+            return {media_path for media_path, in cursor.fetchall()}
     except Exception as e:
-        print(f"Failed to execute query: {e}")
-        connection.rollback()
+        print(f"Failed to load the labeled images: {e}")
+        return set()
     finally:
-        cursor.close()
         connection.close()
 
+class DetectionPusher:
+    """
+    Streams detections into a PostgreSQL table with COPY, in chunks and in a single transaction, so detections can be pushed while they are found.
+    A failed chunk rolls back the whole transaction and the chunks after it are ignored.
+
+    Attributes:
+        table_name (str): The name of the table to insert data into.
+        replace_paths (list): The media paths that were labeled again, their earlier detections are deleted in the same transaction.
+        chunk_size (int): The number of detections copied at a time.
+        pushed (int): The number of detections copied so far.
+        failed (bool): Whether the transaction failed.
+    """
+
+    def __init__(self, table_name: str, host: str, username: str, password: str, database: str, port: int, replace_paths: list=None, chunk_size: int=100000):
+        """
+        Initializes the pusher, connecting to the database and deleting the outdated detections.
+
+        Args:
+            table_name (str): The name of the table to insert data into.
+            host (str): The PostgreSQL server host.
+            username (str): PostgreSQL username.
+            password (str): PostgreSQL password.
+            database (str): Name of the PostgreSQL database.
+            port (int): Port number for PostgreSQL.
+            replace_paths (list): The media paths that were labeled again, their earlier detections are deleted in the same transaction.
+            chunk_size (int): The number of detections copied at a time.
+        """
+        self.table_name = table_name
+        self.replace_paths = replace_paths
+        self.chunk_size = chunk_size
+        self.pushed = 0
+        self.failed = False
+        self.connection = None
+
+        # Establish connection
+        try:
+            self.connection = psycopg2.connect(
+                host=host,
+                port=port,
+                database=database,
+                user=username,
+                password=password
+            )
+            self.cursor = self.connection.cursor()
+
+            # drop the outdated detections of the images that were labeled again
+            if replace_paths: self.cursor.execute(f"DELETE FROM {table_name} WHERE media_path = ANY(%s)", (list(replace_paths),))
+        except Exception as e:
+            print(f"Failed to prepare pushing the detections: {e}")
+            self.failed = True
+
+    def write(self, detections: pd.DataFrame):
+        """
+        Copies detections into the table, a chunk at a time.
+
+        Args:
+            detections (pd.DataFrame): DataFrame containing detection results.
+        """
+        if self.failed: return
+
+        try:
+            for start in range(0, len(detections), self.chunk_size):
+                chunk = detections.iloc[start:start + self.chunk_size]
+
+                # write the chunk as csv to an in-memory buffer and stream it into the table
+                buffer = io.StringIO()
+                chunk[DETECTION_SCHEMA.names].to_csv(buffer, index=False, header=False)
+                buffer.seek(0)
+                self.cursor.copy_expert(f"COPY {self.table_name} (media_path, label, confidence, x1, y1, x2, y2) FROM STDIN WITH (FORMAT csv)", buffer)
+                self.pushed += len(chunk)
+        except Exception as e:
+            print(f"Failed to copy detections: {e}")
+            self.connection.rollback()
+            self.failed = True
+
+    def close(self):
+        """
+        Commits the transaction unless it failed, and closes the connection.
+
+        Returns:
+            True if the detections were pushed.
+        """
+        if self.connection is None: return False
+
+        try:
+            if self.failed: return False
+            self.connection.commit()
+            print(f"Successfully pushed {self.pushed} records to {self.table_name}.")
+            return True
+        except Exception as e:
+            print(f"Failed to commit the detections: {e}")
+            self.connection.rollback()
+            return False
+        finally:
+            self.connection.close()
+
+def push_detections(detections: pd.DataFrame, table_name: str, host: str, username: str, password: str, database: str, port: int, replace_paths: list=None, chunk_size: int=100000):
+    """
+    Push the detections dataframe to a PostgreSQL table using COPY.
+
+    Args:
+        detections (pd.DataFrame): DataFrame containing detection results.
+        table_name (str): The name of the table to insert data into.
+        host (str): The PostgreSQL server host.
+        username (str): PostgreSQL username.
+        password (str): PostgreSQL password.
+        database (str): Name of the PostgreSQL database.
+        port (int): Port number for PostgreSQL.
+        replace_paths (list): The media paths that were labeled again, their earlier detections are deleted in the same transaction.
+        chunk_size (int): The number of detections copied at a time.
+
+    Returns:
+        True if the detections were pushed.
+    """
+    pusher = DetectionPusher(table_name=table_name, host=host, username=username, password=password, database=database, port=port, replace_paths=replace_paths, chunk_size=chunk_size)
+    pusher.write(detections)
+    return pusher.close()
+
 if __name__ == "__main__":
-    import argparse, os, warnings
+    import argparse, warnings
     from dotenv import load_dotenv
 
     # disable warning
@@ -113,14 +732,51 @@ if __name__ == "__main__":
 
     parser.add_argument('--images_folder', default='./data/media')
     parser.add_argument('--export_folder', default='./object_detection')
+    parser.add_argument('--export_format', choices=['csv', 'parquet'], default='csv') # the format the detections are exported to the export folder in
+    parser.add_argument('--data_path', default=None) # a csv or parquet file of messages, only the images in its media_path column are labeled
     parser.add_argument('--env', default='.env')
+    parser.add_argument('--batch_size', type=int, default=16) # the number of images given to the model at a time
+    parser.add_argument('--loader_workers', type=int, default=4) # the number of images decoded at the same time
+    parser.add_argument('--prefetch', type=int, default=2) # the number of batches decoded ahead of the model
+    parser.add_argument('--image_size', type=int, default=640) # the longest side of the images given to the model, larger images are shrunk while loading
+    parser.add_argument('--manifest', default=None) # the manifest of the labeled images, defaults to manifest.json in the export folder
+    parser.add_argument('--force', action='store_true') # label every image again, not only the new and changed ones
+    parser.add_argument('--cache', action='store_true') # run the model once for every distinct image, copies get the cached detections
+    parser.add_argument('--perceptual_hash', action='store_true') # also match resized or re-encoded copies of an image, implies --cache
+    parser.add_argument('--cache_size', type=int, default=100000) # the number of cached images kept in memory
+    parser.add_argument('--cache_path', default=None) # a sqlite file that persists the cache between runs, implies --cache, needs --workers 1
+    parser.add_argument('--model_path', default=None) # a YOLOv5 model exported to .onnx or .torchscript, run locally instead of the torch hub model
+    parser.add_argument('--workers', type=int, default=1) # the number of processes the model runs in, each one labels a shard of the images at a time
+    parser.add_argument('--shard_size', type=int, default=256) # the number of images sent to a worker process at a time
+    parser.add_argument('--torch_threads', type=int, default=None) # the number of threads torch uses in every worker, defaults to the cores split evenly between the workers
 
     args = parser.parse_args()
+
+    # the worker processes each keep an in-memory cache, none of them can write the sqlite file
+    if args.cache_path and args.workers > 1:
+        parser.error("--cache_path needs a single worker, run with --workers 1 or use --cache for in-memory caches per worker")
     
     # obtain parsed args
     images_folder = args.images_folder
     export_folder = args.export_folder
-    env_path = args.env    
+    export_format = args.export_format
+    data_path = args.data_path
+    env_path = args.env
+    batch_size = args.batch_size
+    loader_workers = args.loader_workers
+    prefetch = args.prefetch
+    image_size = args.image_size
+    manifest_path = args.manifest or os.path.join(export_folder, 'manifest.json')
+    force = args.force
+    workers = args.workers
+    model_path = args.model_path
+
+    # load the exported model from disk if one is given, otherwise from torch hub
+    load_model = partial(LocalDetector, model_path) if model_path else load_yolo_model
+
+    # create the cache of detections if it was asked for, the worker processes create their own
+    cache_mode = 'perceptual' if args.perceptual_hash else 'content' if args.cache or args.cache_path else None
+    cache = DetectionCache(mode=cache_mode, max_size=args.cache_size, path=args.cache_path) if cache_mode and workers <= 1 else None
     
     # load the database connection params from the .env
     load_dotenv(dotenv_path=env_path)
@@ -130,13 +786,55 @@ if __name__ == "__main__":
     username = os.getenv("DB_USER")
     password = os.getenv("DB_PASSWORD")
 
-    # load a pretrained yoloV5 model from torch hub
-    model = torch.hub.load('ultralytics/yolov5', 'yolov5s', pretrained=True)
+    # only label the images of the messages in the data, reading just the media_path column
+    image_files = sorted(os.listdir(images_folder))
+    if data_path is not None:
+        media_paths = read_table(data_path, columns=['media_path'])['media_path'].dropna()
+        image_files = sorted({os.path.basename(media_path) for media_path in media_paths} & set(image_files))
+
+    # skip the images that were labeled by earlier runs and haven't changed since
+    os.makedirs(export_folder, exist_ok=True)
+    manifest = DetectionManifest(manifest_path)
+    if not force:
+        labeled = labeled_images(table_name="image_detection", host=host, username=username, password=password, database=db_name, port=port)
+        total = len(image_files)
+        image_files = select_images(folder_path=images_folder, image_files=image_files, manifest=manifest, labeled=labeled)
+        print(f"Labeling {len(image_files)} new or changed images, skipping {total - len(image_files)}.")
 
-    print("YOLOV5 loading finished!")
+    # the detections are exported and pushed while they are found, the images that were labeled again have their detections replaced
+    writer = FrameWriter(path=os.path.join(export_folder, f"detections.{export_format}"), schema=DETECTION_SCHEMA)
+    pusher = DetectionPusher(table_name="image_detection", host=host, username=username, password=password, database=db_name, port=port, replace_paths=image_files)
+
+    def sink(detections: pd.DataFrame):
+        writer.write(detections)
+        pusher.write(detections)
 
     # detect the objects
-    detections = detect_objects(folder_path=images_folder, model=model)
+    started = time.perf_counter()
+    options = {'batch_size': batch_size, 'workers': loader_workers, 'prefetch': prefetch, 'image_size': image_size, 'sink': sink}
+    if workers > 1:
+        # every worker process loads its own model, the shards are streamed to the sink in order
+        _, stats = detect_objects_parallel(folder_path=images_folder, load_model=load_model, image_files=image_files, processes=workers, shard_size=args.shard_size, threads=args.torch_threads, cache_mode=cache_mode, cache_size=args.cache_size, **options)
+
+        # report the throughput of every worker
+        for pid, worker_stats in stats.items():
+            images, seconds = worker_stats['images'], worker_stats['seconds']
+            print(f"Worker {pid}: {images} images in {seconds:.2f}s ({images / max(seconds, 1e-9):.1f} images/s)")
+    else:
+        # load the yoloV5 model
+        model = load_model()
+        print(f"YOLOV5 loading finished in {time.perf_counter() - started:.2f}s!")
+
+        started = time.perf_counter()
+        detect_objects(folder_path=images_folder, model=model, image_files=image_files, cache=cache, **options)
+        if cache is not None: cache.close()
+
+    seconds = time.perf_counter() - started
+    print(f"Labeled {len(image_files)} images in {seconds:.2f}s ({len(image_files) / max(seconds, 1e-9):.1f} images/s)")
+
+    # finish the export and commit the pushed detections
+    writer.close()
+    pushed = pusher.close()
 
-    # push to the database
-    push_detections(detections=detections, table_name="image_detection", host=host, username=username, password=password, database=db_name, port=port)
+    # only remember the labeled images once their detections are stored
+    if pushed: manifest.record(folder_path=images_folder, image_files=image_files)
@@ -0,0 +1,70 @@
+import argparse, asyncio, time
+import numpy as np
+import httpx
+from logger import config_logger, log_message
+
+async def run_load_test(base_url: str, paths: list, concurrency: int=50, requests: int=2000, timeout: float=30.0):
+    """
+    This is a function that sends requests to a running instance of the API from a number of concurrent clients,
+    to compare the throughput of its sync and async database modes.
+
+    Args:
+        base_url(str): the url the API is served at
+        paths(list): the paths requested, in turns
+        concurrency(int): the number of requests in flight at the same time
+        requests(int): the total number of requests
+        timeout(float): the number of seconds a request may take
+    Returns:
+        stats(dict): the requests per second, the 50th and 95th percentile latencies in milliseconds and the number of failed requests
+    """
+    latencies, failures = [], 0
+    counter = iter(range(requests))
+
+    async def client_loop(client: httpx.AsyncClient):
+        nonlocal failures
+        for index in counter:
+            start = time.perf_counter()
+            try:
+                response = await client.get(paths[index % len(paths)])
+                if response.status_code >= 500: failures += 1
+            except httpx.HTTPError:
+                failures += 1
+            latencies.append(time.perf_counter() - start)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        # warm up the connection pools of the API before measuring
+        await asyncio.gather(*[client.get(paths[0]) for _ in range(concurrency)])
+
+        start = time.perf_counter()
+        await asyncio.gather(*[client_loop(client) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+    return {
+        'requests_per_second': requests / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p95_ms': float(np.percentile(latencies, 95) * 1000),
+        'failures': failures,
+    }
+
+if __name__ == "__main__":
+    # initialize argparse
+    parser = argparse.ArgumentParser(
+        prog='API Load Test',
+        description='Measures the requests per second a running instance of the API serves, run it once against each database mode to compare them.'
+    )
+
+    # define arguments for the script
+    parser.add_argument('--base_url', type=str, default='http://127.0.0.1:8000', help='the url the API is served at')
+    parser.add_argument('--paths', type=str, nargs='+', default=['/channels/', '/messages/?limit=50', '/product-prices-transformed/?limit=50'], help='the paths requested, in turns')
+    parser.add_argument('--concurrency', type=int, default=50, help='the number of requests in flight at the same time')
+    parser.add_argument('--requests', type=int, default=2000, help='the total number of requests')
+
+    # obtain the passed arguments
+    args = parser.parse_args()
+
+    # configure the logger
+    config_logger(log_file='log.log')
+
+    stats = asyncio.run(run_load_test(base_url=args.base_url, paths=args.paths, concurrency=args.concurrency, requests=args.requests))
+    log_message(msg=f"{stats['requests_per_second']:.0f} requests per second, p50 {stats['p50_ms']:.1f} ms, p95 {stats['p95_ms']:.1f} ms, {stats['failures']} failures")
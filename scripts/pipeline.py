@@ -0,0 +1,261 @@
+import os, argparse, asyncio, queue, threading, time
+import pandas as pd
+from typing import List
+from telethon import TelegramClient
+from dotenv import load_dotenv
+from telegram_scrapper import CheckpointStore, MediaDownloader, scrape_channel_incremental
+from data_cleaner import Preprocessor
+from data_pusher import DB_Client
+from data_io import MESSAGE_SCHEMA
+from logger import config_logger, log_message
+
+async def batch_rows(rows: asyncio.Queue, batches: queue.Queue, batch_size: int=500, flush_interval: float=5.0):
+    """
+    This is a function that groups the rows put on the queue by the scrapper into dataframes and hands them to the cleaning stage.
+    A batch is handed over once it is full or once its oldest row has waited flush_interval seconds, so quiet channels aren't held back.
+    Callables put on the queue, e.g. checkpoint updates, are handed over right behind the rows put before them.
+
+    Args:
+        rows(asyncio.Queue): the queue of rows, a None on the queue stops the function
+        batches(queue.Queue): the bounded queue of the cleaning stage, putting on it blocks while it is full
+        batch_size(int): the number of rows in a full batch
+        flush_interval(float): the maximum number of seconds a row waits for its batch to fill up
+    Returns:
+        None
+    """
+    buffer = []
+    deadline = None
+
+    async def hand_over(item: any):
+        # the put runs on a thread, so a full queue holds back the scrapper without blocking the event loop
+        await asyncio.to_thread(batches.put, item)
+
+    async def flush():
+        nonlocal buffer, deadline
+        if buffer: await hand_over(pd.DataFrame(buffer, columns=MESSAGE_SCHEMA.names))
+        buffer, deadline = [], None
+
+    while True:
+        try:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            row = await asyncio.wait_for(rows.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            await flush()
+            continue
+
+        if row is None:
+            await flush()
+            await hand_over(None)
+            break
+        if callable(row):
+            await flush()
+            await hand_over(row)
+            continue
+
+        buffer.append(row)
+        if deadline is None: deadline = time.monotonic() + flush_interval
+        if len(buffer) >= batch_size: await flush()
+
+def clean_batches(batches: queue.Queue, cleaned: queue.Queue, stats: dict):
+    """
+    This is a function that runs the cleaning stage, it drops the empty messages of every batch and preprocesses the rest.
+    A batch that can't be cleaned is replaced by its exception, so the pushing stage knows rows went missing.
+
+    Args:
+        batches(queue.Queue): the queue of scraped batches and callables, a None on the queue stops the function
+        cleaned(queue.Queue): the bounded queue of the pushing stage
+        stats(dict): the running totals of the pipeline, updated in place
+    Returns:
+        None
+    """
+    while True:
+        batch = batches.get()
+        if isinstance(batch, pd.DataFrame):
+            started = time.perf_counter()
+            try:
+                batch = batch.dropna(subset=['message'])
+                batch['message'] = Preprocessor.preprocess_series(series=batch['message'])
+                stats['cleaned'] += len(batch)
+            except Exception as e:
+                log_message(msg=f"Failed to clean a batch of {len(batch)} messages: {e}", level="ERROR")
+                batch = e
+            stats['clean_seconds'] += time.perf_counter() - started
+
+        cleaned.put(batch)
+        if batch is None: break
+
+def push_batches(cleaned: queue.Queue, client: DB_Client, stats: dict, batch_size: int=10000):
+    """
+    This is a function that runs the pushing stage, it upserts every cleaned batch and calls the callables once the rows before them are stored.
+    Every batch is pushed in its own transaction. After a batch fails no more callables are called, so the checkpoints stay behind the
+    lost rows and the next run fetches them again.
+
+    Args:
+        cleaned(queue.Queue): the queue of cleaned batches, exceptions and callables, a None on the queue stops the function
+        client(DB_Client): the client the batches are pushed with
+        stats(dict): the running totals of the pipeline, updated in place
+        batch_size(int): the number of messages copied at a time
+    Returns:
+        None
+    """
+    # the upserts rely on the natural key indexes, they are created once, without them every push fails and no checkpoint moves
+    failed = not client.ensure_natural_keys()
+    while True:
+        batch = cleaned.get()
+        if batch is None: break
+
+        if isinstance(batch, pd.DataFrame):
+            started = time.perf_counter()
+            try:
+                # the upsert skips the messages that are already stored, so fetching rows twice never duplicates them
+                stats['pushed'] += client.push_batch(data=batch, batch_size=batch_size)
+                stats['batches'] += 1
+            except Exception as e:
+                log_message(msg=f"Failed to push a batch of {len(batch)} messages: {e}", level="ERROR")
+                failed = True
+            stats['push_seconds'] += time.perf_counter() - started
+        elif isinstance(batch, Exception):
+            failed = True
+        elif not failed:
+            batch()
+
+async def run_pipeline(client: TelegramClient, telegram_channels: List[str], db_client: DB_Client, save_path: str, concurrency: int=5, max_retries: int=3, download_workers: int=4, download_retries: int=3, backfill: bool=False, batch_size: int=1000, push_batch_size: int=500, queue_size: int=8, flush_interval: float=5.0):
+    """
+    This is a function that scrapes telegram channels, cleans their messages and pushes them to the database in one streaming run.
+    The scrapper, the cleaning stage and the pushing stage run at the same time and are connected by bounded queues,
+    so a slow stage holds back the ones before it instead of piling up rows in memory. Nothing is written to disk but the photos and
+    the checkpoints, which are only moved once the messages they cover are in the database.
+
+    Args:
+        client(telethon.TelegramClient): an instance of a telethon TelegramClient class
+        telegram_channels(List[str]): a list of telegram channel usernames
+        db_client(DB_Client): the client the messages are pushed with
+        save_path(str): the path to the folder the photos are saved to, the checkpoints are kept in scrape_state.json inside it
+        concurrency(int): the number of channels scraped at the same time
+        max_retries(int): the number of flood waits to sit out for a channel before giving up on it
+        download_workers(int): the number of photos downloaded at the same time
+        download_retries(int): the number of times a failed photo download is retried
+        backfill(bool): whether to page through the full history of the channels
+        batch_size(int): the number of messages fetched for every backfill batch
+        push_batch_size(int): the number of messages cleaned and pushed at a time
+        queue_size(int): the number of batches that can wait between two stages
+        flush_interval(float): the maximum number of seconds a message waits for its batch to fill up
+    Returns:
+        stats(dict): the number of messages cleaned and pushed, the number of batches pushed and the seconds spent in each stage
+    """
+    # start up the client
+    await client.start()
+
+    # Create a directory for media files
+    media_dir = os.path.join(save_path, 'media')
+    os.makedirs(media_dir, exist_ok=True)
+
+    # load the high-water marks of the earlier runs
+    checkpoints = CheckpointStore(os.path.join(save_path, 'scrape_state.json'))
+
+    # the cleaning and pushing stages run on their own threads, connected by bounded queues
+    stats = {'cleaned': 0, 'pushed': 0, 'batches': 0, 'clean_seconds': 0.0, 'push_seconds': 0.0}
+    batches, cleaned = queue.Queue(maxsize=queue_size), queue.Queue(maxsize=queue_size)
+    stages = [
+        threading.Thread(target=clean_batches, args=(batches, cleaned, stats), name='clean'),
+        threading.Thread(target=push_batches, args=(cleaned, db_client, stats), name='push'),
+    ]
+    for stage in stages: stage.start()
+
+    started = time.perf_counter()
+    rows = asyncio.Queue(maxsize=push_batch_size)
+    batcher_task = asyncio.create_task(batch_rows(rows, batches, batch_size=push_batch_size, flush_interval=flush_interval))
+    try:
+        # the photos are downloaded on their own pool, so iterating over the messages doesn't wait on them
+        downloader = MediaDownloader(client, workers=download_workers, max_retries=download_retries)
+        downloader.start()
+
+        # scrape the channels concurrently into the pipeline
+        semaphore = asyncio.Semaphore(concurrency)
+        results = await asyncio.gather(
+            *(scrape_channel_incremental(client, channel, rows, media_dir, semaphore, checkpoints, max_retries, downloader, backfill, batch_size) for channel in telegram_channels),
+            return_exceptions=True
+        )
+    finally:
+        # drain the pipeline once every channel is done
+        await rows.put(None)
+        await batcher_task
+        for stage in stages: await asyncio.to_thread(stage.join)
+
+    # wait for the remaining photos
+    await downloader.close()
+
+    for channel, result in zip(telegram_channels, results):
+        if isinstance(result, Exception): log_message(msg=f"{channel} scrapping failed: {result}", level="ERROR")
+
+    seconds = time.perf_counter() - started
+    log_message(msg=f"Pushed {stats['pushed']} of {stats['cleaned']} cleaned messages in {stats['batches']} batches in {seconds:.2f}s "
+                    f"(cleaning {stats['clean_seconds']:.2f}s, pushing {stats['push_seconds']:.2f}s).")
+
+    return stats
+
+if __name__ == "__main__":
+    # initialize argparse
+    parser = argparse.ArgumentParser(
+        prog='Telegram Pipeline',
+        description='Scrapes the messages of telegram channels, cleans them and pushes them to a postgres database in a single streaming run.'
+    )
+
+    # define arguments for the script
+    parser.add_argument('--path', type=str, default='./data/', help='the path to store the photos and the scrapping checkpoints')
+    parser.add_argument('--env_path', default='.env', help='the path to the .env file which contains the telegram and database connection params')
+    parser.add_argument('--concurrency', type=int, default=5, help='the number of channels to scrape at the same time')
+    parser.add_argument('--max_retries', type=int, default=3, help='the number of flood waits to sit out for a channel before giving up on it')
+    parser.add_argument('--download_workers', type=int, default=4, help='the number of photos to download at the same time')
+    parser.add_argument('--download_retries', type=int, default=3, help='the number of times a failed photo download is retried')
+    parser.add_argument('--backfill', action='store_true', help='page through the full history of the channels, resuming where an earlier backfill stopped')
+    parser.add_argument('--batch_size', type=int, default=1000, help='the number of messages fetched for every backfill batch')
+    parser.add_argument('--push_batch_size', type=int, default=500, help='the number of messages cleaned and pushed at a time')
+    parser.add_argument('--queue_size', type=int, default=8, help='the number of batches that can wait between two stages')
+    parser.add_argument('--flush_interval', type=float, default=5.0, help='the maximum number of seconds a message waits for its batch to fill up')
+
+    # obtain the passed arguments
+    args = parser.parse_args()
+
+    # configure the logger
+    config_logger(log_file='log.log')
+
+    # Load environment variables once
+    load_dotenv(args.env_path)
+
+    # create a database client
+    db_client = DB_Client(
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT"),
+        user_name=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        database_name=os.getenv("DB_NAME")
+    )
+
+    # Initialize the client once
+    client = TelegramClient('scraping_session', os.getenv('API_ID'), os.getenv('API_HASH'))
+    log_message(msg="Client Initialization Succcessful")
+
+    # list the channels to be scraped
+    channels = ['@DoctorsET', '@lobelia4cosmetics', '@yetenaweg']
+
+    with client:
+        client.loop.run_until_complete(
+            run_pipeline(
+                client=client,
+                telegram_channels=channels,
+                db_client=db_client,
+                save_path=args.path,
+                concurrency=args.concurrency,
+                max_retries=args.max_retries,
+                download_workers=args.download_workers,
+                download_retries=args.download_retries,
+                backfill=args.backfill,
+                batch_size=args.batch_size,
+                push_batch_size=args.push_batch_size,
+                queue_size=args.queue_size,
+                flush_interval=args.flush_interval
+            )
+        )
+
+    db_client.close()
@@ -1,62 +1,369 @@
-import csv, os, argparse
+import csv, os, argparse, asyncio, json
 from typing import List
+from functools import partial
 from telethon import TelegramClient
+from telethon.errors import FloodWaitError
 from dotenv import load_dotenv
+from data_io import MESSAGE_SCHEMA, ParquetPartWriter
 
-async def scrape_channel(client : TelegramClient, channel_username: str, writer: any, media_dir: str):
+class MediaDownloader:
     """
-    This is a function that will write messages found from a telegram channel into a csv file.
+    A bounded pool of async workers that download the photos of messages, so iterating over the messages never waits on a download.
+
+    Attributes:
+        client(telethon.TelegramClient): the client the photos are downloaded with
+        workers(int): the number of photos downloaded at the same time
+        max_retries(int): the number of times a failed download is retried before it is counted as failed
+        retry_delay(float): the seconds waited before the first retry, doubled on every following retry
+        stats(dict): the number of downloads that were queued, finished, failed and skipped because the file already exists
+    """
+
+    def __init__(self, client: TelegramClient, workers: int=4, max_retries: int=3, retry_delay: float=1.0, queue_size: int=100):
+        """
+        Initializes the downloader, the workers are started with start.
+
+        Args:
+            client(telethon.TelegramClient): the client the photos are downloaded with
+            workers(int): the number of photos downloaded at the same time
+            max_retries(int): the number of times a failed download is retried before it is counted as failed
+            retry_delay(float): the seconds waited before the first retry, doubled on every following retry
+            queue_size(int): the number of downloads that can wait for a worker before submit blocks
+        """
+        self.client = client
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.tasks = []
+        self.stats = {'queued': 0, 'finished': 0, 'failed': 0, 'skipped': 0}
+
+    def start(self):
+        """
+        Starts the worker tasks, must be called from a running event loop.
+        """
+        self.tasks = [asyncio.create_task(self.__work()) for _ in range(self.workers)]
+
+    async def submit(self, media: any, media_path: str):
+        """
+        Queues the download of a photo, photos that already exist on disk are skipped.
+
+        Args:
+            media(any): the media of a telegram message
+            media_path(str): the path to save the photo to
+        """
+        if os.path.exists(media_path):
+            self.stats['skipped'] += 1
+            return
+
+        self.stats['queued'] += 1
+        await self.queue.put((media, media_path))
+
+    async def __download(self, media: any, media_path: str):
+        """
+        Downloads a photo, retrying with an exponential backoff when the download fails. The photo is written to a '.part'
+        file that is renamed once the download finished, so an interrupted download never leaves a truncated photo that later runs skip.
+
+        Args:
+            media(any): the media of a telegram message
+            media_path(str): the path to save the photo to
+        """
+        part_path = media_path + '.part'
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.client.download_media(media, part_path)
+                os.replace(part_path, media_path)
+                self.stats['finished'] += 1
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.stats['failed'] += 1
+                    print(f"Failed to download {media_path}: {e}")
+                    if os.path.exists(part_path): os.remove(part_path)
+                    return
+                await asyncio.sleep(e.seconds if isinstance(e, FloodWaitError) else self.retry_delay * 2 ** attempt)
+
+    async def __work(self):
+        """
+        Takes downloads off the queue until the task is cancelled.
+        """
+        while True:
+            media, media_path = await self.queue.get()
+            try:
+                await self.__download(media, media_path)
+            finally:
+                self.queue.task_done()
+
+    async def close(self):
+        """
+        Waits for the queued downloads to be done and stops the workers.
+        """
+        await self.queue.join()
+        for task in self.tasks: task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+class CheckpointStore:
+    """
+    A JSON state file that records the scrapping high-water marks of every channel, so a run only fetches what earlier runs haven't.
+    For every channel it keeps the newest ('last_id') and oldest ('oldest_id') message ids that were written to the dataset,
+    and whether the full history of the channel was backfilled ('backfill_done').
+
+    Attributes:
+        path(str): the path to the JSON state file
+        state(dict): the checkpoint of every channel username
+    """
+
+    def __init__(self, path: str):
+        """
+        Initializes the store, loading the state file if it exists.
+
+        Args:
+            path(str): the path to the JSON state file
+        """
+        self.path = path
+        self.state = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                self.state = json.load(file)
+
+    def get(self, channel_username: str):
+        """
+        Returns a copy of the checkpoint of a channel, empty if the channel was never scraped.
+
+        Args:
+            channel_username(str): the username of a telegram channel, starts with @
+        Returns:
+            checkpoint(dict): the checkpoint of the channel
+        """
+        return dict(self.state.get(channel_username, {}))
+
+    def update(self, channel_username: str, **fields):
+        """
+        Updates the checkpoint of a channel and saves the state file.
+
+        Args:
+            channel_username(str): the username of a telegram channel, starts with @
+            fields: the fields of the checkpoint to update
+        """
+        self.state.setdefault(channel_username, {}).update(fields)
+        self.save()
+
+    def save(self):
+        """
+        Writes the state to a temporary file and moves it over the state file, so a crash never leaves a half written file.
+        """
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            json.dump(self.state, file, indent=2)
+        os.replace(temporary_path, self.path)
+
+async def scrape_channel(client : TelegramClient, channel_username: str, queue: asyncio.Queue, media_dir: str, progress: dict=None, downloader: MediaDownloader=None, limit: int=1000, min_id: int=0):
+    """
+    This is a function that will put the messages found from a telegram channel on a queue, to be written into a csv file.
+    The messages are fetched from the newest to the oldest.
 
     Args:
         client(telethon.TelegramClient): an instance of a telethon TelegramClient class
         channel_username(string): the username of a telegram channel, starts with @
-        writer(csv.writer): an instance of a csv writer
+        queue(asyncio.Queue): the queue the rows are put on, it is consumed by write_rows
+        media_dir(str): the path to the folder to save the photos of the messages
+        progress(dict): the id of the last message put on the queue ('last_id'), the id of the first one ('first_id') and the number
+                        of messages put on it ('count'), updated in place. When it is passed the scrapping resumes after the last message it records.
+        downloader(MediaDownloader): the pool the photos are downloaded on, the photos are downloaded inline when it is None
+        limit(int): the maximum number of messages to fetch, None to fetch all of them
+        min_id(int): only the messages with a larger id are fetched
     Returns:
         None
     """
+    if progress is None: progress = {'last_id': 0, 'first_id': 0, 'count': 0}
+
     entity = await client.get_entity(channel_username)
     channel_title = entity.title  # Extract the channel's title
-    async for message in client.iter_messages(entity, limit=1000):
+    remaining = None if limit is None else limit - progress['count']
+    async for message in client.iter_messages(entity, limit=remaining, offset_id=progress['last_id'], min_id=min_id):
         media_path = None
         if message.media and hasattr(message.media, 'photo'):
             # Create a unique filename for the photo
             filename = f"{channel_username}_{message.id}.jpg"
             media_path = os.path.join(media_dir, filename)
-            # Download the media to the specified directory if it's a photo
-            await client.download_media(message.media, media_path)
-        
+            # Download the media to the specified directory if it's a photo, without waiting for it if there is a downloader
+            if downloader is not None: await downloader.submit(message.media, media_path)
+            else: await client.download_media(message.media, media_path)
+
         # Write the channel title along with other data
-        writer.writerow([channel_title, channel_username, message.id, message.message, message.date, media_path])
+        await queue.put([channel_title, channel_username, message.id, message.message, message.date, media_path])
+        progress['first_id'] = progress.get('first_id') or message.id
+        progress['last_id'] = message.id
+        progress['count'] += 1
 
-async def obtain_channel_ads(client: TelegramClient, telegram_channels: List[str], save_path: str):
+async def scrape_channel_with_backoff(client: TelegramClient, channel_username: str, queue: asyncio.Queue, media_dir: str, max_retries: int=3, downloader: MediaDownloader=None, progress: dict=None, limit: int=1000, min_id: int=0):
     """
-    This is a function that wrappers the scrape_channel function and run it over multiple telegram channels.
+    This is a function that runs scrape_channel, waiting out flood waits that telethon doesn't handle by itself.
+    After a flood wait the scrapping resumes from the last message that was put on the queue, so no row is written twice.
+
+    Args:
+        client(telethon.TelegramClient): an instance of a telethon TelegramClient class
+        channel_username(string): the username of a telegram channel, starts with @
+        queue(asyncio.Queue): the queue the rows are put on, it is consumed by write_rows
+        media_dir(str): the path to the folder to save the photos of the messages
+        max_retries(int): the number of flood waits to sit out before giving up on the channel
+        downloader(MediaDownloader): the pool the photos are downloaded on
+        progress(dict): the progress of the scrapping as described in scrape_channel, updated in place
+        limit(int): the maximum number of messages to fetch, None to fetch all of them
+        min_id(int): only the messages with a larger id are fetched
+    Returns:
+        progress(dict): the ids of the first and last messages put on the queue and the number of messages put on it
+    """
+    if progress is None: progress = {'last_id': 0, 'first_id': 0, 'count': 0}
+    for attempt in range(max_retries + 1):
+        try:
+            await scrape_channel(client, channel_username, queue, media_dir, progress=progress, downloader=downloader, limit=limit, min_id=min_id)
+            return progress
+        except FloodWaitError as e:
+            if attempt == max_retries: raise
+            print(f"Flood wait of {e.seconds}s while scrapping {channel_username}, retrying ({attempt + 1}/{max_retries})")
+            await asyncio.sleep(e.seconds)
+
+async def scrape_channel_incremental(client: TelegramClient, channel_username: str, queue: asyncio.Queue, media_dir: str, semaphore: asyncio.Semaphore, checkpoints: CheckpointStore, max_retries: int=3, downloader: MediaDownloader=None, backfill: bool=False, batch_size: int=1000):
+    """
+    This is a function that scrapes the messages of a channel that are newer than its checkpoint, once the semaphore allows it.
+    A channel without a checkpoint gets its latest 1000 messages. When backfilling, the history older than the oldest scraped
+    message is then paged through in batches, the checkpoint is moved after every batch so an interrupted backfill resumes where it stopped.
+    The checkpoints are put on the queue behind the rows they cover, so they are only saved once those rows are in the file.
+
+    Args:
+        client(telethon.TelegramClient): an instance of a telethon TelegramClient class
+        channel_username(string): the username of a telegram channel, starts with @
+        queue(asyncio.Queue): the queue the rows are put on, it is consumed by write_rows
+        media_dir(str): the path to the folder to save the photos of the messages
+        semaphore(asyncio.Semaphore): limits the number of channels scraped at the same time
+        checkpoints(CheckpointStore): the store of the channel high-water marks
+        max_retries(int): the number of flood waits to sit out before giving up on the channel
+        downloader(MediaDownloader): the pool the photos are downloaded on
+        backfill(bool): whether to page through the history older than the oldest scraped message
+        batch_size(int): the number of messages fetched for every backfill batch
+    Returns:
+        None
+    """
+    async with semaphore:
+        print(f"********** {channel_username} scrapping started **********")
+        checkpoint = checkpoints.get(channel_username)
+        last_id = checkpoint.get('last_id', 0)
+
+        # fetch every message newer than the high-water mark, or the latest messages on the first run
+        progress = await scrape_channel_with_backoff(client, channel_username, queue, media_dir, max_retries, downloader, limit=None if last_id else 1000, min_id=last_id)
+        if progress['count']:
+            checkpoint['last_id'] = max(last_id, progress['first_id'])
+            checkpoint['oldest_id'] = checkpoint.get('oldest_id') or progress['last_id']
+            await queue.put(partial(checkpoints.update, channel_username, **checkpoint))
+
+        # page through the older history in batches
+        while backfill and checkpoint.get('oldest_id') and not checkpoint.get('backfill_done'):
+            progress = {'last_id': checkpoint['oldest_id'], 'first_id': 0, 'count': 0}
+            try:
+                await scrape_channel_with_backoff(client, channel_username, queue, media_dir, max_retries, downloader, progress=progress, limit=batch_size)
+                if progress['count'] < batch_size: checkpoint['backfill_done'] = True
+            finally:
+                # the older history is fetched without gaps, so even a failed batch can move the checkpoint
+                if progress['count']: checkpoint['oldest_id'] = progress['last_id']
+                await queue.put(partial(checkpoints.update, channel_username, **checkpoint))
+            print(f"{channel_username} backfilled {progress['count']} messages, oldest id is now {checkpoint['oldest_id']}")
+
+        print(f"********** {channel_username} scrapping finished **********")
+
+async def write_rows(queue: asyncio.Queue, writer: any, file: any=None):
+    """
+    This is a function that writes the rows put on the queue with a csv writer, it is the only task that writes to the file.
+    Callables put on the queue, e.g. checkpoint updates, are called once the rows put before them are flushed to the file.
+
+    Args:
+        queue(asyncio.Queue): the queue of rows, a None on the queue stops the function
+        writer(csv.writer): an instance of a csv writer
+        file(file): the file the csv writer writes to, flushed before a callable is called
+    Returns:
+        None
+    """
+    while True:
+        row = await queue.get()
+        if row is None: break
+        if callable(row):
+            if file is not None: file.flush()
+            row()
+        else:
+            writer.writerow(row)
+
+async def obtain_channel_ads(client: TelegramClient, telegram_channels: List[str], save_path: str, concurrency: int=5, max_retries: int=3, download_workers: int=4, download_retries: int=3, backfill: bool=False, batch_size: int=1000, output_format: str='csv'):
+    """
+    This is a function that wrappers the scrape_channel function and run it concurrently over multiple telegram channels.
+    Only the messages newer than the checkpoint of a channel are fetched, they are appended to the dataset of the earlier runs.
 
     Args:
         clinet(telethon.TelegramClient): an instance of a telethon TelegramClient class
         telegram_channels(List[str]): a list of telegram channel usernames
-        save_path(str): the path to the folder to save the scrapping result
+        save_path(str): the path to the folder to save the scrapping result, the checkpoints are kept in scrape_state.json inside it
+        concurrency(int): the number of channels scraped at the same time
+        max_retries(int): the number of flood waits to sit out for a channel before giving up on it
+        download_workers(int): the number of photos downloaded at the same time
+        download_retries(int): the number of times a failed photo download is retried
+        backfill(bool): whether to page through the full history of the channels
+        batch_size(int): the number of messages fetched for every backfill batch
+        output_format(str): 'csv' to write telegram_data.csv, 'parquet' to write part files to the telegram_data folder
     Returns:
-        None
+        downloader(MediaDownloader): the pool the photos were downloaded on, its stats hold the download counters
     """
     # start up the client
     await client.start()
-    
+
     # Create a directory for media files
-    csv_path = os.path.join(save_path, 'telegram_data.csv')
     media_dir = os.path.join(save_path, 'media')
     os.makedirs(media_dir, exist_ok=True)
 
-    # Open the CSV file and prepare the writer
-    with open(csv_path, 'w', newline='', encoding='utf-8') as file:
+    # load the high-water marks of the earlier runs
+    checkpoints = CheckpointStore(os.path.join(save_path, 'scrape_state.json'))
+
+    if output_format == 'parquet':
+        # every run adds its own part files to the telegram_data folder
+        writer = ParquetPartWriter(folder=os.path.join(save_path, 'telegram_data'), schema=MESSAGE_SCHEMA)
+        file = writer
+    else:
+        # Open the CSV file and prepare the writer, the header is only written to a new file
+        csv_path = os.path.join(save_path, 'telegram_data.csv')
+        write_header = not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0
+        file = open(csv_path, 'a', newline='', encoding='utf-8')
         writer = csv.writer(file)
-        writer.writerow(['channel_title', 'channel_username', 'id', 'message', 'date', 'media_path']) 
-        
-        # Iterate over channels and scrape data into the single CSV file
-        for channel in telegram_channels:
-            print(f"********** {channel} scrapping started **********")
-            await scrape_channel(client, channel, writer, media_dir)
-            print(f"********** {channel} scrapping finished **********")
+        if write_header: writer.writerow(MESSAGE_SCHEMA.names)
+
+    try:
+        # a single task writes the rows of every channel, so the rows never interleave
+        queue = asyncio.Queue(maxsize=1000)
+        writer_task = asyncio.create_task(write_rows(queue, writer, file))
+
+        # the photos are downloaded on their own pool, so iterating over the messages doesn't wait on them
+        downloader = MediaDownloader(client, workers=download_workers, max_retries=download_retries)
+        downloader.start()
+
+        # scrape the channels concurrently into the single dataset
+        semaphore = asyncio.Semaphore(concurrency)
+        results = await asyncio.gather(
+            *(scrape_channel_incremental(client, channel, queue, media_dir, semaphore, checkpoints, max_retries, downloader, backfill, batch_size) for channel in telegram_channels),
+            return_exceptions=True
+        )
+
+        # stop the writer once every channel is done
+        await queue.put(None)
+        await writer_task
+    finally:
+        file.close()
+
+    # wait for the remaining photos
+    await downloader.close()
+
+    for channel, result in zip(telegram_channels, results):
+        if isinstance(result, Exception): print(f"********** {channel} scrapping failed: {result} **********")
+
+    stats = downloader.stats
+    print(f"Media downloads: {stats['queued']} queued, {stats['finished']} finished, {stats['failed']} failed, {stats['skipped']} skipped")
+
+    return downloader
 
 if __name__ == "__main__":
     # initialize argparse
@@ -67,10 +374,24 @@ if __name__ == "__main__":
 
     # define arguments for the script
     parser.add_argument('--path', type=str, default='./data/', help='the path to store the scrapping results')
-    
+    parser.add_argument('--concurrency', type=int, default=5, help='the number of channels to scrape at the same time')
+    parser.add_argument('--max_retries', type=int, default=3, help='the number of flood waits to sit out for a channel before giving up on it')
+    parser.add_argument('--download_workers', type=int, default=4, help='the number of photos to download at the same time')
+    parser.add_argument('--download_retries', type=int, default=3, help='the number of times a failed photo download is retried')
+    parser.add_argument('--backfill', action='store_true', help='page through the full history of the channels, resuming where an earlier backfill stopped')
+    parser.add_argument('--batch_size', type=int, default=1000, help='the number of messages fetched for every backfill batch')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv', help='write telegram_data.csv or a telegram_data folder of parquet part files')
+
     # obtain the passed arguments
     args = parser.parse_args()
     path = args.path
+    concurrency = args.concurrency
+    max_retries = args.max_retries
+    download_workers = args.download_workers
+    download_retries = args.download_retries
+    backfill = args.backfill
+    batch_size = args.batch_size
+    output_format = args.format
 
     # Load environment variables once
     load_dotenv('.env')
@@ -90,6 +411,13 @@ if __name__ == "__main__":
             obtain_channel_ads(
                 client=client,
                 telegram_channels=channels,
-                save_path=path
+                save_path=path,
+                concurrency=concurrency,
+                max_retries=max_retries,
+                download_workers=download_workers,
+                download_retries=download_retries,
+                backfill=backfill,
+                batch_size=batch_size,
+                output_format=output_format
             )
         )
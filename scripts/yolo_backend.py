@@ -0,0 +1,185 @@
+import ast, json
+import numpy as np
+import torch, cv2
+from types import SimpleNamespace
+
+def letterbox(image: np.ndarray, size: int=640, color: tuple=(114, 114, 114)):
+    """
+    A function that shrinks or grows an image to fit a square of the given size, keeping its aspect ratio, and pads the rest.
+
+    Args:
+        image(np.ndarray): the decoded image
+        size(int): the side of the square the model was exported for
+        color(tuple): the color of the padding
+    Returns:
+        image(np.ndarray): the padded square image
+        ratio(float): the factor the image was resized by
+        pad(tuple): the number of pixels padded to the left and the top of the image
+    """
+    height, width = image.shape[:2]
+    ratio = min(size / height, size / width)
+    new_width, new_height = round(width * ratio), round(height * ratio)
+    if (new_width, new_height) != (width, height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+
+    # split the padding between both sides of the image
+    left, top = (size - new_width) // 2, (size - new_height) // 2
+    image = cv2.copyMakeBorder(image, top, size - new_height - top, left, size - new_width - left, cv2.BORDER_CONSTANT, value=color)
+
+    return image, ratio, (left, top)
+
+def non_max_suppression(prediction: torch.Tensor, conf_threshold: float=0.25, iou_threshold: float=0.45, max_detections: int=1000):
+    """
+    A function that turns the raw predictions of a YOLOv5 model for an image into boxes, dropping the boxes that overlap a better box of the same class.
+
+    Args:
+        prediction(torch.Tensor): the predictions of the image, one row of center x, center y, width, height, objectness and class scores for every anchor
+        conf_threshold(float): the minimum confidence of a box
+        iou_threshold(float): the overlap above which the box with the lower confidence is dropped
+        max_detections(int): the maximum number of boxes kept
+    Returns:
+        boxes(torch.Tensor): one row of x1, y1, x2, y2, confidence and class for every box, by descending confidence
+    """
+    # the confidence of a box is its objectness times the score of its best class
+    prediction = prediction[prediction[:, 4] > conf_threshold]
+    confidence, classes = (prediction[:, 5:] * prediction[:, 4:5]).max(dim=1)
+    keep = confidence > conf_threshold
+    prediction, confidence, classes = prediction[keep], confidence[keep], classes[keep]
+
+    # convert the centers and sizes into corners
+    boxes = torch.cat([prediction[:, :2] - prediction[:, 2:4] / 2, prediction[:, :2] + prediction[:, 2:4] / 2], dim=1)
+
+    # boxes of different classes are moved apart, so they never suppress each other
+    shifted = boxes + classes[:, None].to(boxes.dtype) * 4096
+    areas = (shifted[:, 2] - shifted[:, 0]) * (shifted[:, 3] - shifted[:, 1])
+
+    order = confidence.argsort(descending=True)
+    kept = []
+    while order.numel() and len(kept) < max_detections:
+        best, rest = order[0], order[1:]
+        kept.append(best)
+
+        # the overlap of the best box with the boxes left
+        top_left = torch.maximum(shifted[best, :2], shifted[rest, :2])
+        bottom_right = torch.minimum(shifted[best, 2:], shifted[rest, 2:])
+        intersection = (bottom_right - top_left).clamp(min=0).prod(dim=1)
+        iou = intersection / (areas[best] + areas[rest] - intersection)
+        order = rest[iou <= iou_threshold]
+
+    kept = torch.stack(kept) if kept else torch.zeros(0, dtype=torch.long)
+    return torch.cat([boxes[kept], confidence[kept, None], classes[kept, None].to(boxes.dtype)], dim=1)
+
+class LocalDetector:
+    """
+    Runs a YOLOv5 model exported to ONNX or TorchScript from a local file, with the same call interface as the torch hub model.
+    The images are letterboxed to the square the model was exported for and the raw predictions go through non max suppression,
+    so the boxes come back in the coordinates of the images that were passed. The channels of the images are passed through
+    as they are, like the torch hub model does.
+
+    Attributes:
+        path(str): the path to the .onnx or .torchscript file
+        image_size(int): the side of the square the model was exported for
+        conf_threshold(float): the minimum confidence of a box
+        iou_threshold(float): the overlap above which the box with the lower confidence is dropped
+        max_detections(int): the maximum number of boxes kept for every image
+        names(dict): the class names of the model, by class index
+    """
+
+    def __init__(self, path: str, image_size: int=640, conf_threshold: float=0.25, iou_threshold: float=0.45, max_detections: int=1000):
+        """
+        Initializes the detector, loading the model with ONNX Runtime if the path ends with .onnx and as TorchScript otherwise.
+
+        Args:
+            path(str): the path to the .onnx or .torchscript file
+            image_size(int): the side of the square the model was exported for, taken from the model if it records it
+            conf_threshold(float): the minimum confidence of a box
+            iou_threshold(float): the overlap above which the box with the lower confidence is dropped
+            max_detections(int): the maximum number of boxes kept for every image
+        """
+        self.path = path
+        self.image_size = image_size
+        self.conf_threshold = conf_threshold
+        self.iou_threshold = iou_threshold
+        self.max_detections = max_detections
+        self.batch_size = None
+
+        if path.endswith('.onnx'): self.__load_onnx()
+        else: self.__load_torchscript()
+
+    def __load_onnx(self):
+        """
+        Loads the model into an ONNX Runtime session, the class names are read from the metadata YOLOv5 exports.
+        """
+        # onnxruntime is only needed by this backend
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(self.path, providers=['CPUExecutionProvider'])
+        self.module = None
+
+        # a model exported without dynamic axes only takes batches of a fixed size
+        input = self.session.get_inputs()[0]
+        self.input_name = input.name
+        if isinstance(input.shape[0], int): self.batch_size = input.shape[0]
+        if isinstance(input.shape[2], int): self.image_size = input.shape[2]
+
+        names = self.session.get_modelmeta().custom_metadata_map.get('names')
+        self.names = ast.literal_eval(names) if names else {}
+
+    def __load_torchscript(self):
+        """
+        Loads the TorchScript module, the class names are read from the config.txt YOLOv5 exports next to it.
+        """
+        extra_files = {'config.txt': ''}
+        self.module = torch.jit.load(self.path, _extra_files=extra_files, map_location='cpu').eval()
+        self.session = None
+
+        config = json.loads(extra_files['config.txt'] or '{}')
+        if config.get('shape'): self.image_size = config['shape'][2]
+        self.names = {int(index): name for index, name in config.get('names', {}).items()} if isinstance(config.get('names'), dict) else dict(enumerate(config.get('names', [])))
+
+    def __predict(self, batch: np.ndarray):
+        """
+        Runs the model over a batch of letterboxed images.
+
+        Args:
+            batch(np.ndarray): the images as a float32 array of shape (images, 3, size, size) with values between 0 and 1
+        Returns:
+            prediction(torch.Tensor): the raw predictions of every image
+        """
+        if self.session is not None:
+            return torch.from_numpy(self.session.run(None, {self.input_name: batch})[0])
+
+        with torch.inference_mode():
+            prediction = self.module(torch.from_numpy(batch))
+        return prediction[0] if isinstance(prediction, (tuple, list)) else prediction
+
+    def __call__(self, images: list):
+        """
+        Detects the objects in a list of images.
+
+        Args:
+            images(list): the decoded images
+        Returns:
+            results(SimpleNamespace): xyxy holds the boxes of every image, one row of x1, y1, x2, y2, confidence and class for every object
+        """
+        letterboxed = [letterbox(image, size=self.image_size) for image in images]
+        batch = np.stack([image for image, _, _ in letterboxed]).transpose(0, 3, 1, 2).astype(np.float32) / 255
+
+        # models exported for a fixed batch size are run a batch of that size at a time, the last batch is padded
+        step = self.batch_size or len(images)
+        predictions = []
+        for start in range(0, len(images), step):
+            chunk = batch[start:start + step]
+            if len(chunk) < step: chunk = np.concatenate([chunk, np.zeros((step - len(chunk),) + chunk.shape[1:], dtype=np.float32)])
+            predictions.extend(self.__predict(np.ascontiguousarray(chunk)).float()[:len(images) - start])
+
+        xyxy = []
+        for image, (_, ratio, (left, top)), prediction in zip(images, letterboxed, predictions):
+            boxes = non_max_suppression(prediction, conf_threshold=self.conf_threshold, iou_threshold=self.iou_threshold, max_detections=self.max_detections)
+
+            # map the boxes from the letterboxed square back onto the image
+            boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - left) / ratio).clamp(0, image.shape[1])
+            boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - top) / ratio).clamp(0, image.shape[0])
+            xyxy.append(boxes)
+
+        return SimpleNamespace(xyxy=xyxy)
@@ -0,0 +1,127 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import Column, Select, select
+from typing import Literal, Optional
+from datetime import date
+from database import AsyncSessionLocal
+from routes import DEFAULT_LIMIT, MAX_LIMIT, EXPORT_CHUNK_SIZE, page_statement, make_page, fast_statement, fetch_rows, render, filter_channel, filter_dates, serialize_rows, export_response, export_statement
+import models
+import schemas
+
+# the same endpoints as routes.py, served from the event loop instead of a thread pool
+router = APIRouter()
+
+# Dependency to get the async database session
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def paginate(db: AsyncSession, statement: Select, key: Column, limit: int, cursor: Optional[str], schema: type):
+    """
+    Fetches a page of a statement ordered by its primary key, see routes.page_statement.
+    """
+    result = await db.execute(page_statement(fast_statement(statement, schema), key, limit, cursor))
+    return make_page(fetch_rows(result), key, limit)
+
+async def export_rows(statement: Select, format: str):
+    """
+    Streams the rows of a statement as newline delimited json or csv, like routes.export_rows,
+    awaiting every chunk of the server side cursor instead of blocking on it.
+
+    Args:
+        statement(Select): the filtered, column projected statement of the rows
+        format(str): ndjson or csv
+    Returns:
+        chunks(async generator): the serialized chunks of rows
+    """
+    names = [column.key for column in statement.selected_columns]
+
+    # the csv header is sent before the first row is fetched
+    if format == 'csv': yield serialize_rows([], names, format)
+
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(statement.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+        async for rows in result.partitions():
+            yield serialize_rows(rows, names, format)
+
+@router.get("/image-detection/", response_model=schemas.Page[schemas.ImageDetection])
+async def get_image_detections(limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    return render(await paginate(db, select(models.ImageDetection), models.ImageDetection.id, limit, cursor, schemas.ImageDetection))
+
+@router.get("/products-transformed/", response_model=schemas.Page[schemas.ProductsTransformed])
+async def get_products_transformed(channel_id: Optional[str] = None, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    statement = filter_channel(select(models.ProductsTransformed), models.ProductsTransformed, channel_id)
+    return render(await paginate(db, statement, models.ProductsTransformed.id, limit, cursor, schemas.ProductsTransformed))
+
+@router.get("/product-prices-transformed/", response_model=schemas.Page[schemas.ProductPricesTransformed])
+async def get_product_prices_transformed(channel_id: Optional[str] = None, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    statement = filter_channel(select(models.ProductPricesTransformed), models.ProductPricesTransformed, channel_id)
+    return render(await paginate(db, statement, models.ProductPricesTransformed.id, limit, cursor, schemas.ProductPricesTransformed))
+
+@router.get("/phone-numbers-transformed/", response_model=schemas.Page[schemas.PhoneNumbersTransformed])
+async def get_phone_numbers_transformed(channel_id: Optional[str] = None, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    statement = filter_channel(select(models.PhoneNumbersTransformed), models.PhoneNumbersTransformed, channel_id)
+    return render(await paginate(db, statement, models.PhoneNumbersTransformed.id, limit, cursor, schemas.PhoneNumbersTransformed))
+
+@router.get("/messages/", response_model=schemas.Page[schemas.Message])
+async def get_messages(channel_id: Optional[str] = None, date_from: Optional[date] = None, date_to: Optional[date] = None, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    statement = filter_dates(filter_channel(select(models.Message), models.Message, channel_id), date_from, date_to)
+    return render(await paginate(db, statement, models.Message.id, limit, cursor, schemas.Message))
+
+@router.get("/channels/", response_model=schemas.Page[schemas.Channel])
+async def get_channels(limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    return render(await paginate(db, select(models.Channel), models.Channel.id, limit, cursor, schemas.Channel))
+
+@router.get("/phone-numbers/{channel_id}", response_model=schemas.Page[schemas.PhoneNumbersTransformed])
+async def get_phone_numbers_by_channel(channel_id: str, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    statement = filter_channel(select(models.PhoneNumbersTransformed), models.PhoneNumbersTransformed, channel_id)
+    phone_numbers = await paginate(db, statement, models.PhoneNumbersTransformed.id, limit, cursor, schemas.PhoneNumbersTransformed)
+    if cursor is None and not phone_numbers["items"]:
+        raise HTTPException(status_code=404, detail="Phone numbers not found for this channel ID")
+    return render(phone_numbers)
+
+@router.get("/product-prices/{channel_id}", response_model=schemas.Page[schemas.ProductPricesTransformed])
+async def get_product_prices_by_channel(channel_id: str, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    statement = filter_channel(select(models.ProductPricesTransformed), models.ProductPricesTransformed, channel_id)
+    prices = await paginate(db, statement, models.ProductPricesTransformed.id, limit, cursor, schemas.ProductPricesTransformed)
+    if cursor is None and not prices["items"]:
+        raise HTTPException(status_code=404, detail="Prices not found for this channel ID")
+    return render(prices)
+
+@router.get("/object-detection/{media_path}", response_model=list[schemas.ImageDetection])
+async def get_object_detection_by_media(media_path: str, db: AsyncSession = Depends(get_db)):
+    statement = select(models.ImageDetection).filter(models.ImageDetection.media_path == media_path).order_by(models.ImageDetection.id)
+    detections = fetch_rows(await db.execute(fast_statement(statement, schemas.ImageDetection)))
+    if not detections:
+        raise HTTPException(status_code=404, detail="Object detection results not found for this media path")
+    return render(detections)
+
+@router.get("/image-detection/export")
+async def export_image_detections(format: Literal['ndjson', 'csv'] = 'ndjson'):
+    statement = export_statement(models.ImageDetection, schemas.ImageDetection).order_by(models.ImageDetection.id)
+    return export_response(export_rows(statement, format), format, 'image_detection')
+
+@router.get("/products-transformed/export")
+async def export_products_transformed(channel_id: Optional[str] = None, format: Literal['ndjson', 'csv'] = 'ndjson'):
+    statement = filter_channel(export_statement(models.ProductsTransformed, schemas.ProductsTransformed), models.ProductsTransformed, channel_id)
+    return export_response(export_rows(statement.order_by(models.ProductsTransformed.id), format), format, 'products_transformed')
+
+@router.get("/product-prices-transformed/export")
+async def export_product_prices_transformed(channel_id: Optional[str] = None, format: Literal['ndjson', 'csv'] = 'ndjson'):
+    statement = filter_channel(export_statement(models.ProductPricesTransformed, schemas.ProductPricesTransformed), models.ProductPricesTransformed, channel_id)
+    return export_response(export_rows(statement.order_by(models.ProductPricesTransformed.id), format), format, 'product_prices_transformed')
+
+@router.get("/phone-numbers-transformed/export")
+async def export_phone_numbers_transformed(channel_id: Optional[str] = None, format: Literal['ndjson', 'csv'] = 'ndjson'):
+    statement = filter_channel(export_statement(models.PhoneNumbersTransformed, schemas.PhoneNumbersTransformed), models.PhoneNumbersTransformed, channel_id)
+    return export_response(export_rows(statement.order_by(models.PhoneNumbersTransformed.id), format), format, 'phone_numbers_transformed')
+
+@router.get("/messages/export")
+async def export_messages(channel_id: Optional[str] = None, date_from: Optional[date] = None, date_to: Optional[date] = None, format: Literal['ndjson', 'csv'] = 'ndjson'):
+    statement = filter_dates(filter_channel(export_statement(models.Message, schemas.Message), models.Message, channel_id), date_from, date_to)
+    return export_response(export_rows(statement.order_by(models.Message.id), format), format, 'message')
+
+@router.get("/channels/export")
+async def export_channels(format: Literal['ndjson', 'csv'] = 'ndjson'):
+    statement = export_statement(models.Channel, schemas.Channel).order_by(models.Channel.id)
+    return export_response(export_rows(statement, format), format, 'channel')
@@ -0,0 +1,169 @@
+from fastapi import APIRouter, Header, HTTPException, Request, Response
+from starlette.middleware.base import BaseHTTPMiddleware
+from collections import OrderedDict
+from typing import Optional
+import hashlib, hmac, os, re, threading, time
+
+# the endpoints whose responses are cached, the data behind them only changes when the nightly dbt run finishes
+CACHED_PATHS = [r'/channels/', r'/phone-numbers/[^/]+', r'/product-prices/[^/]+']
+
+class ResponseCache:
+    """
+    A bounded LRU cache of response bodies, every entry expires ttl seconds after it was stored.
+    The cache lives in the process, so every worker of the server holds its own.
+
+    Attributes:
+        max_size(int): the maximum number of responses held, the least recently used one is dropped first
+        ttl(float): the number of seconds a response is served from the cache
+        hits(int): the number of requests served from the cache
+        misses(int): the number of requests that reached the endpoint
+        not_modified(int): the number of requests answered with a 304
+    """
+
+    def __init__(self, max_size: int=1024, ttl: float=300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key: str):
+        """
+        Looks a response up, counting a hit or a miss.
+
+        Args:
+            key(str): the path and the query string of the request
+        Returns:
+            entry(tuple): the etag, the body, the media type and the other headers of the response, None if it isn't cached or has expired
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self.__entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return entry[1:]
+
+    def put(self, key: str, body: bytes, media_type: str, headers: dict=None):
+        """
+        Stores a response, dropping the least recently used ones past max_size.
+
+        Args:
+            key(str): the path and the query string of the request
+            body(bytes): the body of the response
+            media_type(str): the content type of the response
+            headers(dict): the other headers the endpoint set, sent again with every cached response
+        Returns:
+            etag(str): the etag of the response, a hash of its body
+        """
+        etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        with self.__lock:
+            self.__entries[key] = (time.monotonic() + self.ttl, etag, body, media_type, headers or {})
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+        return etag
+
+    def invalidate(self, prefix: str=''):
+        """
+        Drops the cached responses whose path starts with the prefix, all of them by default.
+
+        Returns:
+            dropped(int): the number of responses dropped
+        """
+        with self.__lock:
+            keys = [key for key in self.__entries if key.startswith(prefix)]
+            for key in keys: del self.__entries[key]
+        return len(keys)
+
+    def stats(self):
+        """
+        Returns the hit and miss counts and the number of responses held.
+        """
+        with self.__lock:
+            return {'hits': self.hits, 'misses': self.misses, 'not_modified': self.not_modified, 'size': len(self.__entries), 'max_size': self.max_size, 'ttl': self.ttl}
+
+    def count_not_modified(self):
+        """
+        Counts a request answered with a 304.
+        """
+        with self.__lock:
+            self.not_modified += 1
+
+class ResponseCacheMiddleware(BaseHTTPMiddleware):
+    """
+    Serves the GET requests of the cached paths from a ResponseCache, keyed by path and query string.
+    Every cached response carries an ETag, a request whose If-None-Match lists it, weak or strong, gets an empty 304.
+    Only 200 responses are stored, errors always reach the endpoint.
+    """
+
+    def __init__(self, app, cache: ResponseCache, paths: list=CACHED_PATHS):
+        super().__init__(app)
+        self.cache = cache
+        self.pattern = re.compile('|'.join(f'(?:{path})' for path in paths))
+
+    def respond(self, request: Request, etag: str, body: bytes, media_type: str, headers: dict, status: str):
+        """
+        Answers with the cached body and headers, or a 304 if the client already holds it.
+        """
+        headers = {**headers, 'ETag': etag, 'X-Cache': status}
+
+        # If-None-Match is a comma separated list of etags, compared weakly, or a '*' matching any of them
+        etags = [tag.strip().removeprefix('W/') for tag in request.headers.get('if-none-match', '').split(',')]
+        if '*' in etags or etag in etags:
+            self.cache.count_not_modified()
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type=media_type, headers=headers)
+
+    async def dispatch(self, request: Request, call_next):
+        if request.method != 'GET' or not self.pattern.fullmatch(request.url.path):
+            return await call_next(request)
+
+        # the query parameters are sorted, so their order doesn't split the cache
+        key = request.url.path + '?' + '&'.join(sorted(request.url.query.split('&')))
+        entry = self.cache.get(key)
+        if entry is not None: return self.respond(request, *entry, status='HIT')
+
+        response = await call_next(request)
+        if response.status_code != 200: return response
+
+        body = b''.join([chunk async for chunk in response.body_iterator])
+        media_type = response.headers.get('content-type')
+
+        # the length and type are set again from the cached body, the etag replaces any the endpoint set
+        headers = {name: value for name, value in response.headers.items() if name not in ('content-length', 'content-type', 'etag')}
+        etag = self.cache.put(key, body, media_type, headers)
+        return self.respond(request, etag, body, media_type, headers, status='MISS')
+
+response_cache = ResponseCache(max_size=int(os.getenv('RESPONSE_CACHE_SIZE', '1024')), ttl=float(os.getenv('RESPONSE_CACHE_TTL', '300')))
+
+router = APIRouter(prefix='/cache')
+
+def check_token(token: Optional[str]):
+    """
+    Rejects the request unless it carries the admin token set in CACHE_ADMIN_TOKEN, every request is rejected while it isn't set.
+    """
+    expected = os.getenv('CACHE_ADMIN_TOKEN')
+    if not expected:
+        raise HTTPException(status_code=403, detail="The cache admin endpoints are disabled, set CACHE_ADMIN_TOKEN to enable them")
+    # compare_digest only takes ascii strings, the header can carry any character
+    if token is None or not hmac.compare_digest(token.encode(), expected.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@router.post("/invalidate")
+def invalidate_cache(prefix: str = '', x_admin_token: Optional[str] = Header(None)):
+    check_token(x_admin_token)
+    return {"invalidated": response_cache.invalidate(prefix)}
+
+@router.get("/stats")
+def get_cache_stats(x_admin_token: Optional[str] = Header(None)):
+    check_token(x_admin_token)
+    return response_cache.stats()
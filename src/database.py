@@ -1,4 +1,6 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -10,7 +12,24 @@ load_dotenv('.env')
 # load the connection string
 DATABASE_URL = os.getenv('CONNECTION_STRING')
 
-engine = create_engine(DATABASE_URL)
+# sync serves the routes from a thread pool with blocking queries, async serves them from the event loop with asyncpg
+DATABASE_MODE = os.getenv('DATABASE_MODE', 'sync')
+
+# the connections every engine keeps open, the extra connections it opens under load and whether a connection is checked before it's used
+POOL_SETTINGS = {
+    'pool_size': int(os.getenv('DB_POOL_SIZE', '5')),
+    'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '10')),
+    'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes'),
+}
+
+engine = create_engine(DATABASE_URL, **POOL_SETTINGS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
\ No newline at end of file
+# the async engine talks to the same database through asyncpg, it's only created where asyncpg is installed
+try:
+    async_engine = create_async_engine(make_url(DATABASE_URL).set(drivername='postgresql+asyncpg'), **POOL_SETTINGS)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+except ImportError:
+    async_engine, AsyncSessionLocal = None, None
+
+Base = declarative_base()
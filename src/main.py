@@ -1,16 +1,30 @@
 from fastapi import FastAPI
-from database import engine
+from database import engine, async_engine, DATABASE_MODE
+from cache import ResponseCacheMiddleware, response_cache, router as cache_router
 import models
-from routes import router
+
+# fail at startup on a database mode that can't serve requests
+if DATABASE_MODE not in ('sync', 'async'):
+    raise ValueError(f"DATABASE_MODE must be 'sync' or 'async', not '{DATABASE_MODE}'")
+if DATABASE_MODE == 'async' and async_engine is None:
+    raise ImportError("DATABASE_MODE=async needs asyncpg, install it or set DATABASE_MODE=sync")
 
 # Create the database tables
 models.Base.metadata.create_all(bind=engine)
 
 app = FastAPI()
 
-# Include the routes
+# Include the routes of the database mode, the async routes are only imported when they are used
+if DATABASE_MODE == 'async':
+    from async_routes import router
+else:
+    from routes import router
 app.include_router(router)
 
+# Serve the hot read endpoints from the response cache, it's invalidated through /cache/invalidate after a load
+app.add_middleware(ResponseCacheMiddleware, cache=response_cache)
+app.include_router(cache_router)
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to Kara Medical Data FastAPI application!"}
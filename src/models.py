@@ -4,7 +4,10 @@ from database import Base
 class ImageDetection(Base):
     __tablename__ = "image_detection"
 
-    media_path = Column(String, primary_key=True, index=True)
+    # an image has a row for every object found in it, so the rows are keyed by a serial id
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    media_path = Column(String, index=True)
+    label = Column(String)
     confidence = Column(Numeric)
     x1 = Column(Numeric)
     x2 = Column(Numeric)
@@ -15,7 +18,7 @@ class ProductsTransformed(Base):
     __tablename__ = "products_transformed"
 
     id = Column(String, primary_key=True, index=True)
-    channel_id = Column(String)
+    channel_id = Column(String, index=True)
     name = Column(String)
     media_path = Column(String)
 
@@ -23,25 +26,25 @@ class ProductPricesTransformed(Base):
     __tablename__ = "product_prices_transformed"
 
     id = Column(String, primary_key=True, index=True)
-    channel_id = Column(String)
+    channel_id = Column(String, index=True)
     price = Column(Numeric)
 
 class PhoneNumbersTransformed(Base):
     __tablename__ = "phone_numbers_transformed"
 
     id = Column(String, primary_key=True, index=True)
-    channel_id = Column(String)
+    channel_id = Column(String, index=True)
     price = Column(String)
 
 class Message(Base):
     __tablename__ = "message"
 
     id = Column(String, primary_key=True, index=True)
-    channel_id = Column(String)
+    channel_id = Column(String, index=True)
     telegram_id = Column(Integer)
     message = Column(String)
     media_path = Column(String)
-    date = Column(Date)
+    date = Column(Date, index=True)
 
 class Channel(Base):
     __tablename__ = "channel"
@@ -1,11 +1,38 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
+from sqlalchemy import Column, Select, select
+from typing import Literal, Optional
+from datetime import date
+from decimal import Decimal
 from database import SessionLocal
+import base64, csv, io, json, os
+import orjson
 import models
 import schemas
 
 router = APIRouter()
 
+# the number of rows a page holds unless a limit is given, and the most a limit can ask for
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+# the number of rows an export fetches from the server side cursor and sends at a time
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_MEDIA_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+# with JSON_MODE=orjson the rows are fetched as plain tuples of the response model's columns and encoded by orjson,
+# skipping the pydantic objects the response models build for every row, the responses stay the same
+FAST_JSON = os.getenv('JSON_MODE', 'pydantic') == 'orjson'
+
+class FastJSONResponse(JSONResponse):
+    """
+    A json response encoded with orjson, it writes the same compact utf-8 json as the response models do.
+    """
+
+    def render(self, content):
+        return orjson.dumps(content)
+
 # Dependency to get the database session
 def get_db():
     db = SessionLocal()
@@ -14,47 +41,266 @@ def get_db():
     finally:
         db.close()
 
-@router.get("/image-detection/", response_model=list[schemas.ImageDetection])
-def get_image_detections(db: Session = Depends(get_db)):
-    return db.query(models.ImageDetection).all()
+def encode_cursor(key: str):
+    """
+    Creates the opaque cursor that points right after a row.
+
+    Args:
+        key(str | int): the primary key of the last row of a page
+    Returns:
+        cursor(str): the url safe cursor of the next page
+    """
+    return base64.urlsafe_b64encode(json.dumps([key]).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str):
+    """
+    Reads the primary key a cursor points after.
+
+    Args:
+        cursor(str): a cursor created by encode_cursor
+    Returns:
+        key(str | int): the primary key of the last row of the previous page
+    """
+    try:
+        [key] = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return key
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def page_statement(statement: Select, key: Column, limit: int, cursor: Optional[str]):
+    """
+    Orders a statement by its primary key and seeks past the cursor instead of offsetting,
+    so every page costs the same no matter how deep it is.
+
+    Args:
+        statement(Select): the filtered statement of the rows
+        key(Column): the primary key column the rows are ordered by
+        limit(int): the maximum number of rows in the page
+        cursor(str): the cursor of the page, None for the first page
+    Returns:
+        statement(Select): the statement of the page, it fetches one row more than the limit to know whether there is a next page
+    """
+    if cursor is not None: statement = statement.filter(key > decode_cursor(cursor))
+    return statement.order_by(key).limit(limit + 1)
+
+def make_page(rows: list, key: Column, limit: int):
+    """
+    Creates the page of the rows fetched by a page statement.
+
+    Returns:
+        page(dict): the rows of the page and the cursor of the next page, None on the last page
+    """
+    next_cursor = encode_cursor(getattr(rows[limit - 1], key.key)) if len(rows) > limit else None
+    return {"items": rows[:limit], "next_cursor": next_cursor}
+
+def paginate(db: Session, statement: Select, key: Column, limit: int, cursor: Optional[str], schema: type):
+    """
+    Fetches a page of a statement ordered by its primary key, see page_statement.
+    """
+    result = db.execute(page_statement(fast_statement(statement, schema), key, limit, cursor))
+    return make_page(fetch_rows(result), key, limit)
+
+def fast_statement(statement: Select, schema: type):
+    """
+    Selects only the columns of the response model, in its order, when the fast json mode is on.
+
+    Args:
+        statement(Select): a statement selecting the rows of a table as objects
+        schema(type): the response model of a row
+    Returns:
+        statement(Select): the statement, projected onto the columns in the fast json mode
+    """
+    if not FAST_JSON: return statement
+    model = statement.column_descriptions[0]['entity']
+    return statement.with_only_columns(*[getattr(model, name) for name in schema.model_fields])
+
+def fetch_rows(result):
+    """
+    Reads the rows of the result of a fast_statement, plain rows in the fast json mode and objects otherwise.
+    """
+    return result.all() if FAST_JSON else result.scalars().all()
+
+def render(content):
+    """
+    Returns the content of a route as it is, for its response model to serialize, or encodes it with orjson in the fast json mode.
+    The plain rows are converted the way the response models convert them, see export_value.
+
+    Args:
+        content(dict | list): a page or a list of rows
+    Returns:
+        content(dict | list | FastJSONResponse): the content, or its response in the fast json mode
+    """
+    if not FAST_JSON: return content
+
+    def plain(rows: list):
+        return [{name: export_value(value) for name, value in row._mapping.items()} for row in rows]
+
+    if isinstance(content, dict): content = {**content, "items": plain(content["items"])}
+    else: content = plain(content)
+    return FastJSONResponse(content)
 
-@router.get("/products-transformed/", response_model=list[schemas.ProductsTransformed])
-def get_products_transformed(db: Session = Depends(get_db)):
-    return db.query(models.ProductsTransformed).all()
+def filter_channel(statement: Select, model: type, channel_id: Optional[str]):
+    """
+    Keeps the rows of a channel when a channel_id is given.
+    """
+    return statement if channel_id is None else statement.filter(model.channel_id == channel_id)
 
-@router.get("/product-prices-transformed/", response_model=list[schemas.ProductPricesTransformed])
-def get_product_prices_transformed(db: Session = Depends(get_db)):
-    return db.query(models.ProductPricesTransformed).all()
+def filter_dates(statement: Select, date_from: Optional[date], date_to: Optional[date]):
+    """
+    Keeps the messages sent between two dates, both included, when they are given.
+    """
+    if date_from is not None: statement = statement.filter(models.Message.date >= date_from)
+    if date_to is not None: statement = statement.filter(models.Message.date <= date_to)
+    return statement
 
-@router.get("/phone-numbers-transformed/", response_model=list[schemas.PhoneNumbersTransformed])
-def get_phone_numbers_transformed(db: Session = Depends(get_db)):
-    return db.query(models.PhoneNumbersTransformed).all()
+def export_value(value):
+    """
+    Converts a column value the way the response models do, numerics become floats and dates iso strings.
+    """
+    if isinstance(value, Decimal): return float(value)
+    if isinstance(value, date): return value.isoformat()
+    return value
 
-@router.get("/messages/", response_model=list[schemas.Message])
-def get_messages(db: Session = Depends(get_db)):
-    return db.query(models.Message).all()
+def serialize_rows(rows: list, names: list, format: str):
+    """
+    Serializes a chunk of rows as newline delimited json or csv lines.
 
-@router.get("/channels/", response_model=list[schemas.Channel])
-def get_channels(db: Session = Depends(get_db)):
-    return db.query(models.Channel).all()
+    Args:
+        rows(list): the rows, their values in the order of the names
+        names(list): the names of the columns
+        format(str): ndjson or csv, an empty list of rows gives the csv header
+    Returns:
+        chunk(str): the serialized rows
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if format == 'csv' and not rows: writer.writerow(names)
 
-@router.get("/phone-numbers/{channel_id}", response_model=list[schemas.PhoneNumbersTransformed])
-def get_phone_numbers_by_channel(channel_id: str, db: Session = Depends(get_db)):
-    phone_numbers = db.query(models.PhoneNumbersTransformed).filter(models.PhoneNumbersTransformed.channel_id == channel_id).all()
-    if not phone_numbers:
+    for row in rows:
+        values = [export_value(value) for value in row]
+        if format == 'csv': writer.writerow(values)
+        else: buffer.write(json.dumps(dict(zip(names, values))) + '\n')
+
+    return buffer.getvalue()
+
+def export_rows(statement: Select, format: str):
+    """
+    Streams the rows of a statement as newline delimited json or csv. The rows are fetched through a server side cursor
+    a chunk at a time and every chunk is sent as soon as it is serialized, so an export of a whole table runs in constant memory.
+    The generator opens its own session, since it keeps running after the route has returned.
+
+    Args:
+        statement(Select): the filtered, column projected statement of the rows
+        format(str): ndjson or csv
+    Returns:
+        chunks(generator): the serialized chunks of rows
+    """
+    names = [column.key for column in statement.selected_columns]
+
+    # the csv header is sent before the first row is fetched
+    if format == 'csv': yield serialize_rows([], names, format)
+
+    with SessionLocal() as db:
+        result = db.execute(statement.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+        for rows in result.partitions():
+            yield serialize_rows(rows, names, format)
+
+def export_response(chunks, format: str, name: str):
+    """
+    Creates the streaming response of an export, sent as a file named after the table.
+
+    Args:
+        chunks(generator): the serialized chunks of rows, a sync or an async generator
+        format(str): ndjson or csv
+        name(str): the name of the table
+    """
+    headers = {'Content-Disposition': f'attachment; filename="{name}.{format}"'}
+    return StreamingResponse(chunks, media_type=EXPORT_MEDIA_TYPES[format], headers=headers)
+
+def export_statement(model: type, schema: type):
+    """
+    Selects the columns of a table that its response model holds, in the same order.
+    """
+    return select(*[getattr(model, name) for name in schema.model_fields])
+
+@router.get("/image-detection/", response_model=schemas.Page[schemas.ImageDetection])
+def get_image_detections(limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    return render(paginate(db, select(models.ImageDetection), models.ImageDetection.id, limit, cursor, schemas.ImageDetection))
+
+@router.get("/products-transformed/", response_model=schemas.Page[schemas.ProductsTransformed])
+def get_products_transformed(channel_id: Optional[str] = None, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    statement = filter_channel(select(models.ProductsTransformed), models.ProductsTransformed, channel_id)
+    return render(paginate(db, statement, models.ProductsTransformed.id, limit, cursor, schemas.ProductsTransformed))
+
+@router.get("/product-prices-transformed/", response_model=schemas.Page[schemas.ProductPricesTransformed])
+def get_product_prices_transformed(channel_id: Optional[str] = None, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    statement = filter_channel(select(models.ProductPricesTransformed), models.ProductPricesTransformed, channel_id)
+    return render(paginate(db, statement, models.ProductPricesTransformed.id, limit, cursor, schemas.ProductPricesTransformed))
+
+@router.get("/phone-numbers-transformed/", response_model=schemas.Page[schemas.PhoneNumbersTransformed])
+def get_phone_numbers_transformed(channel_id: Optional[str] = None, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    statement = filter_channel(select(models.PhoneNumbersTransformed), models.PhoneNumbersTransformed, channel_id)
+    return render(paginate(db, statement, models.PhoneNumbersTransformed.id, limit, cursor, schemas.PhoneNumbersTransformed))
+
+@router.get("/messages/", response_model=schemas.Page[schemas.Message])
+def get_messages(channel_id: Optional[str] = None, date_from: Optional[date] = None, date_to: Optional[date] = None, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    statement = filter_dates(filter_channel(select(models.Message), models.Message, channel_id), date_from, date_to)
+    return render(paginate(db, statement, models.Message.id, limit, cursor, schemas.Message))
+
+@router.get("/channels/", response_model=schemas.Page[schemas.Channel])
+def get_channels(limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    return render(paginate(db, select(models.Channel), models.Channel.id, limit, cursor, schemas.Channel))
+
+@router.get("/phone-numbers/{channel_id}", response_model=schemas.Page[schemas.PhoneNumbersTransformed])
+def get_phone_numbers_by_channel(channel_id: str, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    statement = filter_channel(select(models.PhoneNumbersTransformed), models.PhoneNumbersTransformed, channel_id)
+    phone_numbers = paginate(db, statement, models.PhoneNumbersTransformed.id, limit, cursor, schemas.PhoneNumbersTransformed)
+    if cursor is None and not phone_numbers["items"]:
         raise HTTPException(status_code=404, detail="Phone numbers not found for this channel ID")
-    return phone_numbers
+    return render(phone_numbers)
 
-@router.get("/product-prices/{channel_id}", response_model=list[schemas.ProductPricesTransformed])
-def get_product_prices_by_channel(channel_id: str, db: Session = Depends(get_db)):
-    prices = db.query(models.ProductPricesTransformed).filter(models.ProductPricesTransformed.channel_id == channel_id).all()
-    if not prices:
+@router.get("/product-prices/{channel_id}", response_model=schemas.Page[schemas.ProductPricesTransformed])
+def get_product_prices_by_channel(channel_id: str, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    statement = filter_channel(select(models.ProductPricesTransformed), models.ProductPricesTransformed, channel_id)
+    prices = paginate(db, statement, models.ProductPricesTransformed.id, limit, cursor, schemas.ProductPricesTransformed)
+    if cursor is None and not prices["items"]:
         raise HTTPException(status_code=404, detail="Prices not found for this channel ID")
-    return prices
+    return render(prices)
 
 @router.get("/object-detection/{media_path}", response_model=list[schemas.ImageDetection])
 def get_object_detection_by_media(media_path: str, db: Session = Depends(get_db)):
-    detections = db.query(models.ImageDetection).filter(models.ImageDetection.media_path == media_path).all()
+    statement = select(models.ImageDetection).filter(models.ImageDetection.media_path == media_path).order_by(models.ImageDetection.id)
+    detections = fetch_rows(db.execute(fast_statement(statement, schemas.ImageDetection)))
     if not detections:
         raise HTTPException(status_code=404, detail="Object detection results not found for this media path")
-    return detections
\ No newline at end of file
+    return render(detections)
+
+@router.get("/image-detection/export")
+def export_image_detections(format: Literal['ndjson', 'csv'] = 'ndjson'):
+    statement = export_statement(models.ImageDetection, schemas.ImageDetection).order_by(models.ImageDetection.id)
+    return export_response(export_rows(statement, format), format, 'image_detection')
+
+@router.get("/products-transformed/export")
+def export_products_transformed(channel_id: Optional[str] = None, format: Literal['ndjson', 'csv'] = 'ndjson'):
+    statement = filter_channel(export_statement(models.ProductsTransformed, schemas.ProductsTransformed), models.ProductsTransformed, channel_id)
+    return export_response(export_rows(statement.order_by(models.ProductsTransformed.id), format), format, 'products_transformed')
+
+@router.get("/product-prices-transformed/export")
+def export_product_prices_transformed(channel_id: Optional[str] = None, format: Literal['ndjson', 'csv'] = 'ndjson'):
+    statement = filter_channel(export_statement(models.ProductPricesTransformed, schemas.ProductPricesTransformed), models.ProductPricesTransformed, channel_id)
+    return export_response(export_rows(statement.order_by(models.ProductPricesTransformed.id), format), format, 'product_prices_transformed')
+
+@router.get("/phone-numbers-transformed/export")
+def export_phone_numbers_transformed(channel_id: Optional[str] = None, format: Literal['ndjson', 'csv'] = 'ndjson'):
+    statement = filter_channel(export_statement(models.PhoneNumbersTransformed, schemas.PhoneNumbersTransformed), models.PhoneNumbersTransformed, channel_id)
+    return export_response(export_rows(statement.order_by(models.PhoneNumbersTransformed.id), format), format, 'phone_numbers_transformed')
+
+@router.get("/messages/export")
+def export_messages(channel_id: Optional[str] = None, date_from: Optional[date] = None, date_to: Optional[date] = None, format: Literal['ndjson', 'csv'] = 'ndjson'):
+    statement = filter_dates(filter_channel(export_statement(models.Message, schemas.Message), models.Message, channel_id), date_from, date_to)
+    return export_response(export_rows(statement.order_by(models.Message.id), format), format, 'message')
+
+@router.get("/channels/export")
+def export_channels(format: Literal['ndjson', 'csv'] = 'ndjson'):
+    statement = export_statement(models.Channel, schemas.Channel).order_by(models.Channel.id)
+    return export_response(export_rows(statement, format), format, 'channel')
@@ -1,8 +1,13 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Generic, Optional, TypeVar
+from datetime import date
+
+Item = TypeVar('Item')
 
 class ImageDetectionBase(BaseModel):
+    id: int
     media_path: str
+    label: Optional[str]
     confidence: float
     x1: float
     x2: float
@@ -29,9 +34,9 @@ class MessageBase(BaseModel):
     id: str
     channel_id: str
     telegram_id: int
-    message: str
-    media_path: str
-    date: str
+    message: Optional[str]
+    media_path: Optional[str]
+    date: date
 
 class ChannelBase(BaseModel):
     id: str
@@ -62,3 +67,8 @@ class Message(MessageBase):
 class Channel(ChannelBase):
     class Config:
         orm_mode = True
+
+# the envelope of a page of a list endpoint, next_cursor is passed back as cursor to get the next page
+class Page(BaseModel, Generic[Item]):
+    items: list[Item]
+    next_cursor: Optional[str]
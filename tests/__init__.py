@@ -0,0 +1,7 @@
+import os, sys
+
+# the scripts import each other by module name, as they do when run from the scripts folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+# the api modules import each other by module name too, as they do when the app is run from the src folder
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
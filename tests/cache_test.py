@@ -0,0 +1,116 @@
+import unittest
+from unittest import mock
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.testclient import TestClient
+from cache import ResponseCache, ResponseCacheMiddleware, router
+
+class TestResponseCache(unittest.TestCase):
+    """
+    Unit tests for the ResponseCache class.
+    """
+
+    def test_least_recently_used_responses_are_dropped(self):
+        cache = ResponseCache(max_size=2)
+        cache.put('/a?', b'a', 'application/json')
+        cache.put('/b?', b'b', 'application/json')
+        cache.get('/a?')
+        cache.put('/c?', b'c', 'application/json')
+
+        self.assertIsNone(cache.get('/b?'))
+        self.assertEqual(cache.get('/a?')[1:], (b'a', 'application/json', {}))
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_responses_expire(self):
+        cache = ResponseCache(ttl=10)
+        with mock.patch('cache.time.monotonic', return_value=100.0):
+            cache.put('/a?', b'a', 'application/json')
+        with mock.patch('cache.time.monotonic', return_value=109.0):
+            self.assertIsNotNone(cache.get('/a?'))
+        with mock.patch('cache.time.monotonic', return_value=111.0):
+            self.assertIsNone(cache.get('/a?'))
+
+        self.assertEqual(cache.stats()['size'], 0)
+
+class TestResponseCacheMiddleware(unittest.TestCase):
+    """
+    Tests for the middleware, run against a small app that counts the calls of its endpoints.
+    """
+
+    def setUp(self):
+        self.calls = []
+        self.cache = ResponseCache()
+        app = FastAPI()
+
+        @app.get("/channels/")
+        def get_channels(response: Response, limit: int = 100):
+            self.calls.append(limit)
+            response.headers['Cache-Control'] = 'max-age=60'
+            return {"items": [{"id": "c1"}], "limit": limit}
+
+        @app.get("/product-prices/{channel_id}")
+        def get_prices(channel_id: str):
+            self.calls.append(channel_id)
+            raise HTTPException(status_code=404, detail="Prices not found for this channel ID")
+
+        @app.get("/channels/export")
+        def export_channels():
+            self.calls.append('export')
+            return {}
+
+        app.add_middleware(ResponseCacheMiddleware, cache=self.cache)
+        self.client = TestClient(app)
+
+    def test_responses_are_served_from_the_cache(self):
+        first = self.client.get('/channels/', params={'limit': 5})
+        second = self.client.get('/channels/?limit=5')
+
+        self.assertEqual(self.calls, [5])
+        self.assertEqual((first.headers['x-cache'], second.headers['x-cache']), ('MISS', 'HIT'))
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second.headers['etag'], first.headers['etag'])
+        self.assertEqual(second.headers['content-type'], 'application/json')
+        self.assertEqual((first.headers['cache-control'], second.headers['cache-control']), ('max-age=60', 'max-age=60'))
+
+    def test_matching_etags_get_a_304(self):
+        etag = self.client.get('/channels/').headers['etag']
+        response = self.client.get('/channels/', headers={'If-None-Match': etag})
+
+        self.assertEqual((response.status_code, response.content), (304, b''))
+
+        # weak etags and lists of etags match too
+        for if_none_match in [f'W/{etag}', f'"stale", {etag}', '*']:
+            self.assertEqual(self.client.get('/channels/', headers={'If-None-Match': if_none_match}).status_code, 304)
+        self.assertEqual(self.client.get('/channels/', headers={'If-None-Match': '"stale"'}).status_code, 200)
+        self.assertEqual(self.cache.stats()['not_modified'], 4)
+
+    def test_errors_and_other_paths_are_not_cached(self):
+        for _ in range(2):
+            self.client.get('/product-prices/c9')
+            self.client.get('/channels/export')
+
+        self.assertEqual(self.calls, ['c9', 'export'] * 2)
+
+    def test_invalidation(self):
+        app = FastAPI()
+        app.include_router(router)
+        admin = TestClient(app)
+        self.client.get('/channels/')
+
+        with mock.patch('cache.response_cache', self.cache), mock.patch.dict('os.environ', {'CACHE_ADMIN_TOKEN': 'secret'}):
+            self.assertEqual(admin.post('/cache/invalidate').status_code, 403)
+            self.assertEqual(admin.get('/cache/stats', headers={'X-Admin-Token': 'sécret'.encode()}).status_code, 403)
+            response = admin.post('/cache/invalidate', params={'prefix': '/channels/'}, headers={'X-Admin-Token': 'secret'})
+            stats = admin.get('/cache/stats', headers={'X-Admin-Token': 'secret'}).json()
+
+        # without a configured token the endpoints are closed
+        with mock.patch.dict('os.environ', {'CACHE_ADMIN_TOKEN': ''}):
+            self.assertEqual(admin.post('/cache/invalidate').status_code, 403)
+            self.assertEqual(admin.get('/cache/stats', headers={'X-Admin-Token': ''}).status_code, 403)
+
+        self.assertEqual(response.json(), {'invalidated': 1})
+        self.assertEqual((stats['size'], stats['misses']), (0, 1))
+        self.client.get('/channels/')
+        self.assertEqual(len(self.calls), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os, tempfile, unittest
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from scripts.data_io import MESSAGE_SCHEMA, FrameReader, FrameWriter, ParquetPartWriter, read_table, write_table
+
+def make_messages(count: int):
+    """
+    Creates a dataframe of scraped messages, with the dates written the way the csv files have them.
+    """
+    return pd.DataFrame({
+        'channel_title': ['Doctors'] * count,
+        'channel_username': ['@DoctorsET'] * count,
+        'id': range(count, 0, -1),
+        'message': [f"message {id}" for id in range(count)],
+        'date': ['2024-01-01 08:30:00+00:00'] * count,
+        'media_path': [None] * count,
+    })
+
+class TestDataIO(unittest.TestCase):
+    """
+    Unit tests for the csv and parquet helpers shared by the scripts.
+    """
+
+    def test_write_table_parquet_is_typed(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'messages.parquet')
+            write_table(make_messages(5), path, schema=MESSAGE_SCHEMA)
+
+            self.assertEqual(pq.read_schema(path).remove_metadata(), MESSAGE_SCHEMA)
+            self.assertEqual(pq.ParquetFile(path).metadata.row_group(0).column(0).compression, 'ZSTD')
+
+            data = read_table(path, columns=['id', 'date'])
+
+        self.assertEqual(data.columns.tolist(), ['id', 'date'])
+        self.assertEqual(data['id'].tolist(), [5, 4, 3, 2, 1])
+        self.assertEqual(data['date'].iloc[0], pd.Timestamp('2024-01-01 08:30:00', tz='UTC'))
+
+    def test_frame_reader_and_writer_round_trip(self):
+        data = make_messages(25)
+        with tempfile.TemporaryDirectory() as folder:
+            csv_path, parquet_path = os.path.join(folder, 'messages.csv'), os.path.join(folder, 'messages.parquet')
+            data.to_csv(csv_path, index=False)
+
+            csv_reader = FrameReader(csv_path, chunksize=10)
+            with FrameWriter(parquet_path, schema=MESSAGE_SCHEMA) as writer:
+                for frame in csv_reader: writer.write(frame)
+            self.assertEqual(csv_reader.position, csv_reader.total)
+
+            parquet_reader = FrameReader(parquet_path, chunksize=10, columns=['id'])
+            frames = list(parquet_reader)
+
+        self.assertEqual((parquet_reader.unit, parquet_reader.total, parquet_reader.position), ('rows', 25, 25))
+        self.assertEqual(pd.concat(frames)['id'].tolist(), data['id'].tolist())
+
+    def test_parquet_part_writer(self):
+        rows = make_messages(7).assign(date=pd.Timestamp('2024-01-01', tz='UTC')).values.tolist()
+        with tempfile.TemporaryDirectory() as folder:
+            writer = ParquetPartWriter(folder, schema=MESSAGE_SCHEMA, rows_per_part=3)
+            for row in rows: writer.writerow(row)
+            writer.close()
+
+            self.assertEqual(len(os.listdir(folder)), 3)
+            data = read_table(folder)
+
+        self.assertEqual(sorted(data['id'].tolist()), list(range(1, 8)))
+        self.assertEqual(str(data['id'].dtype), 'int64')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import os, unittest
+import pandas as pd
+import psycopg2, psycopg2.pool
+from scripts.data_pusher import DB_Client
+
+# the tests run against their own database on a local postgres server, they are skipped if it can't be reached
+TEST_DB = {
+    'host': os.getenv('TEST_DB_HOST', 'localhost'),
+    'port': os.getenv('TEST_DB_PORT', '5432'),
+    'user_name': os.getenv('TEST_DB_USER', 'postgres'),
+    'password': os.getenv('TEST_DB_PASSWORD', ''),
+    'database_name': os.getenv('TEST_DB_NAME', 'kara_medical_test'),
+}
+
+def create_test_database():
+    """
+    Creates the test database if it doesn't exist, returns False if the postgres server can't be reached.
+    """
+    try:
+        connection = psycopg2.connect(host=TEST_DB['host'], port=TEST_DB['port'], user=TEST_DB['user_name'], password=TEST_DB['password'], database='postgres', connect_timeout=3)
+    except psycopg2.OperationalError:
+        return False
+
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (TEST_DB['database_name'],))
+        if cursor.fetchone() is None: cursor.execute(f"CREATE DATABASE {TEST_DB['database_name']}")
+    connection.close()
+    return True
+
+DATABASE_AVAILABLE = create_test_database()
+
+def make_messages(channel_username: str, count: int):
+    """
+    Creates a dataframe of cleaned messages, like the one data_cleaner.py saves.
+    """
+    return pd.DataFrame({
+        'channel_title': [channel_username.strip('@').title()] * count,
+        'channel_username': [channel_username] * count,
+        'id': range(count, 0, -1),
+        'message': [f"it's message {id}, \"quoted\"\nover lines" for id in range(count, 0, -1)],
+        'date': ['2024-01-01 08:30:00+00:00'] * count,
+        'media_path': [f"data/media/{channel_username}_{id}.jpg" if id % 2 else None for id in range(count, 0, -1)],
+    })
+
+@unittest.skipUnless(DATABASE_AVAILABLE, "a local postgres server is needed")
+class TestDBClient(unittest.TestCase):
+    """
+    Unit tests for the DB_Client class, the channel and message tables are created like src/models.py declares them.
+    """
+
+    def setUp(self):
+        self.client = DB_Client(**TEST_DB)
+        self.client.cursor.execute("DROP TABLE IF EXISTS message, channel")
+        self.client.cursor.execute("CREATE TABLE channel (id VARCHAR PRIMARY KEY, username VARCHAR, title VARCHAR)")
+        self.client.cursor.execute(
+            "CREATE TABLE message (id VARCHAR PRIMARY KEY, channel_id VARCHAR, telegram_id INTEGER, message VARCHAR, media_path VARCHAR, date DATE)"
+        )
+        self.client.connection.commit()
+
+    def tearDown(self):
+        self.client.close()
+
+    def query(self, query: str):
+        self.client.cursor.execute(query)
+        return self.client.cursor.fetchall()
+
+    def test_add_messages_copies_in_batches(self):
+        data = make_messages('@DoctorsET', 25)
+        channel_id = self.client.add_channel(username="@DoctorsET", title="Doctor's ET")
+
+        inserted = self.client.add_messages(channel_id=channel_id, telegram_id_col='id', message_col='message', media_path_col='media_path', date_col='date', data=data, batch_size=10)
+
+        self.assertEqual(inserted, 25)
+        rows = self.query("SELECT channel_id, telegram_id, message, media_path, date::text FROM message ORDER BY telegram_id DESC")
+        self.assertEqual(rows[0], (channel_id, 25, "it's message 25, \"quoted\"\nover lines", "data/media/@DoctorsET_25.jpg", "2024-01-01"))
+        self.assertEqual(rows[1][3], None)
+        self.assertEqual(self.query("SELECT COUNT(DISTINCT id) FROM message"), [(25,)])
+        self.assertEqual(self.query("SELECT title FROM channel"), [("Doctor's ET",)])
+
+    def test_push_data(self):
+        data = pd.concat([make_messages('@DoctorsET', 7), make_messages('@yetenaweg', 4)])
+
+        self.client.push_data(data=data, batch_size=3)
+
+        self.assertEqual(
+            self.query("SELECT c.username, COUNT(*) FROM message m JOIN channel c ON c.id = m.channel_id GROUP BY c.username ORDER BY c.username"),
+            [('@DoctorsET', 7), ('@yetenaweg', 4)]
+        )
+
+    def test_push_data_upsert_is_idempotent(self):
+        first_run = pd.concat([make_messages('@DoctorsET', 30).iloc[10:20], make_messages('@yetenaweg', 4)])
+        second_run = pd.concat([make_messages('@DoctorsET', 30), make_messages('@yetenaweg', 4)])
+
+        self.client.push_data(data=first_run, batch_size=3, upsert=True)
+        first_ids = self.query("SELECT id FROM message ORDER BY id")
+        self.client.push_data(data=second_run, batch_size=3, upsert=True)
+        self.client.push_data(data=second_run, batch_size=3, upsert=True)
+
+        self.assertEqual(self.query("SELECT COUNT(*) FROM channel"), [(2,)])
+        self.assertEqual(
+            self.query("SELECT c.username, COUNT(*), COUNT(DISTINCT m.telegram_id) FROM message m JOIN channel c ON c.id = m.channel_id GROUP BY c.username ORDER BY c.username"),
+            [('@DoctorsET', 30, 30), ('@yetenaweg', 4, 4)]
+        )
+        self.assertTrue(set(first_ids) <= set(self.query("SELECT id FROM message")))
+
+    def test_push_data_upsert_fills_gaps(self):
+        data = make_messages('@DoctorsET', 10)
+
+        # a partial load leaves a hole in the stored telegram ids
+        self.client.push_data(data=data[~data['id'].between(4, 6)], batch_size=3, upsert=True)
+        self.client.push_data(data=data, batch_size=3, upsert=True)
+
+        self.assertEqual(self.query("SELECT telegram_id FROM message ORDER BY telegram_id"), [(id,) for id in range(1, 11)])
+
+    def test_push_data_parallel(self):
+        data = pd.concat([make_messages(f'@channel{index}', 20 + index) for index in range(6)])
+
+        self.client.push_data(data=data, batch_size=7, workers=3)
+        self.client.push_data(data=data, batch_size=7, upsert=True, workers=3)
+
+        self.assertEqual(self.client.pool.maxconn, 3)
+        self.assertEqual(
+            self.query("SELECT c.username, COUNT(*) FROM message m JOIN channel c ON c.id = m.channel_id GROUP BY c.username ORDER BY c.username"),
+            [(f'@channel{index}', 20 + index) for index in range(6)]
+        )
+
+    def test_push_channel_rolls_back(self):
+        data = make_messages('@DoctorsET', 5).assign(id='not a number')
+        pool = psycopg2.pool.ThreadedConnectionPool(1, 1, host=TEST_DB['host'], port=TEST_DB['port'], user=TEST_DB['user_name'], password=TEST_DB['password'], database=TEST_DB['database_name'])
+
+        inserted = self.client.push_channel(pool, '@DoctorsET', 'Doctors', data)
+        pool.closeall()
+
+        self.assertEqual(inserted, 0)
+        self.assertEqual(self.query("SELECT COUNT(*) FROM channel"), [(0,)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+import os, tempfile, unittest
+import numpy as np
+import psycopg2
+import pandas as pd
+from types import SimpleNamespace
+from tests.data_pusher_test import DATABASE_AVAILABLE, TEST_DB
+
+# the labeling script needs torch and opencv, the tests are skipped where they aren't installed
+try:
+    import torch, cv2
+    from scripts.label_images import DetectionCache, DetectionManifest, DetectionPusher, ImageLoader, detect_objects, detect_objects_parallel, labeled_images, push_detections, select_images
+    LABELING_AVAILABLE = True
+except ImportError:
+    LABELING_AVAILABLE = False
+
+class FakeModel:
+    """
+    A stand-in for the YOLOv5 hub model that finds one box per image, its confidence is the mean pixel value of the image.
+
+    Attributes:
+        names(dict): the class names of the model, by class index
+        calls(list): the number of images given to the model on every call
+    """
+
+    def __init__(self):
+        self.names = {0: 'bottle', 1: 'person'}
+        self.calls = []
+
+    def __call__(self, images: list):
+        self.calls.append(len(images))
+        boxes = [torch.tensor([[1.0, 2.0, 3.0, 4.0, float(image.mean()), float(image.mean() > 100)]]) for image in images]
+        return SimpleNamespace(xyxy=boxes)
+
+def load_fake_model():
+    """
+    Loads a FakeModel in a worker process, its class names record the number of threads torch was limited to.
+    """
+    model = FakeModel()
+    model.names = {0: f"bottle-{torch.get_num_threads()}", 1: f"person-{torch.get_num_threads()}"}
+    return model
+
+def write_images(folder: str, count: int):
+    """
+    Writes count small images whose pixel values are 10 times their index, returns their names.
+    """
+    names = [f"@a_{index}.jpg" for index in range(count)]
+    for index, name in enumerate(names):
+        cv2.imwrite(os.path.join(folder, name), np.full((8, 8, 3), index * 10, dtype=np.uint8))
+    return names
+
+@unittest.skipUnless(LABELING_AVAILABLE, "torch and opencv are needed")
+class TestDetectObjects(unittest.TestCase):
+    """
+    Unit tests for detect_objects, run against a fake model.
+    """
+
+    def test_batches_are_mapped_back_to_their_files(self):
+        model = FakeModel()
+        with tempfile.TemporaryDirectory() as folder:
+            names = write_images(folder, 13)
+            detections = detect_objects(folder_path=folder, model=model, image_files=names, batch_size=5)
+
+        self.assertEqual(model.calls, [5, 5, 3])
+        self.assertEqual(detections['media_path'].tolist(), names)
+        self.assertEqual(detections['confidence'].round().tolist(), [index * 10.0 for index in range(13)])
+        self.assertEqual(detections['label'].tolist(), ['bottle'] * 11 + ['person'] * 2)
+
+    def test_unreadable_files_are_skipped(self):
+        model = FakeModel()
+        with tempfile.TemporaryDirectory() as folder:
+            names = write_images(folder, 4)
+            with open(os.path.join(folder, '@a_broken.jpg'), 'wb') as file: file.write(b'not a jpeg')
+            with open(os.path.join(folder, 'notes.txt'), 'w') as file: file.write('notes')
+
+            detections = detect_objects(folder_path=folder, model=model, image_files=['notes.txt'] + names + ['@a_broken.jpg'], batch_size=2)
+
+        self.assertEqual(model.calls, [1, 2, 1])
+        self.assertEqual(detections['media_path'].tolist(), names)
+
+    def test_boxes_are_scaled_back(self):
+        model = FakeModel()
+        with tempfile.TemporaryDirectory() as folder:
+            cv2.imwrite(os.path.join(folder, 'large.jpg'), np.zeros((40, 80, 3), dtype=np.uint8))
+            detections = detect_objects(folder_path=folder, model=model, image_size=20)
+
+        self.assertEqual(detections[['x1', 'y1', 'x2', 'y2']].values.tolist(), [[4.0, 8.0, 12.0, 16.0]])
+
+    def test_copies_are_served_from_the_cache(self):
+        model = FakeModel()
+        cache = DetectionCache()
+        with tempfile.TemporaryDirectory() as folder:
+            names = write_images(folder, 3)
+            for copy in ['@b_1.jpg', '@c_1.jpg']:
+                with open(os.path.join(folder, names[1]), 'rb') as source, open(os.path.join(folder, copy), 'wb') as file: file.write(source.read())
+
+            detections = detect_objects(folder_path=folder, model=model, image_files=names + ['@b_1.jpg', '@c_1.jpg'], batch_size=2, cache=cache)
+            again = detect_objects(folder_path=folder, model=model, image_files=['@c_1.jpg'], cache=cache)
+
+        self.assertEqual(model.calls, [2, 1])
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+        self.assertEqual(detections['media_path'].tolist(), names + ['@b_1.jpg', '@c_1.jpg'])
+        self.assertEqual(detections.iloc[3, 1:].tolist(), detections.iloc[1, 1:].tolist())
+        self.assertEqual(again.iloc[0, 1:].tolist(), detections.iloc[1, 1:].tolist())
+
+    def test_perceptual_cache_fits_boxes_to_resized_copies(self):
+        model = FakeModel()
+        gradient = np.tile(np.linspace(0, 255, 64, dtype=np.uint8) ** 2 % 251, (32, 1)).astype(np.uint8)
+        with tempfile.TemporaryDirectory() as folder:
+            cv2.imwrite(os.path.join(folder, 'a.png'), cv2.cvtColor(gradient, cv2.COLOR_GRAY2BGR))
+            cv2.imwrite(os.path.join(folder, 'b.jpg'), cv2.resize(cv2.cvtColor(gradient, cv2.COLOR_GRAY2BGR), (128, 64), interpolation=cv2.INTER_NEAREST))
+
+            with tempfile.TemporaryDirectory() as cache_folder:
+                cache = DetectionCache(mode='perceptual', path=os.path.join(cache_folder, 'cache.sqlite'))
+                detect_objects(folder_path=folder, model=model, image_files=['a.png'], cache=cache)
+                cache.close()
+
+                # the cache is read back from disk
+                cache = DetectionCache(mode='perceptual', path=os.path.join(cache_folder, 'cache.sqlite'))
+                detections = detect_objects(folder_path=folder, model=model, image_files=['b.jpg'], cache=cache)
+                cache.close()
+
+        self.assertEqual(model.calls, [1])
+        self.assertEqual(detections[['x1', 'y1', 'x2', 'y2']].values.tolist(), [[2.0, 4.0, 6.0, 8.0]])
+
+    def test_batches_are_streamed_to_the_sink(self):
+        batches = []
+        with tempfile.TemporaryDirectory() as folder:
+            names = write_images(folder, 5)
+            detections = detect_objects(folder_path=folder, model=FakeModel(), image_files=names, batch_size=2, sink=batches.append)
+
+        self.assertTrue(detections.empty)
+        self.assertEqual(list(detections.columns), ['media_path', 'label', 'confidence', 'x1', 'y1', 'x2', 'y2'])
+        self.assertEqual([batch['media_path'].tolist() for batch in batches], [names[:2], names[2:4], names[4:]])
+        self.assertEqual(str(batches[0]['x1'].dtype), 'float32')
+
+    def test_parallel_shards_are_merged_in_order(self):
+        with tempfile.TemporaryDirectory() as folder:
+            names = write_images(folder, 13)
+            detections, stats = detect_objects_parallel(folder_path=folder, load_model=load_fake_model, image_files=names, processes=2, shard_size=3, threads=1, batch_size=2)
+
+        self.assertEqual(detections['media_path'].tolist(), names)
+        self.assertEqual(detections['confidence'].round().tolist(), [index * 10.0 for index in range(13)])
+        self.assertEqual(set(detections['label']), {'bottle-1', 'person-1'})
+        self.assertEqual(sum(worker_stats['images'] for worker_stats in stats.values()), 13)
+
+@unittest.skipUnless(LABELING_AVAILABLE, "torch and opencv are needed")
+class TestImageLoader(unittest.TestCase):
+    """
+    Unit tests for the ImageLoader class.
+    """
+
+    def test_loader_stops_early(self):
+        with tempfile.TemporaryDirectory() as folder:
+            names = write_images(folder, 10)
+            loader = ImageLoader(folder_path=folder, image_files=names, batch_size=1, workers=2, prefetch=1)
+
+            for size, (batch_files, images, scales, keys) in loader:
+                break
+
+        self.assertEqual(batch_files, names[:1])
+        self.assertEqual(images[0].shape, (8, 8, 3))
+
+@unittest.skipUnless(LABELING_AVAILABLE, "torch and opencv are needed")
+class TestIncrementalLabeling(unittest.TestCase):
+    """
+    Unit tests for the selection of the images that still need to be labeled.
+    """
+
+    def test_only_new_and_changed_images_are_selected(self):
+        with tempfile.TemporaryDirectory() as folder:
+            names = write_images(folder, 4)
+            manifest = DetectionManifest(os.path.join(folder, 'manifest.json'))
+            manifest.record(folder_path=folder, image_files=names[:3])
+
+            # a changed image is labeled again, an image the manifest doesn't know is skipped if it already has detections
+            cv2.imwrite(os.path.join(folder, names[1]), np.zeros((16, 16, 3), dtype=np.uint8))
+            new_name = "@a_new.jpg"
+            cv2.imwrite(os.path.join(folder, new_name), np.zeros((8, 8, 3), dtype=np.uint8))
+            selected = select_images(folder_path=folder, image_files=names + [new_name], manifest=DetectionManifest(manifest.path), labeled={names[3]})
+
+        self.assertEqual(selected, [names[1], new_name])
+
+    @unittest.skipUnless(DATABASE_AVAILABLE, "a local postgres server is needed")
+    def test_push_detections_replaces_labeled_images(self):
+        connection = {'host': TEST_DB['host'], 'port': TEST_DB['port'], 'username': TEST_DB['user_name'], 'password': TEST_DB['password'], 'database': TEST_DB['database_name']}
+        detections = pd.DataFrame({'media_path': ['a.jpg', 'a.jpg', 'b.jpg'], 'label': ['bottle', 'person', 'bottle'], 'confidence': [0.9, 0.8, 0.7], 'x1': [1.0] * 3, 'y1': [2.0] * 3, 'x2': [3.0] * 3, 'y2': [4.0] * 3})
+
+        with psycopg2.connect(host=TEST_DB['host'], port=TEST_DB['port'], user=TEST_DB['user_name'], password=TEST_DB['password'], database=TEST_DB['database_name']) as db:
+            with db.cursor() as cursor:
+                cursor.execute("DROP TABLE IF EXISTS image_detection")
+                cursor.execute("CREATE TABLE image_detection (media_path VARCHAR, label VARCHAR, confidence NUMERIC, x1 NUMERIC, y1 NUMERIC, x2 NUMERIC, y2 NUMERIC)")
+
+        self.assertTrue(push_detections(detections=detections, table_name='image_detection', **connection))
+        self.assertEqual(labeled_images(table_name='image_detection', **connection), {'a.jpg', 'b.jpg'})
+
+        # labeling a.jpg again replaces its two detections
+        self.assertTrue(push_detections(detections=detections.iloc[:1], table_name='image_detection', replace_paths=['a.jpg'], **connection))
+        with psycopg2.connect(host=TEST_DB['host'], port=TEST_DB['port'], user=TEST_DB['user_name'], password=TEST_DB['password'], database=TEST_DB['database_name']) as db:
+            with db.cursor() as cursor:
+                cursor.execute("SELECT media_path, label FROM image_detection ORDER BY media_path")
+                rows = cursor.fetchall()
+
+        self.assertEqual(rows, [('a.jpg', 'bottle'), ('b.jpg', 'bottle')])
+
+        # a chunk that fails to copy rolls back the chunks before it and the deletion of the replaced detections
+        pusher = DetectionPusher(table_name='image_detection', replace_paths=['a.jpg', 'b.jpg'], chunk_size=2, **connection)
+        pusher.write(detections)
+        pusher.write(detections.assign(confidence='not a number'))
+        pusher.write(detections)
+
+        self.assertEqual((pusher.pushed, pusher.failed, pusher.close()), (3, True, False))
+        self.assertEqual(labeled_images(table_name='image_detection', **connection), {'a.jpg', 'b.jpg'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,67 @@
-import unittest
-from scripts.data_cleaner import Preprocessor
+import os, re, tempfile, unittest
+from unittest import mock
+import pandas as pd
+from hypothesis import given, strategies as st
+from scripts.data_cleaner import Preprocessor, PreprocessorCache, preprocess_stream, _FIDEL_FOLDS, _LABIALIZED_REWRITES
+
+def legacy_normalize_data(text: str):
+    """
+    The original chain of re.sub calls that Preprocessor.normalize_data replaced, kept as a reference implementation.
+    """
+    rep1=re.sub('[ሃኅኃሐሓኻ]','ሀ',text)
+    rep2=re.sub('[ሑኁዅ]','ሁ',rep1)
+    rep3=re.sub('[ኂሒኺ]','ሂ',rep2)
+    rep4=re.sub('[ኌሔዄ]','ሄ',rep3)
+    rep5=re.sub('[ሕኅ]','ህ',rep4)
+    rep6=re.sub('[ኆሖኾ]','ሆ',rep5)
+    rep7=re.sub('[ሠ]','ሰ',rep6)
+    rep8=re.sub('[ሡ]','ሱ',rep7)
+    rep9=re.sub('[ሢ]','ሲ',rep8)
+    rep10=re.sub('[ሣ]','ሳ',rep9)
+    rep11=re.sub('[ሤ]','ሴ',rep10)
+    rep12=re.sub('[ሥ]','ስ',rep11)
+    rep13=re.sub('[ሦ]','ሶ',rep12)
+    rep14=re.sub('[ዓኣዐ]','አ',rep13)
+    rep15=re.sub('[ዑ]','ኡ',rep14)
+    rep16=re.sub('[ዒ]','ኢ',rep15)
+    rep17=re.sub('[ዔ]','ኤ',rep16)
+    rep18=re.sub('[ዕ]','እ',rep17)
+    rep19=re.sub('[ዖ]','ኦ',rep18)
+    rep20=re.sub('[ጸ]','ፀ',rep19)
+    rep21=re.sub('[ጹ]','ፁ',rep20)
+    rep22=re.sub('[ጺ]','ፂ',rep21)
+    rep23=re.sub('[ጻ]','ፃ',rep22)
+    rep24=re.sub('[ጼ]','ፄ',rep23)
+    rep25=re.sub('[ጽ]','ፅ',rep24)
+    rep26=re.sub('[ጾ]','ፆ',rep25)
+    #Normalizing words with Labialized Amharic characters such as በልቱዋል or  በልቱአል to  በልቷል  
+    rep27=re.sub('(ሉ[ዋአ])','ሏ',rep26)
+    rep28=re.sub('(ሙ[ዋአ])','ሟ',rep27)
+    rep29=re.sub('(ቱ[ዋአ])','ቷ',rep28)
+    rep30=re.sub('(ሩ[ዋአ])','ሯ',rep29)
+    rep31=re.sub('(ሱ[ዋአ])','ሷ',rep30)
+    rep32=re.sub('(ሹ[ዋአ])','ሿ',rep31)
+    rep33=re.sub('(ቁ[ዋአ])','ቋ',rep32)
+    rep34=re.sub('(ቡ[ዋአ])','ቧ',rep33)
+    rep35=re.sub('(ቹ[ዋአ])','ቿ',rep34)
+    rep36=re.sub('(ሁ[ዋአ])','ኋ',rep35)
+    rep37=re.sub('(ኑ[ዋአ])','ኗ',rep36)
+    rep38=re.sub('(ኙ[ዋአ])','ኟ',rep37)
+    rep39=re.sub('(ኩ[ዋአ])','ኳ',rep38)
+    rep40=re.sub('(ዙ[ዋአ])','ዟ',rep39)
+    rep41=re.sub('(ጉ[ዋአ])','ጓ',rep40)
+    rep42=re.sub('(ደ[ዋአ])','ዷ',rep41)
+    rep43=re.sub('(ጡ[ዋአ])','ጧ',rep42)
+    rep44=re.sub('(ጩ[ዋአ])','ጯ',rep43)
+    rep45=re.sub('(ጹ[ዋአ])','ጿ',rep44)
+    rep46=re.sub('(ፉ[ዋአ])','ፏ',rep45)
+    rep47=re.sub('[ቊ]','ቁ',rep46) #ቁ can be written as ቊ
+    rep48=re.sub('[ኵ]','ኩ',rep47) #ኩ can be also written as ኵ  
+
+    return rep48
+
+# every character the normalizer cares about plus the characters that can follow them
+NORMALIZER_ALPHABET = ''.join(sources for sources, _ in _FIDEL_FOLDS) + ''.join(_LABIALIZED_REWRITES) + 'ዋአሀሁ ል\n'
 
 class TestPreprocessor(unittest.TestCase):
     """
@@ -21,6 +83,15 @@ class TestPreprocessor(unittest.TestCase):
         expected_output = "ሀሀሀ ሁሁሁ አአአ"
         self.assertEqual(Preprocessor.normalize_data(text_to_normalize), expected_output)
 
+    @given(st.text(alphabet=st.sampled_from(NORMALIZER_ALPHABET) | st.characters()))
+    def test_normalize_data_matches_legacy(self, text):
+        self.assertEqual(Preprocessor.normalize_data(text), legacy_normalize_data(text))
+
+    def test_normalize_data_labialized(self):
+        text_to_normalize = "በልቱዋል በልቱአል ሉዓ ሑዋ ቊዋ ኵአ"
+        expected_output = "በልቷል በልቷል ሏ ኋ ቁዋ ኩአ"
+        self.assertEqual(Preprocessor.normalize_data(text_to_normalize), expected_output)
+
     def test_remove_extra_space(self):
         text_with_extra_space = "Hello     World!    \nThis is a test."
         expected_output = "Hello World! This is a test."
@@ -31,5 +102,126 @@ class TestPreprocessor(unittest.TestCase):
         expected_output = "Hello How are you ሀሀሀ ሁሁሁ አአአ"
         self.assertEqual(Preprocessor.preprocess_text(text_to_process), expected_output)
 
+    @given(st.lists(st.text(alphabet=st.sampled_from(NORMALIZER_ALPHABET + "😊🚀!።፤,. ") | st.characters())))
+    def test_preprocess_series_matches_preprocess_text(self, texts):
+        series = pd.Series(texts, dtype=object)
+        expected_output = [Preprocessor.preprocess_text(text) for text in texts]
+        self.assertEqual(Preprocessor.preprocess_series(series).tolist(), expected_output)
+
+    def test_preprocess_series_keeps_index(self):
+        series = pd.Series(["Hello 😊! How are you? ፤ ። ፣ ሃኅኃ ሑኁዅ ዓኣዐ", "በልቱዋል"], index=[3, 7])
+        result = Preprocessor.preprocess_series(series)
+        self.assertEqual(result.index.tolist(), [3, 7])
+        self.assertEqual(result.tolist(), ["Hello How are you ሀሀሀ ሁሁሁ አአአ", "በልቷል"])
+
+    def test_preprocess_parallel_keeps_order(self):
+        texts = [f"ሃ {index}! በልቱዋል 😊" for index in range(50)]
+        series = pd.Series(texts, index=range(100, 150))
+        result, stats = Preprocessor.preprocess_parallel(series, workers=2, chunksize=7)
+        self.assertEqual(result.index.tolist(), series.index.tolist())
+        self.assertEqual(result.tolist(), Preprocessor.preprocess_series(series).tolist())
+        self.assertEqual(sum(worker_stats['rows'] for worker_stats in stats.values()), 50)
+
+    def test_preprocess_stream(self):
+        data = pd.DataFrame({
+            'id': range(25),
+            'message': [None if index % 4 == 0 else f"ሃ {index}! በልቱዋል 😊" for index in range(25)]
+        })
+        expected_output = data.dropna(subset=['message'])
+        expected_output = expected_output.assign(message=Preprocessor.preprocess_series(expected_output['message']))
+
+        with tempfile.TemporaryDirectory() as folder:
+            path, out = os.path.join(folder, 'raw.csv'), os.path.join(folder, 'clean.csv')
+            data.to_csv(path, index=False)
+
+            for workers in (1, 2):
+                rows, _ = preprocess_stream(path=path, out=out, text_col='message', chunksize=6, workers=workers)
+                self.assertEqual(rows, len(expected_output))
+                self.assertEqual(pd.read_csv(out).values.tolist(), pd.read_csv(path).dropna(subset=['message']).assign(message=expected_output['message']).values.tolist())
+
+    def test_preprocess_stream_writes_one_header(self):
+        # the first chunk is empty once its missing messages are dropped
+        data = pd.DataFrame({'id': range(6), 'message': [None, None, None, "ሃ a", "b", "c"]})
+
+        with tempfile.TemporaryDirectory() as folder:
+            path, out = os.path.join(folder, 'raw.csv'), os.path.join(folder, 'clean.csv')
+            data.to_csv(path, index=False)
+            preprocess_stream(path=path, out=out, text_col='message', chunksize=3)
+            with open(out, encoding='utf-8') as file: lines = file.read().splitlines()
+
+        self.assertEqual(lines, ['id,message', '3,ሀ a', '4,b', '5,c'])
+
+    def test_preprocess_stream_parquet(self):
+        data = pd.DataFrame({'id': range(10), 'message': ["ሃ! በልቱዋል"] * 10, 'date': ['2024-01-01 00:00:00+00:00'] * 10})
+
+        with tempfile.TemporaryDirectory() as folder:
+            path, out = os.path.join(folder, 'raw.csv'), os.path.join(folder, 'clean.parquet')
+            data.to_csv(path, index=False)
+            preprocess_stream(path=path, out=out, text_col='message', chunksize=4)
+            result = pd.read_parquet(out)
+
+        self.assertEqual(result['message'].tolist(), ["ሀ በልቷል"] * 10)
+        self.assertEqual(str(result['id'].dtype), 'int64')
+        self.assertEqual(str(result['date'].dtype), 'datetime64[us, UTC]')
+
+class TestPreprocessorCache(unittest.TestCase):
+    """
+    Unit tests for the PreprocessorCache class.
+    """
+
+    def test_preprocess_series_matches_preprocessor(self):
+        series = pd.Series(["በልቱዋል 😊", "ሃኅኃ!", "በልቱዋል 😊", "ሃኅኃ!", "new"], index=[5, 6, 7, 8, 9])
+        groups = pd.Series(["@a", "@a", "@b", "@a", "@b"], index=series.index)
+        cache = PreprocessorCache(max_size=10)
+
+        result = cache.preprocess_series(series, groups=groups)
+
+        self.assertEqual(result.index.tolist(), series.index.tolist())
+        self.assertEqual(result.tolist(), Preprocessor.preprocess_series(series).tolist())
+        self.assertEqual((cache.hits, cache.misses), (2, 3))
+        self.assertEqual(cache.group_stats, {"@a": {"hits": 1, "misses": 2}, "@b": {"hits": 1, "misses": 1}})
+
+    def test_lru_eviction(self):
+        cache = PreprocessorCache(max_size=2)
+        for text in ["one", "two", "three"]: cache.preprocess_text(text)
+        self.assertEqual(list(cache.entries), [PreprocessorCache.hash_text("two"), PreprocessorCache.hash_text("three")])
+
+    def test_disk_cache_persists(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'cache.sqlite')
+            cache = PreprocessorCache(path=path)
+            cache.preprocess_text("በልቱዋል 😊", group="@a")
+            cache.close()
+
+            cache = PreprocessorCache(path=path)
+            self.assertEqual(cache.preprocess_text("በልቱዋል 😊", group="@a"), "በልቷል ")
+            self.assertEqual((cache.hits, cache.misses), (1, 0))
+            cache.close()
+
+    def test_disk_cache_misses_after_the_rules_change(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'cache.sqlite')
+            with mock.patch('scripts.data_cleaner._CACHE_SALT', b'older rules'):
+                cache = PreprocessorCache(path=path)
+                cache.preprocess_text("በልቱዋል 😊")
+                cache.close()
+
+            cache = PreprocessorCache(path=path)
+            cache.preprocess_text("በልቱዋል 😊")
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
+            cache.close()
+
+    def test_preprocess_stream_with_cache(self):
+        data = pd.DataFrame({'channel_username': ['@a', '@b'] * 10, 'message': ["ሃ! በልቱዋል", "ad 😊"] * 10})
+        cache = PreprocessorCache()
+
+        with tempfile.TemporaryDirectory() as folder:
+            path, out = os.path.join(folder, 'raw.csv'), os.path.join(folder, 'clean.csv')
+            data.to_csv(path, index=False)
+            preprocess_stream(path=path, out=out, text_col='message', chunksize=6, workers=2, cache=cache, group_col='channel_username')
+            self.assertEqual(pd.read_csv(out, keep_default_na=False)['message'].tolist(), ["ሀ በልቷል", "ad "] * 10)
+
+        self.assertEqual((cache.hits, cache.misses), (18, 2))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,124 @@
+import asyncio, json, os, queue, tempfile, unittest
+from scripts.data_pusher import DB_Client
+from scripts.pipeline import batch_rows, push_batches, run_pipeline
+from tests.data_pusher_test import DATABASE_AVAILABLE, TEST_DB, make_messages as make_cleaned_messages
+from tests.telegram_scrapper_test import FakeTelegramClient, make_messages
+
+class TestBatchRows(unittest.TestCase):
+    """
+    Unit tests for the batching of the scraped rows.
+    """
+
+    def test_batches_keep_callables_in_order(self):
+        batches = queue.Queue()
+
+        async def scrape():
+            rows = asyncio.Queue()
+            task = asyncio.create_task(batch_rows(rows, batches, batch_size=4, flush_interval=60))
+            for id in range(1, 7): await rows.put(['A', '@a', id, f"message {id}", None, None])
+            await rows.put(print)
+            await rows.put(['A', '@a', 7, "message 7", None, None])
+            await rows.put(None)
+            await task
+
+        asyncio.run(scrape())
+        items = [batches.get() for _ in range(batches.qsize())]
+
+        self.assertEqual([item['id'].tolist() for item in items[:2]], [[1, 2, 3, 4], [5, 6]])
+        self.assertIs(items[2], print)
+        self.assertEqual(items[3]['id'].tolist(), [7])
+        self.assertIsNone(items[4])
+
+    def test_batches_flush_after_interval(self):
+        batches = queue.Queue()
+
+        async def scrape():
+            rows = asyncio.Queue()
+            task = asyncio.create_task(batch_rows(rows, batches, batch_size=100, flush_interval=0.05))
+            await rows.put(['A', '@a', 1, "message 1", None, None])
+            await asyncio.sleep(0.2)
+            flushed = batches.qsize()
+            await rows.put(None)
+            await task
+            return flushed
+
+        self.assertEqual(asyncio.run(scrape()), 1)
+
+@unittest.skipUnless(DATABASE_AVAILABLE, "a local postgres server is needed")
+class TestPipeline(unittest.TestCase):
+    """
+    Unit tests for the streaming pipeline, run against a fake telegram client and the local postgres test database.
+    """
+
+    def setUp(self):
+        self.client = DB_Client(**TEST_DB)
+        self.client.cursor.execute("DROP TABLE IF EXISTS message, channel")
+        self.client.cursor.execute("CREATE TABLE channel (id VARCHAR PRIMARY KEY, username VARCHAR, title VARCHAR)")
+        self.client.cursor.execute(
+            "CREATE TABLE message (id VARCHAR PRIMARY KEY, channel_id VARCHAR, telegram_id INTEGER, message VARCHAR, media_path VARCHAR, date DATE)"
+        )
+        self.client.connection.commit()
+
+    def tearDown(self):
+        self.client.close()
+
+    def query(self, query: str):
+        self.client.cursor.execute(query)
+        return self.client.cursor.fetchall()
+
+    def test_run_pipeline_streams_to_the_database(self):
+        channels = {"@a": make_messages(1200), "@b": make_messages(30)}
+        channels["@b"][0].message = "ምርት 😀 ዋጋ!!"
+        client = FakeTelegramClient(channels)
+
+        with tempfile.TemporaryDirectory() as folder:
+            stats = asyncio.run(run_pipeline(client, list(channels), self.client, folder, push_batch_size=64, queue_size=2))
+
+            # the second run only fetches and pushes the messages posted since the first
+            client.channels["@a"] = make_messages(1250)
+            asyncio.run(run_pipeline(client, list(channels), self.client, folder, push_batch_size=64, queue_size=2))
+
+            with open(os.path.join(folder, 'scrape_state.json')) as file: state = json.load(file)
+
+        self.assertEqual(stats['pushed'], 1030)
+        self.assertEqual(
+            self.query("SELECT c.username, COUNT(*), MIN(m.telegram_id), MAX(m.telegram_id) FROM message m JOIN channel c ON c.id = m.channel_id GROUP BY c.username ORDER BY c.username"),
+            [('@a', 1050, 201, 1250), ('@b', 30, 1, 30)]
+        )
+        self.assertEqual(self.query("SELECT message FROM message WHERE telegram_id = 30 AND message LIKE 'ም%'"), [("ምርት ዋጋ",)])
+        self.assertEqual(state["@a"], {"last_id": 1250, "oldest_id": 201})
+
+    def test_incremental_run_spanning_several_batches(self):
+        channels = {"@a": make_messages(100)}
+        client = FakeTelegramClient(channels)
+
+        with tempfile.TemporaryDirectory() as folder:
+            asyncio.run(run_pipeline(client, list(channels), self.client, folder, push_batch_size=16, queue_size=2))
+
+            # the 50 new messages are pushed newest first over several batches
+            client.channels["@a"] = make_messages(150)
+            stats = asyncio.run(run_pipeline(client, list(channels), self.client, folder, push_batch_size=16, queue_size=2))
+
+            with open(os.path.join(folder, 'scrape_state.json')) as file: state = json.load(file)
+
+        self.assertEqual(stats['pushed'], 50)
+        self.assertEqual(self.query("SELECT COUNT(*), MIN(telegram_id), MAX(telegram_id) FROM message"), [(150, 1, 150)])
+        self.assertEqual(state["@a"]["last_id"], 150)
+
+    def test_failed_batches_hold_the_checkpoints_back(self):
+        stats = {'pushed': 0, 'batches': 0, 'push_seconds': 0.0}
+        checkpoints = []
+        good, bad = make_cleaned_messages('@a', 3), make_cleaned_messages('@b', 2).assign(date='not a date')
+
+        cleaned = queue.Queue()
+        for item in [good, lambda: checkpoints.append('@a'), bad, lambda: checkpoints.append('@b'), good, None]: cleaned.put(item)
+        push_batches(cleaned, self.client, stats)
+
+        # the second push of the good batch skips the stored messages
+        self.assertEqual(checkpoints, ['@a'])
+        self.assertEqual((stats['pushed'], stats['batches']), (3, 2))
+        self.assertEqual(self.query("SELECT COUNT(*) FROM message"), [(3,)])
+        self.assertEqual(self.query("SELECT username FROM channel"), [('@a',)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import csv, io, json, os, subprocess, sys, unittest
+from unittest import mock
+from datetime import date
+from tests.data_pusher_test import DATABASE_AVAILABLE, TEST_DB
+
+# the api reads its connection string from the environment when it's imported, it's pointed at the test database
+if DATABASE_AVAILABLE:
+    os.environ['CONNECTION_STRING'] = f"postgresql+psycopg2://{TEST_DB['user_name']}:{TEST_DB['password']}@{TEST_DB['host']}:{TEST_DB['port']}/{TEST_DB['database_name']}"
+    from sqlalchemy import text
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from database import engine, async_engine, SessionLocal
+    from cache import response_cache
+    import models, main
+
+@unittest.skipUnless(DATABASE_AVAILABLE, "a local postgres server is needed")
+class TestListRoutes(unittest.TestCase):
+    """
+    Tests for the pagination and the filters of the list endpoints, run against the test database.
+    """
+
+    def setUp(self):
+        # the scripts create tables with the same names, they are dropped first
+        with engine.begin() as connection:
+            for table in models.Base.metadata.sorted_tables: connection.execute(text(f"DROP TABLE IF EXISTS {table.name} CASCADE"))
+        models.Base.metadata.create_all(bind=engine)
+        response_cache.invalidate()
+
+        with SessionLocal() as db:
+            db.add_all([
+                models.Message(id=f"m{index:02d}", channel_id='c1' if index % 2 else 'c2', telegram_id=index, message=f"message {index}", media_path=None, date=date(2024, 1, index + 1))
+                for index in range(10)
+            ])
+            db.add_all([models.ProductPricesTransformed(id=f"p{index}", channel_id='c1', price=index) for index in range(3)])
+            db.add_all([models.Channel(id='c1', username='@DoctorsET', title='Doctors Ethiopia ዶክተሮች'), models.Channel(id='c2', username='@yetenaweg', title='Yetena "Weg"')])
+            db.add(models.ImageDetection(media_path='@DoctorsET_1.jpg', label='bottle', confidence=0.8125, x1=1.5, x2=30, y1=2, y2=40.25))
+            db.add(models.PhoneNumbersTransformed(id='n1', channel_id='c1', price='0911 234567'))
+            db.commit()
+
+        self.client = TestClient(self.make_app()).__enter__()
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+        models.Base.metadata.drop_all(bind=engine)
+
+    def make_app(self):
+        """
+        Returns the app under test.
+        """
+        return main.app
+
+    def pages(self, url: str, **params):
+        """
+        Follows the cursors of an endpoint, returns the ids of every page.
+        """
+        pages, cursor = [], None
+        while True:
+            response = self.client.get(url, params={**params, **({'cursor': cursor} if cursor else {})})
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            pages.append([item['id'] for item in body['items']])
+            cursor = body['next_cursor']
+            if cursor is None: return pages
+
+    def test_pages_follow_the_cursor(self):
+        pages = self.pages('/messages/', limit=4)
+
+        self.assertEqual(pages, [[f"m{index:02d}" for index in range(start, min(start + 4, 10))] for start in range(0, 10, 4)])
+
+    def test_filters_are_combined(self):
+        pages = self.pages('/messages/', limit=2, channel_id='c1', date_from='2024-01-03', date_to='2024-01-08')
+
+        self.assertEqual(pages, [['m03', 'm05'], ['m07']])
+
+    def test_limits_and_cursors_are_validated(self):
+        self.assertEqual(self.client.get('/messages/', params={'limit': 0}).status_code, 422)
+        self.assertEqual(self.client.get('/messages/', params={'limit': 1001}).status_code, 422)
+        self.assertEqual(self.client.get('/messages/', params={'cursor': 'not a cursor'}).status_code, 400)
+
+    def test_channel_routes_are_paginated(self):
+        self.assertEqual(self.pages('/product-prices/c1', limit=2), [['p0', 'p1'], ['p2']])
+        self.assertEqual(self.client.get('/product-prices/c2').status_code, 404)
+
+    def test_images_with_several_detections_are_paged(self):
+        with SessionLocal() as db:
+            db.add_all([models.ImageDetection(media_path=path, label='bottle', confidence=confidence, x1=0, x2=1, y1=0, y2=1)
+                        for path, confidence in [('a.jpg', 0.1), ('a.jpg', 0.2), ('a.jpg', 0.3), ('b.jpg', 0.4), ('c.jpg', 0.5)]])
+            db.commit()
+
+        detections, cursor = [], None
+        while True:
+            body = self.client.get('/image-detection/', params={'limit': 2, **({'cursor': cursor} if cursor else {})}).json()
+            detections += [(item['media_path'], item['confidence']) for item in body['items']]
+            cursor = body['next_cursor']
+            if cursor is None: break
+
+        self.assertEqual(detections, [('@DoctorsET_1.jpg', 0.8125), ('a.jpg', 0.1), ('a.jpg', 0.2), ('a.jpg', 0.3), ('b.jpg', 0.4), ('c.jpg', 0.5)])
+        self.assertEqual([item['confidence'] for item in self.client.get('/object-detection/a.jpg').json()], [0.1, 0.2, 0.3])
+
+    def test_fast_json_matches_the_response_models(self):
+        urls = ['/messages/?limit=3', '/messages/?channel_id=c2&limit=2', '/channels/', '/image-detection/', '/product-prices-transformed/',
+                '/phone-numbers-transformed/', '/products-transformed/', '/phone-numbers/c1', '/product-prices/c1?limit=2', '/object-detection/@DoctorsET_1.jpg']
+        expected = [self.client.get(url) for url in urls]
+
+        response_cache.invalidate()
+        with mock.patch('routes.FAST_JSON', True):
+            responses = [self.client.get(url) for url in urls]
+
+        for url, response, expected_response in zip(urls, responses, expected):
+            self.assertEqual(expected_response.status_code, 200, url)
+            self.assertEqual(response.content, expected_response.content, url)
+            self.assertEqual(response.headers['content-type'], expected_response.headers['content-type'], url)
+
+    def test_messages_are_exported_as_ndjson(self):
+        response = self.client.get('/messages/export', params={'channel_id': 'c2', 'date_to': '2024-01-05'})
+        rows = [json.loads(line) for line in response.text.splitlines()]
+
+        self.assertEqual(response.headers['content-type'], 'application/x-ndjson')
+        self.assertEqual([row['id'] for row in rows], ['m00', 'm02', 'm04'])
+        self.assertEqual(rows[0], self.client.get('/messages/', params={'limit': 1}).json()['items'][0])
+
+    def test_prices_are_exported_as_csv(self):
+        response = self.client.get('/product-prices-transformed/export', params={'format': 'csv'})
+
+        self.assertTrue(response.headers['content-type'].startswith('text/csv'))
+        self.assertEqual(list(csv.reader(io.StringIO(response.text))), [['id', 'channel_id', 'price'], ['p0', 'c1', '0.0'], ['p1', 'c1', '1.0'], ['p2', 'c1', '2.0']])
+        self.assertEqual(self.client.get('/channels/export', params={'format': 'xml'}).status_code, 422)
+
+@unittest.skipUnless(DATABASE_AVAILABLE and async_engine is not None, "a local postgres server and asyncpg are needed")
+class TestAsyncListRoutes(TestListRoutes):
+    """
+    Runs the tests of the list endpoints against the async routes.
+    """
+
+    def tearDown(self):
+        # the pooled asyncpg connections belong to the event loop of the client, they are closed before it stops
+        self.client.portal.call(async_engine.dispose)
+        super().tearDown()
+
+    def make_app(self):
+        from async_routes import router
+        app = FastAPI()
+        app.include_router(router)
+        return app
+
+class TestDatabaseMode(unittest.TestCase):
+    """
+    Tests that the app refuses to start in a database mode it can't serve, each run in a fresh interpreter.
+    """
+
+    def start_app(self, mode: str, code: str='import main'):
+        src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+        env = {**os.environ, 'DATABASE_MODE': mode, 'CONNECTION_STRING': 'postgresql+psycopg2://nobody@localhost:1/none'}
+        return subprocess.run([sys.executable, '-c', code], cwd=src, env=env, capture_output=True, text=True)
+
+    def test_unknown_modes_are_rejected(self):
+        result = self.start_app('asynch')
+
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("DATABASE_MODE must be 'sync' or 'async', not 'asynch'", result.stderr)
+
+    def test_async_mode_needs_asyncpg(self):
+        # asyncpg is hidden, as if it wasn't installed
+        result = self.start_app('async', code="import sys; sys.modules['asyncpg'] = None; import main")
+
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("DATABASE_MODE=async needs asyncpg", result.stderr)
+
+if __name__ == '__main__':
+    unittest.main()
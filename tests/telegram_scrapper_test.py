@@ -0,0 +1,191 @@
+import asyncio, csv, json, os, tempfile, unittest
+import pandas as pd
+from datetime import datetime
+from types import SimpleNamespace
+from telethon.errors import FloodWaitError
+from scripts.telegram_scrapper import obtain_channel_ads, MediaDownloader
+
+class FakeTelegramClient:
+    """
+    A stand-in for telethon.TelegramClient that serves messages from memory.
+
+    Attributes:
+        channels(dict): the messages of every channel username, newest first
+        flood_waits(dict): the id of the message iter_messages raises a FloodWaitError at once, for every channel username
+        download_failures(dict): the number of times download_media fails before it succeeds, for every media path
+    """
+
+    def __init__(self, channels: dict, flood_waits: dict=None, download_failures: dict=None):
+        self.channels = channels
+        self.flood_waits = dict(flood_waits or {})
+        self.download_failures = dict(download_failures or {})
+        self.downloads = []
+        self.active = 0
+        self.max_active = 0
+
+    async def start(self):
+        pass
+
+    async def get_entity(self, channel_username: str):
+        return SimpleNamespace(title=channel_username.strip('@').title(), username=channel_username)
+
+    async def iter_messages(self, entity, limit: int=None, offset_id: int=0, min_id: int=0, **kwargs):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            sent = 0
+            for message in self.channels[entity.username]:
+                if offset_id and message.id >= offset_id: continue
+                if message.id <= min_id: break
+                if limit is not None and sent >= limit: break
+                if self.flood_waits.get(entity.username) == message.id:
+                    del self.flood_waits[entity.username]
+                    raise FloodWaitError(request=None, capture=0)
+                await asyncio.sleep(0)
+                yield message
+                sent += 1
+        finally:
+            self.active -= 1
+
+    async def download_media(self, media, path: str):
+        self.downloads.append(path)
+        if self.download_failures.get(path, 0) > 0:
+            self.download_failures[path] -= 1
+            with open(path, 'wb') as file: file.write(b'j')
+            raise ConnectionError("download interrupted")
+        await asyncio.sleep(0)
+        with open(path, 'wb') as file: file.write(b'jpg')
+        return path
+
+def make_messages(count: int, with_photos: bool=False):
+    """
+    Creates fake messages with ids from count down to 1.
+    """
+    return [
+        SimpleNamespace(id=id, message=f"message {id}", date=datetime(2024, 1, 1), media=SimpleNamespace(photo=True) if with_photos and id % 2 else None)
+        for id in range(count, 0, -1)
+    ]
+
+class TestTelegramScrapper(unittest.TestCase):
+    """
+    Unit tests for the telegram scrapper, run against a fake telegram client.
+    """
+
+    def read_rows(self, folder: str):
+        with open(os.path.join(folder, 'telegram_data.csv'), encoding='utf-8') as file:
+            return list(csv.DictReader(file))
+
+    def test_obtain_channel_ads_concurrent(self):
+        channels = {f"@channel{index}": make_messages(30) for index in range(6)}
+        client = FakeTelegramClient(channels)
+
+        with tempfile.TemporaryDirectory() as folder:
+            asyncio.run(obtain_channel_ads(client, list(channels), folder, concurrency=3))
+            rows = self.read_rows(folder)
+
+        self.assertEqual(len(rows), 6 * 30)
+        self.assertEqual(client.max_active, 3)
+        for channel in channels:
+            ids = [int(row['id']) for row in rows if row['channel_username'] == channel]
+            self.assertEqual(ids, list(range(30, 0, -1)))
+
+    def test_obtain_channel_ads_flood_wait_resumes(self):
+        channels = {"@a": make_messages(10), "@b": make_messages(5)}
+        client = FakeTelegramClient(channels, flood_waits={"@a": 6})
+
+        with tempfile.TemporaryDirectory() as folder:
+            asyncio.run(obtain_channel_ads(client, list(channels), folder, concurrency=2, max_retries=1))
+            rows = self.read_rows(folder)
+
+        ids = [int(row['id']) for row in rows if row['channel_username'] == "@a"]
+        self.assertEqual(ids, list(range(10, 0, -1)))
+
+    def test_obtain_channel_ads_downloads_photos(self):
+        channels = {"@a": make_messages(10, with_photos=True)}
+        client = FakeTelegramClient(channels)
+
+        with tempfile.TemporaryDirectory() as folder:
+            # a photo that is already on disk isn't downloaded again
+            os.makedirs(os.path.join(folder, 'media'))
+            open(os.path.join(folder, 'media', '@a_9.jpg'), 'wb').close()
+
+            downloader = asyncio.run(obtain_channel_ads(client, list(channels), folder, download_workers=2))
+            rows = self.read_rows(folder)
+            media = sorted(os.listdir(os.path.join(folder, 'media')))
+
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(media, sorted(f"@a_{id}.jpg" for id in range(1, 10, 2)))
+        self.assertEqual(downloader.stats, {'queued': 4, 'finished': 4, 'failed': 0, 'skipped': 1})
+        self.assertEqual([row['media_path'] != '' for row in rows], [id % 2 == 1 for id in range(10, 0, -1)])
+
+    def test_obtain_channel_ads_incremental(self):
+        with tempfile.TemporaryDirectory() as folder:
+            client = FakeTelegramClient({"@a": make_messages(1200)})
+            asyncio.run(obtain_channel_ads(client, ["@a"], folder))
+            self.assertEqual(len(self.read_rows(folder)), 1000)
+
+            # only the messages posted since the last run are fetched and appended
+            client.channels["@a"] = make_messages(1250)
+            asyncio.run(obtain_channel_ads(client, ["@a"], folder))
+            rows = self.read_rows(folder)
+
+            with open(os.path.join(folder, 'scrape_state.json')) as file: state = json.load(file)
+
+        self.assertEqual([int(row['id']) for row in rows[1000:]], list(range(1250, 1200, -1)))
+        self.assertEqual(state, {"@a": {"last_id": 1250, "oldest_id": 201}})
+
+    def test_obtain_channel_ads_backfill_resumes(self):
+        with tempfile.TemporaryDirectory() as folder:
+            client = FakeTelegramClient({"@a": make_messages(1100)}, flood_waits={"@a": 50})
+
+            # the first run gets the latest 1000 messages and a batch and a half of history, then gives up on a flood wait
+            asyncio.run(obtain_channel_ads(client, ["@a"], folder, backfill=True, batch_size=40, max_retries=0))
+            self.assertEqual(len(self.read_rows(folder)), 1050)
+
+            asyncio.run(obtain_channel_ads(client, ["@a"], folder, backfill=True, batch_size=40))
+            rows = self.read_rows(folder)
+
+            with open(os.path.join(folder, 'scrape_state.json')) as file: state = json.load(file)
+
+        self.assertEqual([int(row['id']) for row in rows], list(range(1100, 0, -1)))
+        self.assertEqual(state, {"@a": {"last_id": 1100, "oldest_id": 1, "backfill_done": True}})
+
+    def test_obtain_channel_ads_parquet(self):
+        client = FakeTelegramClient({"@a": make_messages(10), "@b": make_messages(5)})
+
+        with tempfile.TemporaryDirectory() as folder:
+            asyncio.run(obtain_channel_ads(client, ["@a", "@b"], folder, output_format='parquet'))
+            client.channels["@a"] = make_messages(12)
+            asyncio.run(obtain_channel_ads(client, ["@a", "@b"], folder, output_format='parquet'))
+
+            data = pd.read_parquet(os.path.join(folder, 'telegram_data'))
+
+        self.assertEqual(len(data), 17)
+        self.assertEqual(str(data['id'].dtype), 'int64')
+        self.assertEqual(str(data['date'].dtype), 'datetime64[us, UTC]')
+
+class TestMediaDownloader(unittest.IsolatedAsyncioTestCase):
+    """
+    Unit tests for the MediaDownloader class.
+    """
+
+    async def test_retries_then_fails(self):
+        with tempfile.TemporaryDirectory() as folder:
+            flaky, broken = os.path.join(folder, 'flaky.jpg'), os.path.join(folder, 'broken.jpg')
+            client = FakeTelegramClient({}, download_failures={flaky + '.part': 2, broken + '.part': 5})
+            downloader = MediaDownloader(client, workers=2, max_retries=2, retry_delay=0)
+            downloader.start()
+
+            await downloader.submit(None, flaky)
+            await downloader.submit(None, broken)
+            await downloader.close()
+
+            # the interrupted downloads leave no truncated photo behind
+            self.assertEqual(sorted(os.listdir(folder)), ['flaky.jpg'])
+
+        self.assertEqual(downloader.stats, {'queued': 2, 'finished': 1, 'failed': 1, 'skipped': 0})
+        self.assertEqual(client.downloads.count(flaky + '.part'), 3)
+        self.assertEqual(client.downloads.count(broken + '.part'), 3)
+
+if __name__ == '__main__':
+    unittest.main()
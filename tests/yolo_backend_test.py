@@ -0,0 +1,106 @@
+import json, os, tempfile, unittest
+import numpy as np
+
+# the backend needs torch and opencv, the tests are skipped where they aren't installed
+try:
+    import torch, cv2
+    from scripts.label_images import detect_objects
+    from scripts.yolo_backend import LocalDetector, letterbox, non_max_suppression
+    BACKEND_AVAILABLE = True
+except ImportError:
+    BACKEND_AVAILABLE = False
+
+try:
+    import onnx, onnxruntime
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+
+NAMES = {0: 'bottle', 1: 'person'}
+
+# the raw predictions of the fake model on a 640x640 square: a box, an overlapping weaker box of the same class,
+# the same box for another class and a box below the confidence threshold
+PREDICTIONS = [
+    [320.0, 320.0, 100.0, 100.0, 0.9, 0.9, 0.1],
+    [322.0, 320.0, 100.0, 100.0, 0.8, 0.9, 0.1],
+    [320.0, 320.0, 100.0, 100.0, 0.9, 0.1, 0.8],
+    [100.0, 100.0, 50.0, 50.0, 0.1, 0.9, 0.1],
+]
+
+if BACKEND_AVAILABLE:
+    class FakeYolo(torch.nn.Module):
+        """
+        A stand-in for an exported YOLOv5 model that predicts the same anchors for every image.
+        """
+
+        def __init__(self):
+            super().__init__()
+            self.register_buffer('predictions', torch.tensor(PREDICTIONS))
+
+        def forward(self, images: torch.Tensor):
+            return (self.predictions.expand(images.shape[0], -1, -1) + images.mean() * 0,)
+
+def write_image(folder: str):
+    """
+    Writes a 320x160 image and returns its name.
+    """
+    cv2.imwrite(os.path.join(folder, 'wide.jpg'), np.full((160, 320, 3), 50, dtype=np.uint8))
+    return 'wide.jpg'
+
+@unittest.skipUnless(BACKEND_AVAILABLE, "torch and opencv are needed")
+class TestLocalDetector(unittest.TestCase):
+    """
+    Unit tests for the local YOLOv5 backend, run against fake exported models.
+    """
+
+    # the first and third prediction mapped back onto the 320x160 image, which is letterboxed with a ratio of 2 and 160 pixels of padding on top
+    EXPECTED = [[135.0, 55.0, 185.0, 105.0, 0.81, 0.0], [135.0, 55.0, 185.0, 105.0, 0.72, 1.0]]
+
+    def assertBoxes(self, boxes: torch.Tensor):
+        self.assertEqual(np.round(boxes.numpy().astype(float), 2).tolist(), self.EXPECTED)
+
+    def test_letterbox_pads_to_a_square(self):
+        image, ratio, pad = letterbox(np.zeros((160, 320, 3), dtype=np.uint8), size=640)
+
+        self.assertEqual((image.shape, ratio, pad), ((640, 640, 3), 2.0, (0, 160)))
+        self.assertEqual(int(image[0, 0, 0]), 114)
+
+    def test_non_max_suppression_keeps_other_classes(self):
+        boxes = non_max_suppression(torch.tensor(PREDICTIONS))
+
+        self.assertEqual(boxes[:, 5].tolist(), [0.0, 1.0])
+
+    def test_torchscript_model(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'yolov5s.torchscript')
+            config = {'shape': [1, 3, 640, 640], 'stride': 32, 'names': NAMES}
+            torch.jit.save(torch.jit.script(FakeYolo()), path, _extra_files={'config.txt': json.dumps(config)})
+
+            model = LocalDetector(path)
+            image_file = write_image(folder)
+            detections = detect_objects(folder_path=folder, model=model, image_files=[image_file])
+
+        self.assertEqual(model.names, NAMES)
+        self.assertEqual(detections['label'].tolist(), ['bottle', 'person'])
+        self.assertEqual(detections[['x1', 'y1', 'x2', 'y2']].round(2).values.tolist(), [row[:4] for row in self.EXPECTED])
+
+    @unittest.skipUnless(ONNX_AVAILABLE, "onnx and onnxruntime are needed")
+    def test_onnx_model_with_a_fixed_batch_size(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'yolov5s.onnx')
+            torch.onnx.export(FakeYolo(), torch.zeros(2, 3, 640, 640), path, input_names=['images'], dynamo=False)
+
+            # record the class names like the YOLOv5 export does
+            exported = onnx.load(path)
+            exported.metadata_props.add(key='names', value=str(NAMES))
+            onnx.save(exported, path)
+
+            model = LocalDetector(path)
+            results = model([np.full((160, 320, 3), 50, dtype=np.uint8)] * 3)
+
+        self.assertEqual((model.batch_size, model.names), (2, NAMES))
+        self.assertEqual(len(results.xyxy), 3)
+        for boxes in results.xyxy: self.assertBoxes(boxes)
+
+if __name__ == '__main__':
+    unittest.main()